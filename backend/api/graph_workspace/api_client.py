@@ -0,0 +1,141 @@
+"""
+api_client.py
+
+Async client for the bot's control-plane calls to the FlowCord API
+"""
+import asyncio
+import json
+import os
+import pathlib
+import random
+import tempfile
+from typing import Any, List, Optional
+
+import aiohttp
+
+from .graph_runner import FLOW_INPUT, FLOW_OUTPUT
+from .scheduler import SCHEDULE
+from .triggers import EVENT_TRIGGERS
+
+API_BASE_URL = os.environ.get('API_BASE_URL', "http://127.0.0.1:8000")
+
+# Last flow set we got from the API, used to boot without waiting on it
+FLOW_SNAPSHOT_PATH = pathlib.Path(
+    os.environ.get('FLOW_SNAPSHOT_PATH', pathlib.Path(tempfile.gettempdir()) / "flowcord_flows.json")
+)
+
+# Bots only need flows with a trigger, or that a triggered flow can call
+FLOWS_PATH = "/api/flows/?uses_any=" + ",".join(("__slash__", *EVENT_TRIGGERS, SCHEDULE, FLOW_INPUT, FLOW_OUTPUT))
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FlowClient:
+    """Pooled aiohttp client with timeouts, retries and conditional GETs"""
+
+    def __init__(
+        self,
+        base_url: str = API_BASE_URL,
+        *,
+        snapshot_path: Optional[pathlib.Path] = FLOW_SNAPSHOT_PATH,
+        timeout: float = 10.0,
+        retries: int = 4,
+        backoff: float = 0.5,
+        pool_size: int = 10,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.snapshot_path = snapshot_path
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+
+        self.etag: Optional[str] = None
+        self.flows: Optional[List[dict]] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    # ---------------  Requests ----------------------------------
+
+    async def get(self, path: str, *, headers: Optional[dict] = None) -> aiohttp.ClientResponse:
+        """GET *path*, retrying connection errors and 429/5xx with jittered backoff
+
+        The body is read before returning, so the response can be used after
+        its connection went back to the pool.
+        """
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            last_try = attempt == self.retries
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status in _RETRY_STATUSES and not last_try:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    await response.read()
+                    return response
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError):
+                if last_try:
+                    raise
+            delay = self.backoff * 2 ** attempt
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+        raise AssertionError("unreachable")
+
+    async def fetch_flows(self) -> Optional[List[dict]]:
+        """Return every flow a bot can run (see :data:`FLOWS_PATH`), or ``None``
+        if nothing changed since the last call"""
+        headers = {"If-None-Match": self.etag} if self.etag and self.flows is not None else None
+        response = await self.get(FLOWS_PATH, headers=headers)
+        if response.status == 304:
+            return None
+        response.raise_for_status()
+
+        self.flows = await response.json()
+        self.etag = response.headers.get("ETag")
+        try:
+            await asyncio.to_thread(self._save_snapshot)
+        except OSError as exc:
+            print(f"Could not save the flow snapshot: {exc!r}")  # only costs a slower boot
+        return self.flows
+
+    # ---------------  On-disk snapshot --------------------------
+
+    def load_snapshot(self) -> Optional[List[dict]]:
+        """Flows from the last successful fetch, or ``None`` if there are none"""
+        if self.snapshot_path is None:
+            return None
+        try:
+            data: Any = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        self.flows = data["flows"]
+        self.etag = data.get("etag")
+        return self.flows
+
+    def _save_snapshot(self) -> None:
+        if self.snapshot_path is None:
+            return
+        # a temp file of our own: several bots in one process share the snapshot path
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.snapshot_path.parent, prefix=self.snapshot_path.name,
+            suffix=".tmp", delete=False,
+        ) as tmp:
+            json.dump({"etag": self.etag, "flows": self.flows}, tmp)
+        try:
+            os.replace(tmp.name, self.snapshot_path)
+        except OSError:
+            os.unlink(tmp.name)
+            raise
@@ -0,0 +1,378 @@
+"""
+benchmarks.py
+
+Benchmark suite for the graph runner and component introspection.
+
+Run from the ``backend`` directory::
+
+    python -m api.graph_workspace.benchmarks              # full suite (10 … 100k nodes)
+    python -m api.graph_workspace.benchmarks --quick      # small sizes only
+    python -m api.graph_workspace.benchmarks --save-baseline
+    python -m api.graph_workspace.benchmarks --check      # exit 1 on regressions
+
+Baselines are machine specific, so they are written next to this file and
+ignored by git rather than committed.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+import types
+from typing import Any, Callable, Dict, List, Optional
+
+from . import instrumentation
+from .blocks import BlockRegistry, _component_schema, block
+from .graph_runner import clear_plan_cache, compile_graph, run_graph
+
+DEFAULT_BASELINE = pathlib.Path(__file__).with_name("benchmark_baseline.json")
+
+# Seconds each ``fake_discord_call`` waits, standing in for a Discord round trip
+SIMULATED_LATENCY = 0.0
+
+
+@block("Identity", sink=False)
+def identity(value: Any = None, **_: Any) -> Any:
+    """Pass a value through unchanged
+
+    :param value: any value
+    :return: the same value
+    """
+    return value
+
+
+@block("Fake Discord Call", sink=True)
+async def fake_discord_call(value: Any = None, **_: Any) -> Any:
+    """Wait like an HTTP call to Discord would
+
+    :param value: any value
+    :return: the same value
+    """
+    await asyncio.sleep(SIMULATED_LATENCY)
+    return value
+
+
+# ---------------  Synthetic flows ---------------------------
+
+def _node(node_id: str, code_id: str, ports: List[str]) -> Dict[str, Any]:
+    return {
+        "id": node_id,
+        "code_id": code_id,
+        "label": node_id,
+        "inputs": [{"name": p} for p in ports],
+        "outputs": [{"name": "output"}],
+    }
+
+
+def _edge(source: str, target: str, port: str = "value") -> Dict[str, Any]:
+    return {"sourceId": source, "sourcePort": "output", "targetId": target, "targetPort": port}
+
+
+def chain_flow(size: int, fan_in: int = 1) -> Dict[str, Any]:
+    """Build a chain of *size* identity nodes.
+
+    Every node has *fan_in* input ports, each fed by one of the previous
+    *fan_in* nodes, giving roughly ``size * fan_in`` edges.
+    """
+
+    nodes: List[Dict[str, Any]] = []
+    edges: List[Dict[str, Any]] = []
+    for i in range(size):
+        ports = ["value"] + [f"in{k}" for k in range(1, min(fan_in, i))]
+        nodes.append(_node(f"n{i}", "identity", ports))
+        for k, port in enumerate(ports, start=1):
+            if i - k >= 0:
+                edges.append(_edge(f"n{i - k}", f"n{i}", port))
+    return {"nodes": nodes, "edges": edges, "constants": {"n0.value": 0}}
+
+
+def fanout_flow(size: int) -> Dict[str, Any]:
+    """One identity node feeding ``size - 1`` independent simulated Discord calls."""
+
+    nodes = [_node("root", "identity", ["value"])]
+    edges: List[Dict[str, Any]] = []
+    for i in range(1, size):
+        nodes.append(_node(f"n{i}", "fake_discord_call", ["value"]))
+        edges.append(_edge("root", f"n{i}"))
+    return {"nodes": nodes, "edges": edges, "constants": {"root.value": 0}}
+
+
+def diamond_flow(size: int, width: int = 8) -> Dict[str, Any]:
+    """Stacked diamonds: a join node fans out to *width* simulated Discord
+    calls which all feed the next join, repeated up to *size* nodes."""
+
+    nodes = [_node("j0", "identity", ["value"])]
+    edges: List[Dict[str, Any]] = []
+    layer = 0
+    while len(nodes) + width + 1 <= size:
+        join = f"j{layer + 1}"
+        ports = [f"in{k}" for k in range(width)]
+        for k, port in enumerate(ports):
+            mid = f"l{layer}_{k}"
+            nodes.append(_node(mid, "fake_discord_call", ["value"]))
+            edges.append(_edge(f"j{layer}", mid))
+            edges.append(_edge(mid, join, port))
+        nodes.append(_node(join, "identity", ports))
+        layer += 1
+    return {"nodes": nodes, "edges": edges, "constants": {"j0.value": 0}}
+
+
+FLOW_SHAPES: Dict[str, Callable[[int], Dict[str, Any]]] = {
+    "chain": chain_flow,
+    "fanout": fanout_flow,
+    "diamond": diamond_flow,
+}
+
+
+def blocks_module(count: int) -> types.ModuleType:
+    """A throwaway module holding *count* documented block functions.
+
+    They are labelled but not registered, so the shared registry (and the
+    real palette) never sees them.
+    """
+
+    module = types.ModuleType("bench_blocks")
+    for i in range(count):
+        source = (
+            f"def block_{i}(text: str, count: int = 1, flag: bool | None = None) -> str:\n"
+            f"    '''Synthetic block {i}\n\n"
+            f"    :param text: some text\n"
+            f"    :param count: how many times\n"
+            f"    :param flag: optional switch\n"
+            f"    :return: the text\n"
+            f"    '''\n"
+            f"    return text\n"
+        )
+        exec(source, module.__dict__)
+        module.__dict__[f"block_{i}"].__block_label__ = f"Block {i}"
+    return module
+
+
+# ---------------  Measurement -------------------------------
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def measure(fn: Callable[[], Any], runs: int) -> Dict[str, float]:
+    """Time *runs* calls of *fn* after a warm-up call, then one more under
+    tracemalloc for the peak memory (kept separate so it doesn't skew timings)"""
+
+    fn()
+    gc.collect()
+    samples: List[float] = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ordered = sorted(samples)
+    return {
+        "runs": runs,
+        "throughput_per_s": runs / sum(samples),
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def _runs_for(size: int) -> int:
+    return max(3, min(200, 20_000 // size))
+
+
+# ---------------  Benchmarks --------------------------------
+
+def bench_run_graph(shape: str, size: int, runs: int) -> Dict[str, float]:
+    """Execute a precompiled *shape* flow of *size* nodes on one event loop"""
+
+    plan = compile_graph(FLOW_SHAPES[shape](size), __name__)
+    loop = asyncio.new_event_loop()
+    try:
+        return measure(lambda: loop.run_until_complete(run_graph(plan)), runs)
+    finally:
+        loop.close()
+
+
+def bench_compile(shape: str, size: int, runs: int) -> Dict[str, float]:
+    """Compile a *shape* flow from scratch, clearing the plan cache every run"""
+
+    flow = FLOW_SHAPES[shape](size)
+
+    def compile_once() -> None:
+        clear_plan_cache()
+        compile_graph(flow, __name__)
+
+    return measure(compile_once, runs)
+
+
+def bench_components_json(count: int, runs: int) -> Dict[str, float]:
+    """Introspect *count* blocks and encode their palette, on a fresh registry every run"""
+
+    module = blocks_module(count)
+    fns = [module.__dict__[f"block_{i}"] for i in range(count)]
+
+    def build() -> None:
+        fresh = BlockRegistry()
+        for fn in fns:
+            fn.__block_schema__ = _component_schema(fn)
+            fresh.register(fn)
+        fresh.payload([module.__name__])
+
+    sys.modules[module.__name__] = module  # payload() imports it by name
+    try:
+        return measure(build, runs)
+    finally:
+        del sys.modules[module.__name__]
+
+
+def bench_edge_index(sizes=(1_000, 5_000, 10_000, 20_000), fan_in: int = 2) -> None:
+    """Compile and run chains of increasing size and report per-edge cost.
+
+    With the ``(targetId, targetPort)`` edge index, time per edge should stay
+    roughly flat as the flow grows.
+    """
+
+    print(f"{'nodes':>8} {'edges':>8} {'compile ms':>11} {'run ms':>9} {'us/edge':>8}")
+    for size in sizes:
+        flow = chain_flow(size, fan_in=fan_in)
+        n_edges = len(flow["edges"])
+
+        clear_plan_cache()
+        t0 = time.perf_counter()
+        plan = compile_graph(flow, __name__)
+        t1 = time.perf_counter()
+        asyncio.run(run_graph(plan))
+        t2 = time.perf_counter()
+
+        per_edge = (t2 - t0) / max(n_edges, 1) * 1e6
+        print(f"{size:>8} {n_edges:>8} {(t1 - t0) * 1e3:>11.1f} {(t2 - t1) * 1e3:>9.1f} {per_edge:>8.2f}")
+
+
+def bench_instrumentation(size: int = 2_000, runs: int = 20) -> None:
+    """Compare run time with no instruments, and with the latency collector."""
+
+    plan = compile_graph(chain_flow(size), __name__)
+
+    def timed() -> float:
+        best = float("inf")
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            asyncio.run(run_graph(plan))
+            best = min(best, time.perf_counter() - t0)
+        return best
+
+    saved = list(instrumentation.active)
+    instrumentation.active.clear()
+    try:
+        bare = timed()
+        instrumentation.add_instrument(instrumentation.LatencyCollector())
+        traced = timed()
+    finally:
+        instrumentation.active[:] = saved
+
+    print(f"{size} nodes: disabled {bare * 1e3:.1f} ms, collector {traced * 1e3:.1f} ms "
+          f"({(traced / bare - 1) * 100:+.0f}%)")
+
+
+def _report(name: str, stats: Dict[str, float]) -> None:
+    print(f"{name:<26} {stats['throughput_per_s']:>10.1f}/s  p50 {stats['p50_ms']:>9.3f} ms  "
+          f"p95 {stats['p95_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms  "
+          f"peak {stats['peak_kb']:>9.0f} KiB")
+
+
+def run_suite(quick: bool = False) -> Dict[str, Dict[str, float]]:
+    """Run every benchmark and return ``name → stats``"""
+
+    sizes = (10, 1_000) if quick else (10, 1_000, 10_000, 100_000)
+    counts = (10, 200) if quick else (10, 200, 2_000)
+    results: Dict[str, Dict[str, float]] = {}
+
+    for shape in FLOW_SHAPES:
+        for size in sizes:
+            runs = _runs_for(size)
+            for kind, bench, n in (("run", bench_run_graph, runs), ("compile", bench_compile, max(3, runs // 4))):
+                name = f"{kind}/{shape}/{size}"
+                results[name] = bench(shape, size, n)
+                _report(name, results[name])
+
+    for count in counts:
+        name = f"components_json/{count}"
+        results[name] = bench_components_json(count, _runs_for(count * 10))
+        _report(name, results[name])
+
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Describe every benchmark whose p50 or peak memory grew past *tolerance*"""
+
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p50_ms", "peak_kb"):
+            if base[metric] > 0 and stats[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {metric} {stats[metric]:.3f} vs {base[metric]:.3f} "
+                    f"(+{(stats[metric] / base[metric] - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    global SIMULATED_LATENCY
+
+    parser = argparse.ArgumentParser(description="Graph runner benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="only the small flow sizes")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each simulated Discord call waits")
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if a benchmark regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed growth before --check fails (0.25 = 25%%)")
+    parser.add_argument("--scaling", action="store_true",
+                        help="also print the edge-index scaling and instrumentation overhead reports")
+    args = parser.parse_args(argv)
+
+    SIMULATED_LATENCY = args.latency
+    results = run_suite(quick=args.quick)
+    if args.scaling:
+        bench_edge_index()
+        bench_instrumentation()
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True), encoding="utf-8")
+        print(f"Baseline written to {args.baseline}")
+
+    if args.check:
+        try:
+            baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        except OSError:
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
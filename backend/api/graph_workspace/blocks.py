@@ -1,17 +1,69 @@
+import hashlib
+import importlib
 import inspect
 import json
+import os
 import pathlib
 import re
 from types import NoneType, UnionType
-from typing import Any, Dict, List, get_origin, get_args
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union, get_origin, get_args
+
+from .executors import EXECUTION_MODES
+
+# Modules whose blocks the builder offers and bots can run, comma separated;
+# plugins are added by listing their module here
+BLOCK_MODULES = tuple(
+    m.strip() for m in os.environ.get("BLOCK_MODULES", "api.graph_workspace.components").split(",") if m.strip()
+)
 
 
 # Decorator
-def block(label: str | None = None):
-    """Mark a function as a block"""
+def block(
+    label: str | None = None,
+    *,
+    concurrent: bool = True,
+    execution: str = "inline",
+    sink: bool | None = None,
+    pure: bool = False,
+    ttl: float | None = None,
+    cost: float | None = None,
+    critical: bool = True,
+):
+    """Mark a function as a block
+
+    :param label: Name shown in the builder palette
+    :param concurrent: ``False`` keeps the block's side effects in flow order
+        relative to other non-concurrent blocks instead of running it as soon
+        as its inputs are ready
+    :param execution: Where a sync block runs: ``"inline"`` on the event loop,
+        ``"thread"`` or ``"process"`` on the shared pools in ``executors``.
+        Ignored for ``async`` blocks.
+    :param sink: The block has side effects (sends, edits, state writes);
+        lazy plans only run sinks and whatever they depend on. Defaults to
+        ``not pure``, so unmarked blocks always run; pass ``sink=False`` for
+        blocks that only compute a value
+    :param pure: The result depends only on the arguments, so identical calls
+        can be answered from the shared ``memo.results`` cache
+    :param ttl: Seconds a memoized result stays valid (``None`` = until evicted)
+    :param cost: Typical seconds the block takes, used to predict slow flows
+        until live latency stats are available
+    :param critical: ``False`` lets the runner skip or cancel the block (its
+        output becomes ``None``) when an interaction is about to expire
+    """
+    if execution not in EXECUTION_MODES:
+        raise ValueError(f"execution must be one of {EXECUTION_MODES}, got {execution!r}")
 
     def _wrap(fn):
         fn.__block_label__ = label or fn.__name__
+        fn.__block_concurrent__ = concurrent
+        fn.__block_execution__ = execution
+        fn.__block_sink__ = not pure if sink is None else sink
+        fn.__block_pure__ = pure
+        fn.__block_ttl__ = ttl
+        fn.__block_cost__ = cost
+        fn.__block_critical__ = critical
+        fn.__block_schema__ = _component_schema(fn)
+        registry.register(fn)
         return fn
 
     return _wrap
@@ -37,6 +89,49 @@ def _py_type_to_ts(t: Any, *, is_return: bool = False) -> str:
     return getattr(t, "__name__", str(t))
 
 
+def annotation_classes(t: Any) -> Optional[Tuple[type, ...]]:
+    """Classes a value annotated *t* may have, or ``None`` if it could be anything."""
+
+    if t is inspect.Parameter.empty or t is Any or isinstance(t, str):
+        return None
+    if t in (None, NoneType):
+        return (NoneType,)
+
+    origin = get_origin(t)
+    if origin is UnionType or origin is Union:
+        classes: List[type] = []
+        for arg in get_args(t):
+            arg_classes = annotation_classes(arg)
+            if arg_classes is None:
+                return None
+            classes.extend(arg_classes)
+        return tuple(classes)
+
+    t = origin or t  # list[int] → list
+    return (t,) if isinstance(t, type) else None
+
+
+def coerce_literal(value: Any, t: Any) -> Any:
+    """Convert a value typed into the builder (always text) to annotation *t*.
+
+    Raises ``ValueError`` when the text can't be read as any of its types.
+    """
+
+    classes = annotation_classes(t)
+    if not isinstance(value, str) or classes is None or str in classes:
+        return value
+
+    for cls in classes:
+        if cls is bool and value.strip().lower() in ("true", "false", "1", "0", "yes", "no"):
+            return value.strip().lower() in ("true", "1", "yes")
+        if cls in (int, float):
+            try:
+                return cls(value)
+            except ValueError:
+                continue
+    raise ValueError(f"{value!r} is not a valid {_py_type_to_ts(t)}")
+
+
 # ---------------  Docstring helpers -------------------------
 
 _PARAM_RE = re.compile(r":param\s+(?P<name>\w+)\s*:\s*(?P<desc>.+)")
@@ -65,61 +160,131 @@ def _parse_docstring(doc: str) -> Dict[str, Any]:
 
 # ---------------  Introspection -> schema -------------------
 
+def _component_schema(fn: Callable[..., Any]) -> Dict[str, Any]:
+    """Builder palette entry for block *fn* (computed once, by ``@block``)."""
+
+    spec = inspect.getfullargspec(fn)
+    doc = inspect.getdoc(fn) or ""
+    parsed_doc = _parse_docstring(doc)
+
+    # Build a for arg default values
+    defaults: Dict[str, Any] = {}
+    if spec.defaults:
+        for arg_name, default in zip(spec.args[-len(spec.defaults) :], spec.defaults):
+            defaults[arg_name] = default
+
+    # Inputs
+    inputs = [
+        {
+            "name": arg,
+            "type": _py_type_to_ts(spec.annotations.get(arg, str)),
+            "desc": parsed_doc["args"].get(arg, ""),
+            **({"default": defaults[arg]} if arg in defaults else {}),
+        }
+        for arg in spec.args
+    ]
+
+    # Outputs
+    ret_ann = spec.annotations.get("return", None)
+    outputs = [{
+        "name": "output",
+        "type": _py_type_to_ts(ret_ann, is_return=True),
+        "desc": parsed_doc["return"],
+    }]
+
+    return {
+        "code_id": fn.__name__,
+        "label": getattr(fn, "__block_label__", fn.__name__),
+        "doc": doc.split("\n")[0],
+        "inputs": inputs,
+        "outputs": outputs,
+    }
+
+
 def build_components_json(module) -> List[Dict[str, Any]]:
     """Introspect *module* and build the list consumed by the React UI."""
 
-    comps: List[Dict[str, Any]] = []
-
-    for name, fn in inspect.getmembers(module, inspect.isfunction):
-        if not hasattr(fn, "__block_label__"):
-            continue  # skip helpers / non-blocks
-
-        spec = inspect.getfullargspec(fn)
-        doc = inspect.getdoc(fn) or ""
-        parsed_doc = _parse_docstring(doc)
-
-        # Build a for arg default values
-        defaults: Dict[str, Any] = {}
-        if spec.defaults:
-            for arg_name, default in zip(spec.args[-len(spec.defaults) :], spec.defaults):
-                defaults[arg_name] = default
-
-        # Inputs
-        inputs = [
-            {
-                "name": arg,
-                "type": _py_type_to_ts(spec.annotations.get(arg, str)),
-                "desc": parsed_doc["args"].get(arg, ""),
-                **({"default": defaults[arg]} if arg in defaults else {}),
-            }
-            for arg in spec.args
+    return [
+        fn.__block_schema__
+        for _, fn in inspect.getmembers(module, inspect.isfunction)
+        if hasattr(fn, "__block_label__")  # skip helpers / non-blocks
+    ]
+
+
+# ---------------  Registry ----------------------------------
+
+class BlockRegistry:
+    """Every ``@block`` function, grouped by the module that defines it.
+
+    Filled at import time by the decorator; the runner resolves ``code_id``s
+    and ``/api/components`` builds the palette from here, so neither has to
+    introspect modules again.
+    """
+
+    def __init__(self) -> None:
+        # module name → code_id → function
+        self._modules: Dict[str, Dict[str, Callable[..., Any]]] = {}
+        # memoized per tuple of module names; dropped whenever a block registers
+        self._blocks: Dict[Tuple[str, ...], Dict[str, Callable[..., Any]]] = {}
+        self._payloads: Dict[Tuple[str, ...], Tuple[bytes, str]] = {}
+
+    def register(self, fn: Callable[..., Any]) -> None:
+        # a later definition with the same name replaces the earlier one,
+        # just like rebinding the module attribute
+        self._modules.setdefault(fn.__module__, {})[fn.__name__] = fn
+        self._blocks.clear()
+        self._payloads.clear()
+
+    def blocks(self, module_names: Iterable[str]) -> Dict[str, Callable[..., Any]]:
+        """``code_id → function`` over *module_names* (imported if needed)"""
+
+        names = tuple(module_names)
+        merged = self._blocks.get(names)
+        if merged is not None:
+            return merged
+
+        merged = {}
+        for name in names:
+            importlib.import_module(name)
+            for code_id, fn in self._modules.get(name, {}).items():
+                other = merged.setdefault(code_id, fn)
+                if other is not fn:
+                    raise ValueError(
+                        f"Block '{code_id}' is defined by both {other.__module__} and {name}"
+                    )
+        self._blocks[names] = merged
+        return merged
+
+    def components(self, module_names: Iterable[str]) -> List[Dict[str, Any]]:
+        """Palette entries for *module_names*, module by module, sorted by code_id"""
+
+        names = tuple(module_names)
+        self.blocks(names)  # import + check for clashes
+        return [
+            fn.__block_schema__
+            for name in names
+            for _, fn in sorted(self._modules.get(name, {}).items())
         ]
 
-        # Outputs
-        ret_ann = spec.annotations.get("return", None)
-        outputs = [{
-            "name": "output",
-            "type": _py_type_to_ts(ret_ann, is_return=True),
-            "desc": parsed_doc["return"],
-        }]
+    def payload(self, module_names: Iterable[str]) -> Tuple[bytes, str]:
+        """JSON-encoded :meth:`components` and its quoted sha256 ETag, memoized"""
+
+        names = tuple(module_names)
+        cached = self._payloads.get(names)
+        if cached is None:
+            body = json.dumps(self.components(names), separators=(",", ":"), default=str).encode("utf-8")
+            cached = self._payloads[names] = (body, f'"{hashlib.sha256(body).hexdigest()}"')
+        return cached
 
-        comps.append(
-            {
-                "code_id": name,
-                "label": getattr(fn, "__block_label__", name),
-                "doc": doc.split("\n")[0],
-                "inputs": inputs,
-                "outputs": outputs,
-            }
-        )
 
-    return comps
+registry = BlockRegistry()
 
 
 if __name__ == "__main__":
-    import components as blocks
+    # block modules register with the package's registry, not this __main__ copy
+    from api.graph_workspace.blocks import registry as shared_registry
 
-    comps = build_components_json(blocks)
+    comps = shared_registry.components(BLOCK_MODULES)
 
     outfile = pathlib.Path(__file__).resolve().parents[3] / "frontend" / "src" / "builder" / "components.json"
     with open(outfile, "w", encoding="utf-8") as fp:
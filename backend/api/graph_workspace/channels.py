@@ -0,0 +1,81 @@
+"""
+channels.py
+
+Resolves channel ids to channel objects for blocks, without an HTTP round
+trip per call
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Dict
+
+import discord
+
+# Channels remembered outside discord.py's gateway cache
+CHANNEL_CACHE_SIZE = int(os.environ.get("CHANNEL_CACHE_SIZE", 1024))
+
+
+class ChannelResolver:
+    """Looks channels up in the bot's gateway cache, then in a bounded LRU of
+    channels fetched earlier, and only then asks the API.
+
+    The bot calls :meth:`invalidate` from its channel update/delete events so
+    the LRU never hands out a stale or deleted channel.
+    """
+
+    def __init__(self, bot: discord.Client, maxsize: int = CHANNEL_CACHE_SIZE):
+        self.bot = bot
+        self.maxsize = maxsize
+        self._lru: "OrderedDict[int, Any]" = OrderedDict()
+        self.counts: Dict[str, int] = {"gateway": 0, "lru": 0, "fetched": 0, "partial": 0}
+
+    def _remember(self, channel_id: int, channel: Any) -> Any:
+        self._lru[channel_id] = channel
+        self._lru.move_to_end(channel_id)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+        return channel
+
+    def _cached(self, channel_id: int) -> Any:
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            self.counts["gateway"] += 1
+            return channel
+        channel = self._lru.get(channel_id)
+        if channel is not None:
+            self._lru.move_to_end(channel_id)
+            self.counts["lru"] += 1
+        return channel
+
+    async def resolve(self, channel_id: int) -> Any:
+        """The full channel object for *channel_id*
+
+        Falls back to a partial messageable when the bot may not view the
+        channel, which is still enough to send to it.
+        """
+        channel = self._cached(channel_id)
+        if channel is not None:
+            return channel
+        try:
+            channel = await self.bot.fetch_channel(channel_id)
+            self.counts["fetched"] += 1
+        except discord.Forbidden:
+            channel = self.bot.get_partial_messageable(channel_id)
+            self.counts["partial"] += 1
+        return self._remember(channel_id, channel)
+
+    def messageable(self, channel_id: int) -> Any:
+        """Something to send to *channel_id*, without any API call"""
+        channel = self._cached(channel_id)
+        if channel is None:
+            channel = self._remember(channel_id, self.bot.get_partial_messageable(channel_id))
+            self.counts["partial"] += 1
+        return channel
+
+    def invalidate(self, channel_id: int) -> None:
+        self._lru.pop(channel_id, None)
+
+    def clear(self) -> None:
+        self._lru.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counts, "size": len(self._lru)}
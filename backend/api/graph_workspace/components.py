@@ -1,15 +1,19 @@
 import random
 from typing import Any
 
+from discord import Client
 from discord import Interaction
 from discord import Message
 from discord.abc import Messageable
 
 import api.graph_workspace.globals as globals
 from .blocks import block
+from .channels import ChannelResolver
+from .outbox import Outbox
+from .variables import VariableStore, default_store, key_for
 
 
-@block("Set Bot Token")
+@block("Set Bot Token", concurrent=False, sink=True)
 def set_var(token: str) -> None:
     """Set the bot's token
 
@@ -17,26 +21,90 @@ def set_var(token: str) -> None:
     """
     setattr(globals, "TOKEN", token)
 
-@block("Get Variable")
-def get_var(name: str, default: Any = None) -> Any:
+@block("Get Variable", concurrent=False, sink=False)
+async def get_var(
+    name: str,
+    default: Any = None,
+    scope: str = "global",
+    *,
+    variables: VariableStore | None = None,
+    interaction: Interaction | None = None,
+) -> Any:
     """Gets value of a variable
 
     :param name: The variable name to look up.
     :param default: Optional value to return if the variable is missing.
+    :param scope: "global", "guild", "channel" or "user"
     :return: The current value of the variable (or *default* if absent).
     """
-    return getattr(globals, name, default)
-
-@block("Set Variable")
-def set_var(name: str, value: Any) -> None:
+    store = variables or default_store()
+    return await store.get(key_for(name, scope, interaction), default)
+
+@block("Set Variable", concurrent=False, sink=True)
+async def set_var(
+    name: str,
+    value: Any,
+    scope: str = "global",
+    ttl: float | None = None,
+    *,
+    variables: VariableStore | None = None,
+    interaction: Interaction | None = None,
+) -> None:
     """Set or create a variable
 
     :param name: Variable name
     :param value: The value to store.
+    :param scope: "global", "guild", "channel" or "user"
+    :param ttl: Seconds until the variable expires (empty = never)
     """
-    setattr(globals, name, value)
+    store = variables or default_store()
+    await store.set(key_for(name, scope, interaction), value, ttl)
+
+@block("Increment Variable", concurrent=False, sink=True)
+async def incr_var(
+    name: str,
+    amount: float = 1,
+    scope: str = "global",
+    ttl: float | None = None,
+    *,
+    variables: VariableStore | None = None,
+    interaction: Interaction | None = None,
+) -> float:
+    """Add to a numeric variable, safely even when many flows do it at once
 
-@block("Random Number")
+    :param name: Variable name
+    :param amount: How much to add (missing variables start at 0)
+    :param scope: "global", "guild", "channel" or "user"
+    :param ttl: Seconds until the variable expires (empty = never)
+    :return: The new value
+    """
+    store = variables or default_store()
+    return await store.increment(key_for(name, scope, interaction), amount, ttl)
+
+@block("Compare And Set Variable", concurrent=False, sink=True)
+async def cas_var(
+    name: str,
+    expected: Any,
+    value: Any,
+    scope: str = "global",
+    ttl: float | None = None,
+    *,
+    variables: VariableStore | None = None,
+    interaction: Interaction | None = None,
+) -> bool:
+    """Set a variable only if it still has the value you expect
+
+    :param name: Variable name
+    :param expected: The value it must currently have (empty = not set)
+    :param value: The value to store
+    :param scope: "global", "guild", "channel" or "user"
+    :param ttl: Seconds until the variable expires (empty = never)
+    :return: Whether the variable was set
+    """
+    store = variables or default_store()
+    return await store.compare_and_set(key_for(name, scope, interaction), expected, value, ttl)
+
+@block("Random Number", sink=False)
 def random_int(low: int = 1, high: int = 10) -> int:
     """Generates a random number
 
@@ -46,33 +114,55 @@ def random_int(low: int = 1, high: int = 10) -> int:
     """
     return random.randint(low, high)
 
-@block("Send Message")
-async def send(channel_id: int | Messageable, text: str | Message) -> None:
+@block("Send Message", sink=True)
+async def send(
+    channel_id: int | Messageable | Interaction,
+    text: str | Message,
+    *,
+    bot: Client | None = None,
+    channels: ChannelResolver | None = None,
+    outbox: Outbox | None = None,
+) -> None:
     """Sends a message to a channel
 
     :param channel_id: ID of channel to send the message to
     :param text: The message to send
+    :param bot: The running bot (provided by the runner)
+    :param channels: Cached channel lookups (provided by the runner)
+    :param outbox: Sends the message once the flow yields (provided by the runner)
     """
     if isinstance(channel_id, Messageable):
         channel = channel_id
     elif isinstance(channel_id, Interaction):
         channel = channel_id.channel
     elif type(channel_id) == int:
-        channel = globals.bot.fetch_channel(channel_id)
+        if channels is not None:
+            channel = channels.messageable(channel_id)
+        elif bot is not None:
+            channel = bot.get_channel(channel_id) or bot.get_partial_messageable(channel_id)
+        else:
+            raise Exception("Sending to a channel ID needs the running bot")
     else:
         raise Exception("Parameter \"channel_id\" must be either integer or a Messageable")
-    await channel.send(text)
+    if outbox is not None:
+        outbox.send(channel, text)
+    else:
+        await channel.send(text)
 
-@block("Edit Message")
-async def edit_message(message: Message, new_text: str) -> None:
+@block("Edit Message", sink=True)
+async def edit_message(message: Message, new_text: str, *, outbox: Outbox | None = None) -> None:
     """Edit an existing message
 
     :param message: the Message object to edit
     :param new_text: the new text content
+    :param outbox: Coalesces repeated edits still waiting to go out (provided by the runner)
     """
-    await message.edit(content=new_text)
+    if outbox is not None:
+        outbox.edit(message, new_text)
+    else:
+        await message.edit(content=new_text)
 
-@block("Lowercase String")
+@block("Lowercase String", pure=True)
 def to_lower(text: str) -> str:
     """Convert a string to lowercase
 
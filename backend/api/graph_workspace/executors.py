@@ -0,0 +1,100 @@
+"""
+executors.py
+
+Shared, bounded pools that run synchronous blocks off the event loop
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Tuple
+
+EXECUTION_MODES = ("inline", "thread", "process")
+
+THREAD_WORKERS = int(os.environ.get("BLOCK_THREAD_WORKERS", 8))
+PROCESS_WORKERS = int(os.environ.get("BLOCK_PROCESS_WORKERS", os.cpu_count() or 1))
+
+
+class PoolStats:
+    """Queueing metrics for one pool (times in seconds)."""
+
+    __slots__ = ("submitted", "completed", "in_flight", "queue_time_total", "queue_time_max")
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.in_flight = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "in_flight": self.in_flight,
+            "queue_time_avg": self.queue_time_total / self.completed if self.completed else 0.0,
+            "queue_time_max": self.queue_time_max,
+        }
+
+
+_pools: Dict[str, Executor] = {}
+_stats: Dict[str, PoolStats] = {mode: PoolStats() for mode in EXECUTION_MODES if mode != "inline"}
+
+
+def _get_pool(mode: str) -> Executor:
+    pool = _pools.get(mode)
+    if pool is None:
+        if mode == "thread":
+            pool = ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix="block")
+        elif mode == "process":
+            pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+        else:
+            raise ValueError(f"No executor for execution mode '{mode}'")
+        _pools[mode] = pool
+    return pool
+
+
+def _timed_call(fn: Callable[..., Any], kwargs: Mapping[str, Any]) -> Tuple[float, Any]:
+    """Runs inside the worker; reports when the call actually started."""
+
+    return time.time(), fn(**kwargs)
+
+
+async def run_in_pool(mode: str, fn: Callable[..., Any], kwargs: Mapping[str, Any]) -> Any:
+    """Run ``fn(**kwargs)`` on the shared *mode* pool and return its result.
+
+    Blocks sent to the ``process`` pool must be importable module-level
+    functions and only receive picklable arguments.
+    """
+
+    pool = _get_pool(mode)
+    stats = _stats[mode]
+    submitted = time.time()
+    stats.submitted += 1
+    stats.in_flight += 1
+    try:
+        started, result = await asyncio.get_running_loop().run_in_executor(
+            pool, _timed_call, fn, kwargs
+        )
+    finally:
+        stats.in_flight -= 1
+
+    waited = max(started - submitted, 0.0)
+    stats.completed += 1
+    stats.queue_time_total += waited
+    stats.queue_time_max = max(stats.queue_time_max, waited)
+    return result
+
+
+def executor_stats() -> Dict[str, Dict[str, float]]:
+    """Snapshot of queueing metrics per pool."""
+
+    return {mode: stats.as_dict() for mode, stats in _stats.items()}
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shut down every pool that has been started."""
+
+    for pool in _pools.values():
+        pool.shutdown(wait=wait)
+    _pools.clear()
@@ -1,57 +1,409 @@
 from __future__ import annotations
 
-import importlib
+import hashlib
 import inspect
+import asyncio
+import heapq
 import json
-from typing import Any, Dict, List, Mapping, Tuple, Union
+import sys
+import time
+from array import array
+from collections import deque
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from . import instrumentation, memo
+from .blocks import coerce_literal, registry
+from .executors import run_in_pool
 
 # A value in the cache is uniquely identified by *component‑id* & *port‑name*
 PortKey = Tuple[str, str]  # (componentId, portName)
 
+# Sentinel for "no default in the function signature"
+_MISSING = inspect.Parameter.empty
+
+# Sentinel for "no value in this slot (yet)"
+_UNSET = object()
+
+# Slot index of an input port that no edge feeds
+NO_SOURCE = -1
+
+# Format of the validated plan stored with a flow (see ``validation``)
+PLAN_VERSION = 1
+
+# Assumed duration of an async/offloaded block with no hint and no live stats
+# (roughly one Discord API round trip)
+DEFAULT_ASYNC_COST = 0.25
+
+# Placeholder nodes of callable flows: a "__subflow__" node (``flowId``)
+# runs another flow; that flow's "__flow_input__" nodes receive the node's
+# inputs and its "__flow_output__" nodes provide the node's outputs, each
+# named by the node's ``name`` (falling back to its id)
+SUBFLOW = "__subflow__"
+FLOW_INPUT = "__flow_input__"
+FLOW_OUTPUT = "__flow_output__"
+
+# Upper bound on concurrently awaited blocks per flow run, unless the flow
+# (``maxConcurrency``) or the caller (``max_concurrency=``) says otherwise
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+# ---------------------------------------------------------------------------
+# Compiled plan
+# ---------------------------------------------------------------------------
+class InputBinding(NamedTuple):
+    """Where a single input port gets its value from."""
+
+    port: str
+    slot: int  # this port's own slot (set when a constant targets it)
+    source: int  # slot of the connected output, or :data:`NO_SOURCE`
+    default: Any  # signature default, ``_MISSING`` when there is none
+
+
+class NodePlan(NamedTuple):
+    """Everything needed to execute one node, resolved ahead of time."""
+
+    node_id: str
+    code_id: str
+    label: str
+    fn: Optional[Callable[..., Any]]  # ``None`` for placeholder nodes
+    inputs: Tuple[InputBinding, ...]
+    ctx_params: Optional[FrozenSet[str]]  # ``None`` → accepts ``**kwargs``
+    outputs: Tuple[str, ...]
+    output_slots: Tuple[int, ...]
+    concurrent: bool  # ``False`` → runs in flow order w.r.t. other such nodes
+    execution: str  # "inline" | "thread" | "process" (sync blocks only)
+    pure: bool  # results may be served from ``memo.results``
+    ttl: Optional[float]  # seconds a memoized result stays valid
+    cost: Optional[float]  # ``@block(cost=...)`` hint, in seconds
+    critical: bool  # ``False`` → may be skipped once the run's deadline passed
+
+
+class CompiledGraph(NamedTuple):
+    """Immutable execution plan produced by :func:`compile_graph`.
+
+    Every ``(nodeId, port)`` the plan touches is given an integer *slot*; a
+    run keeps its values in a flat list indexed by slot, and the dependency
+    graph is stored as contiguous integer arrays (successors in CSR form).
+    Plans are shared read-only by every run of the flow.
+    """
+
+    key: Tuple[Any, str, bool]  # (flowId or digest, module_name, lazy)
+    digest: str
+    module_name: str
+    order: Tuple[NodePlan, ...]  # topological order
+    succ_offsets: array  # successors of node i: succ_targets[offsets[i]:offsets[i+1]]
+    succ_targets: array  # indices into *order*
+    indegree: array
+    ports: Tuple[PortKey, ...]  # slot → (nodeId, port)
+    slots: Mapping[PortKey, int]  # (nodeId, port) → slot
+    initial: Tuple[Any, ...]  # slot → flow constant, or ``_UNSET``
+    max_concurrency: Optional[int]
+    lazy: bool
+    consumers: array  # slot → how many scheduled inputs read it
+    validated: bool  # built from a plan stored by ``validation.validate_flow``
+
+
+class PortValues(Mapping):
+    """Read-only ``(nodeId, port) → value`` view over the slots of one run."""
+
+    __slots__ = ("_plan", "_values")
+
+    def __init__(self, plan: CompiledGraph, values: List[Any]):
+        self._plan = plan
+        self._values = values
+
+    def __getitem__(self, key: PortKey) -> Any:
+        slot = self._plan.slots.get(key)
+        if slot is None or self._values[slot] is _UNSET:
+            raise KeyError(key)
+        return self._values[slot]
+
+    def __iter__(self) -> Iterator[PortKey]:
+        values = self._values
+        return (key for slot, key in enumerate(self._plan.ports) if values[slot] is not _UNSET)
+
+    def __len__(self) -> int:
+        return sum(v is not _UNSET for v in self._values)
+
+    def __repr__(self) -> str:
+        return f"PortValues({dict(self)!r})"
+
+
+class GraphValidationError(ValueError):
+    """Raised when a flow cannot be compiled into a consistent plan."""
+
+
+# Flow fields besides nodes and edges that are compiled into a plan
+PLAN_SETTINGS = ("constants", "maxConcurrency")
+
+# (flowId or digest, module_name, lazy) → latest plan for that flow
+_PLAN_CACHE: Dict[Tuple[Any, str, bool], CompiledGraph] = {}
+
+# flow ids whose sub-flows are being compiled, to catch flows calling themselves
+_compiling: List[Any] = []
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+def _normalise(graph: Union[str, Mapping[str, Any]]) -> Mapping[str, Any]:
+    if isinstance(graph, str):  # JSON string → dict
+        return json.loads(graph)
+    return graph  # already a mapping
+
+
+def _src(e: Mapping[str, Any]) -> str:
+    return e.get("sourceId") or e.get("sourceComponentId")  # type: ignore[return-value]
+
+
+def _tgt(e: Mapping[str, Any]) -> str:
+    return e.get("targetId") or e.get("targetComponentId")  # type: ignore[return-value]
+
+
+def _output_ports(node: Mapping[str, Any]) -> Tuple[str, ...]:
+    return tuple(p["name"] for p in node.get("outputs", []))
+
+
+def _port_key(name: str) -> PortKey:
+    node_id, _, port = name.partition(".")  # "component.port"
+    return node_id, port
+
+
+def check_concurrency(value: Any, name: str = "max_concurrency") -> Optional[int]:
+    """*value* if it is ``None`` or a positive int, else raise ``ValueError``"""
+    if value is None or (isinstance(value, int) and not isinstance(value, bool) and value > 0):
+        return value
+    raise ValueError(f"{name} must be a positive integer, got {value!r}")
+
+
+def index_edges(edges: List[Mapping[str, Any]]) -> Dict[PortKey, PortKey]:
+    """Map every ``(targetId, targetPort)`` to its ``(sourceId, sourcePort)``.
+
+    An input port can only be fed by a single edge; duplicate or conflicting
+    bindings raise :class:`GraphValidationError`.
+    """
+
+    index: Dict[PortKey, PortKey] = {}
+    for e in edges:
+        target: PortKey = (_tgt(e), e["targetPort"])
+        source: PortKey = (_src(e), e["sourcePort"])
+        bound = index.setdefault(target, source)
+        if bound is not source:
+            kind = "Duplicate" if bound == source else "Conflicting"
+            raise GraphValidationError(
+                f"{kind} binding for input port '{target[1]}' on node '{target[0]}': "
+                f"{bound[0]}.{bound[1]} and {source[0]}.{source[1]}"
+            )
+    return index
+
+
+def flow_digest(graph: Union[str, Mapping[str, Any]]) -> str:
+    """Return a stable content hash of the *nodes* and *edges* of *graph*."""
+
+    graph_dict = _normalise(graph)
+    payload = json.dumps(
+        {"nodes": graph_dict["nodes"], "edges": graph_dict["edges"]},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _memoize(pending: Any, key: Any, ttl: Optional[float]) -> Any:
+    result = await pending
+    memo.results.put(key, result, ttl)
+    return result
+
+
+def estimate_cost(plan: CompiledGraph, quantile: float = 0.95) -> float:
+    """Predict how long *plan* takes to run, in seconds.
+
+    Each block is costed by the *quantile* of its live wall times when the
+    latency collector is active and has enough samples, else by its
+    ``@block(cost=...)`` hint, else :data:`DEFAULT_ASYNC_COST` for async or
+    offloaded blocks and 0 for inline sync ones. The estimate is the
+    longest path through the plan, since independent branches overlap.
+    """
+
+    live = instrumentation.collector in instrumentation.active
+    # keyed by function: sub-flow nodes share a code_id but not a cost
+    per_block: Dict[Any, float] = {}
+    finish = [0.0] * len(plan.order)
+    start = [0.0] * len(plan.order)
+    offsets, targets = plan.succ_offsets, plan.succ_targets
+
+    for i, node in enumerate(plan.order):
+        block_key = node.fn if node.fn is not None else node.code_id
+        cost = per_block.get(block_key)
+        if cost is None:
+            # live stats are per code_id, which can't tell sub-flows apart
+            timed = live and node.code_id != SUBFLOW
+            cost = instrumentation.collector.percentile(node.code_id, quantile) if timed else None
+            if cost is None:
+                cost = node.cost
+            if cost is None:
+                slow = node.fn is not None and (
+                    node.execution != "inline" or inspect.iscoroutinefunction(node.fn)
+                )
+                cost = DEFAULT_ASYNC_COST if slow else 0.0
+            per_block[block_key] = cost
+
+        finish[i] = start[i] + cost
+        for j in targets[offsets[i]:offsets[i + 1]]:
+            start[j] = max(start[j], finish[i])
+
+    return max(finish, default=0.0)
+
+
+def flow_interface(graph: Union[str, Mapping[str, Any]]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """``(inputs, outputs)`` of a callable flow, each ``port name → node id``
+    of its :data:`FLOW_INPUT` / :data:`FLOW_OUTPUT` nodes."""
+
+    inputs: Dict[str, str] = {}
+    outputs: Dict[str, str] = {}
+    for node in _normalise(graph)["nodes"]:
+        if node["code_id"] == FLOW_INPUT:
+            inputs[node.get("name") or node["id"]] = node["id"]
+        elif node["code_id"] == FLOW_OUTPUT:
+            outputs[node.get("name") or node["id"]] = node["id"]
+    return inputs, outputs
+
+
+def _subflow_block(
+    child: CompiledGraph,
+    interface: Tuple[Dict[str, str], Dict[str, str]],
+    ports: Tuple[str, ...],
+) -> Callable[..., Any]:
+    """Wrap *child* so a :data:`SUBFLOW` node declaring output *ports* can
+    call it like a block.
+
+    Like a block, the wrapper returns the value of a single declared port
+    or a ``port → value`` mapping for several. It carries the same
+    ``__block_*__`` attributes as a block: it is a sink when *child* has one
+    (so lazy callers keep it), and pure when every block of *child* is, in
+    which case whole calls are memoized.
+    """
+
+    inputs, outputs = interface
+    constants = {name: f"{nid}.value" for name, nid in inputs.items()}
+
+    # a flow output is whatever feeds the "value" input of its node
+    bindings = {node.node_id: node.inputs for node in child.order}
+    output_keys: Dict[str, PortKey] = {}
+    for name, nid in outputs.items():
+        for binding in bindings.get(nid, ()):
+            if binding.port == "value":
+                output_keys[name] = child.ports[binding.slot if binding.source == NO_SOURCE else binding.source]
+
+    real = [node for node in child.order if node.fn is not None]
+    sink = any(getattr(node.fn, "__block_sink__", False) for node in real)
+    pure = all(node.pure for node in real)
+
+    async def subflow(**kwargs: Any) -> Any:
+        overlay = {constants[name]: kwargs.pop(name) for name in list(kwargs) if name in constants}
+        values = await run_graph(child, constants=overlay, **kwargs)
+        result = {port: values.get(output_keys[port]) if port in output_keys else None for port in ports}
+        if len(ports) == 1:
+            return result[ports[0]]
+        return result
+
+    # the digest keeps memoized calls of an edited flow apart
+    subflow.__qualname__ = f"subflow[{child.key[0]}:{child.digest[:16]}:{','.join(ports)}]"
+    subflow.__block_sink__ = sink
+    subflow.__block_pure__ = pure
+    subflow.__block_concurrent__ = True
+    subflow.__block_critical__ = any(node.critical for node in real) or not real
+    subflow.__block_cost__ = estimate_cost(child)
+    if pure:
+        # only the flow inputs, so no per-run context ends up in memo keys
+        subflow.__signature__ = inspect.Signature([
+            inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY) for name in inputs
+        ])
+    return subflow
+
+
+def clear_plan_cache() -> None:
+    """Forget every compiled plan (e.g. after reloading block modules)."""
+
+    _PLAN_CACHE.clear()
+
 
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
-async def run_graph(
+def compile_graph(
     graph: Union[str, Mapping[str, Any]],
     module_name: str,
-    **extra_ctx: Any,
-) -> Dict[PortKey, Any]:
-    """Execute *graph* and return a mapping of ``(nodeId, port) → value``.
+    *,
+    lazy: bool = False,
+    subflows: Optional[Mapping[Any, Mapping[str, Any]]] = None,
+) -> CompiledGraph:
+    """Compile *graph* into a reusable :class:`CompiledGraph`.
 
-    Parameters
-    ----------
-    graph:
-        Either the raw ``dict`` exported by the React canvas *or* its JSON
-        representation.
-    module_name:
-        Name of the Python module that contains the user's *block* functions.
-    **extra_ctx:
-        Variables that should be *implicitly* available to every block - e.g.
-        the active Discord ``bot`` instance, the current ``interaction``, etc.
+    Each node's ``code_id`` is resolved among the ``@block`` functions of
+    *module_name* (a comma separated list of modules for plugins).
+
+    :data:`SUBFLOW` nodes are resolved through *subflows* (``flowId →
+    flow``). Each called flow is compiled once (eagerly, as it has to
+    produce its outputs) and its plan is shared by every caller; a caller's
+    plan is rebuilt when a flow it calls changes.
+
+    Plans are cached per flow id (or content hash for anonymous flows),
+    *module_name* and *lazy*; a cached plan is reused for as long as the
+    flow's :func:`flow_digest` and its :data:`PLAN_SETTINGS` do not change.
+
+    With ``lazy=True`` only *sink* blocks (``@block(..., sink=True)``) and
+    the nodes they transitively depend on are scheduled, and intermediate
+    values are dropped from the run's cache once their last consumer ran.
     """
 
-    # --------------------  normalise input --------------------
-    if isinstance(graph, str):  # JSON string → dict
-        graph_dict: Mapping[str, Any] = json.loads(graph)
+    graph_dict = _normalise(graph)
+    try:
+        max_concurrency = check_concurrency(graph_dict.get("maxConcurrency"), "maxConcurrency")
+    except ValueError as exc:
+        raise GraphValidationError(str(exc)) from None
+    # flows from the API carry the hash computed when they were saved
+    content = graph_dict.get("content_hash") or flow_digest(graph_dict)
+    # constants and maxConcurrency are baked into the plan, so they are part
+    # of its identity even though the flow's content hash leaves them out
+    settings = {name: graph_dict[name] for name in PLAN_SETTINGS if graph_dict.get(name) is not None}
+    if settings:
+        payload = json.dumps(settings, sort_keys=True, separators=(",", ":"), default=str)
+        digest = hashlib.sha256(f"{content}:{payload}".encode("utf-8")).hexdigest()
     else:
-        graph_dict = graph  # already a mapping
-
-    nodes: Dict[str, Mapping[str, Any]] = {n["id"]: n for n in graph_dict["nodes"]}
-    edges: List[Mapping[str, Any]] = list(graph_dict["edges"])
-    consts: Mapping[str, Any] = graph_dict.get("constants", {})
+        digest = content
+    key = (graph_dict.get("flowId") or digest, module_name, lazy)
 
-    # Cache starts pre‑filled with constants ("component.port" → value)
-    cache: Dict[PortKey, Any] = {
-        tuple(k.split(".", 1)): v for k, v in consts.items()
-    }
+    # -------- called flows first: their digests are part of ours --------
+    children: Dict[Any, Tuple[CompiledGraph, Tuple[Dict[str, str], Dict[str, str]]]] = {}
+    if subflows is not None:
+        for node in graph_dict["nodes"]:
+            if node["code_id"] != SUBFLOW or node.get("flowId") in children:
+                continue
+            child_id = node.get("flowId")
+            if child_id not in subflows:
+                raise GraphValidationError(f"Sub-flow node '{node['id']}' calls unknown flow {child_id!r}")
+            if child_id in _compiling or child_id == key[0]:
+                raise GraphValidationError(f"Flow {child_id!r} calls itself through its sub-flows")
+            _compiling.append(key[0])
+            try:
+                child = compile_graph(subflows[child_id], module_name, subflows=subflows)
+            finally:
+                _compiling.pop()
+            children[child_id] = (child, flow_interface(subflows[child_id]))
+        if children:
+            digest = hashlib.sha256(
+                ":".join([digest, *(children[c][0].digest for c in sorted(children, key=str))]).encode("utf-8")
+            ).hexdigest()
 
-    # --------------------  edge helpers -----------------------
-    def _src(e: Mapping[str, Any]) -> str:  # type: ignore[override]
-        return e.get("sourceId") or e.get("sourceComponentId")  # type: ignore[index]
+    cached = _PLAN_CACHE.get(key)
+    if cached is not None and cached.digest == digest:
+        return cached
 
-    def _tgt(e: Mapping[str, Any]) -> str:  # type: ignore[override]
-        return e.get("targetId") or e.get("targetComponentId")  # type: ignore[index]
+    nodes: Dict[str, Mapping[str, Any]] = {n["id"]: n for n in graph_dict["nodes"]}
+    edges: List[Mapping[str, Any]] = list(graph_dict["edges"])
 
     # ------------------------------------------------------------------
     # Build adjacency lists for a *Kahn* topological sort
@@ -66,106 +418,497 @@ async def run_graph(
         adj[s].append(t)
         incoming[t] += 1
 
-    queue: List[str] = [nid for nid, deg in incoming.items() if deg == 0]
+    bindings_index = index_edges(edges)
 
-    # -------- import user module once ---------------------------------
-    mod = importlib.import_module(module_name)
+    # A plan validated at save time already knows the order (and that there
+    # are no cycles), as long as it was made for exactly this flow and modules
+    stored = graph_dict.get("plan") or {}
+    validated = (
+        stored.get("version") == PLAN_VERSION
+        and stored.get("digest") == content
+        and stored.get("modules") == module_name.split(",")
+    )
 
-    # --------------------  node execution ------------------------------
-    async def exec_node(node_id: str) -> None:
+    order: List[str] = []
+    if validated:
+        order = [nid for nid in stored["order"] if nid in nodes]
+    else:
+        queue = deque(nid for nid, deg in incoming.items() if deg == 0)
+        while queue:
+            nid = queue.popleft()
+            order.append(nid)
+            for m in adj[nid]:
+                incoming[m] -= 1
+                if incoming[m] == 0:
+                    queue.append(m)
+
+    # -------- blocks of the user module(s), imported once ---------------
+    blocks = registry.blocks(module_name.split(","))
+
+    # -------- sub-flow nodes call a wrapper around the shared child plan -
+    # (flowId, declared output ports) → wrapper
+    subflow_fns: Dict[Tuple[Any, Tuple[str, ...]], Callable[..., Any]] = {}
+
+    def block_of(node: Mapping[str, Any]) -> Optional[Callable[..., Any]]:
+        if node["code_id"] == SUBFLOW:
+            if node.get("flowId") not in children:
+                raise GraphValidationError(f"Sub-flow node '{node['id']}' needs the flows it can call")
+            key = (node["flowId"], _output_ports(node))
+            if key not in subflow_fns:
+                subflow_fns[key] = _subflow_block(*children[node["flowId"]], key[1])
+            return subflow_fns[key]
+        return blocks.get(node["code_id"])
+
+    # -------- demand-driven: keep only what some sink needs -------------
+    if lazy:
+        needed = {
+            nid for nid in order
+            if getattr(block_of(nodes[nid]), "__block_sink__", False)
+        }
+        preds: Dict[str, List[str]] = {nid: [] for nid in nodes}
+        for s, targets in adj.items():
+            for t in targets:
+                preds[t].append(s)
+        stack = list(needed)
+        while stack:
+            for p in preds[stack.pop()]:
+                if p not in needed:
+                    needed.add(p)
+                    stack.append(p)
+        order = [nid for nid in order if nid in needed]
+
+    # ------------------------------------------------------------------
+    # Number every port the plan touches; names are interned so plans of
+    # different flows share one copy of "ctx", "output", …
+    # ------------------------------------------------------------------
+    ports: List[PortKey] = []
+    slots: Dict[PortKey, int] = {}
+
+    def slot_of(port_key: PortKey) -> int:
+        slot = slots.get(port_key)
+        if slot is None:
+            port_key = (sys.intern(port_key[0]), sys.intern(port_key[1]))
+            slot = slots[port_key] = len(ports)
+            ports.append(port_key)
+        return slot
+
+    # code_id (or (SUBFLOW, flowId, ports)) → everything about its block that
+    # doesn't depend on the node, resolved once per compile
+    resolved: Dict[Any, Tuple[Any, ...]] = {}
+
+    # values typed into the builder ("component.port" → value), coerced to
+    # the port's annotation; flow constants take precedence
+    literals: List[Tuple[PortKey, Any]] = []
+
+    plans: List[NodePlan] = []
+    for node_id in order:
         node = nodes[node_id]
         code_id = node["code_id"]
+        # every called flow (and set of ports read from it) is a block of its own
+        block_key = (code_id, node.get("flowId"), _output_ports(node)) if code_id == SUBFLOW else code_id
+        if code_id == SUBFLOW and node.get("flowId") in children:
+            child_inputs, child_outputs = children[node.get("flowId")][1]
+            for port in node.get("inputs", []):
+                if port["name"] not in child_inputs:
+                    raise GraphValidationError(
+                        f"Flow {node.get('flowId')!r} has no input '{port['name']}' (node '{node_id}')"
+                    )
+            for port in node.get("outputs", []):
+                if port["name"] not in child_outputs:
+                    raise GraphValidationError(
+                        f"Flow {node.get('flowId')!r} has no output '{port['name']}' (node '{node_id}')"
+                    )
+
+        if block_key not in resolved:
+            # *Placeholder* nodes (e.g. "__slash__") have no backing function.
+            fn = block_of(node)
+            params = inspect.signature(fn).parameters if fn is not None else {}
+            accepts_all = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+            resolved[block_key] = (
+                sys.intern(code_id),
+                fn,
+                params,
+                None if accepts_all else frozenset(params),
+                getattr(fn, "__block_concurrent__", True),
+                (
+                    "inline"
+                    if inspect.iscoroutinefunction(fn)
+                    else getattr(fn, "__block_execution__", "inline")
+                ),
+                getattr(fn, "__block_pure__", False),
+                getattr(fn, "__block_ttl__", None),
+                getattr(fn, "__block_cost__", None),
+                getattr(fn, "__block_critical__", True),
+            )
+        code_id, fn, params, ctx_params, concurrent, execution, pure, ttl, cost, critical = resolved[block_key]
+        node_id = sys.intern(node_id)
+
+        bindings: List[InputBinding] = []
+        for port in node.get("inputs", []):
+            pname: str = sys.intern(port["name"])
+            param = params.get(pname)
+            source = bindings_index.get((node_id, pname))
+            if source is None and node.get(pname) not in (None, ""):
+                try:
+                    value = coerce_literal(node[pname], param.annotation if param is not None else _MISSING)
+                except ValueError:
+                    value = node[pname]  # left for the block to complain about
+                literals.append(((node_id, pname), value))
+            bindings.append(
+                InputBinding(
+                    port=pname,
+                    slot=slot_of((node_id, pname)),
+                    source=NO_SOURCE if source is None else slot_of(source),
+                    default=param.default if param is not None else _MISSING,
+                )
+            )
+        outputs = tuple(sys.intern(p["name"]) for p in node.get("outputs", []))
+
+        plans.append(
+            NodePlan(
+                node_id=node_id,
+                code_id=code_id,
+                label=node.get("label", code_id),
+                fn=fn,
+                inputs=tuple(bindings),
+                ctx_params=ctx_params,
+                outputs=outputs,
+                output_slots=tuple(slot_of((node_id, p)) for p in outputs),
+                concurrent=concurrent,
+                execution=execution,
+                pure=pure,
+                ttl=ttl,
+                cost=cost,
+                critical=critical,
+            )
+        )
+
+    # ------------------------------------------------------------------
+    # Dependencies between scheduled nodes (by position in *order*)
+    # ------------------------------------------------------------------
+    position = {nid: i for i, nid in enumerate(order)}
+    successors: List[List[int]] = [[] for _ in order]
+    indegree: List[int] = [0] * len(order)
+    for i, nid in enumerate(order):
+        for m in adj[nid]:
+            j = position.get(m)
+            if j is None:
+                continue  # part of a cycle – never scheduled
+            successors[i].append(j)
+            indegree[j] += 1
+
+    # Blocks that opt out of concurrency are chained in topological order so
+    # their side effects always happen in the same sequence.
+    serial = [i for i, p in enumerate(plans) if p.fn is not None and not p.concurrent]
+    for i, j in zip(serial, serial[1:]):
+        successors[i].append(j)
+        indegree[j] += 1
+
+    # Flow constants become the initial value of their slot
+    constant_slots = [
+        (slot_of(_port_key(name)), value) for name, value in graph_dict.get("constants", {}).items()
+    ]
+    initial: List[Any] = [_UNSET] * len(ports)
+    for port_key, value in literals:
+        initial[slots[port_key]] = value
+    for slot, value in constant_slots:
+        initial[slot] = value
 
-        # *Placeholder* nodes (e.g. "__slash__") have no backing function.
-        if not hasattr(mod, code_id):
-            return  # nothing to execute – their outputs come from constants
+    consumers = array("l", bytes(array("l").itemsize * len(ports)))
+    for p in plans:
+        for binding in p.inputs:
+            if binding.source != NO_SOURCE:
+                consumers[binding.source] += 1
 
-        fn = getattr(mod, code_id)
-        sig = inspect.signature(fn)
+    succ_offsets = array("l", [0])
+    succ_targets = array("l")
+    for targets in successors:
+        succ_targets.extend(targets)
+        succ_offsets.append(len(succ_targets))
+
+    plan = CompiledGraph(
+        key=key,
+        digest=digest,
+        module_name=module_name,
+        order=tuple(plans),
+        succ_offsets=succ_offsets,
+        succ_targets=succ_targets,
+        indegree=array("l", indegree),
+        ports=tuple(ports),
+        slots=MappingProxyType(slots),
+        initial=tuple(initial),
+        max_concurrency=max_concurrency,
+        lazy=lazy,
+        consumers=consumers,
+        validated=validated,
+    )
+    _PLAN_CACHE[key] = plan
+    return plan
+
+
+async def run_graph(
+    graph: Union[str, Mapping[str, Any], CompiledGraph],
+    module_name: Optional[str] = None,
+    *,
+    constants: Optional[Mapping[str, Any]] = None,
+    max_concurrency: Optional[int] = None,
+    deadline: Optional[float] = None,
+    **extra_ctx: Any,
+) -> Mapping[PortKey, Any]:
+    """Execute *graph* and return a mapping of ``(nodeId, port) → value``.
+
+    Parameters
+    ----------
+    graph:
+        A :class:`CompiledGraph`, the raw ``dict`` exported by the React
+        canvas *or* its JSON representation.
+    module_name:
+        Name of the Python module that contains the user's *block* functions
+        (several may be given, comma separated). Only required when *graph*
+        has not been compiled yet.
+    constants:
+        Per-invocation ``"component.port" → value`` pairs, layered over the
+        constants stored in the flow itself. Ports the plan never reads are
+        ignored; the plan itself is not copied.
+    max_concurrency:
+        How many awaiting blocks may be in flight at once (a positive int).
+        Defaults to the flow's ``maxConcurrency`` or
+        :data:`DEFAULT_MAX_CONCURRENCY`.
+    deadline:
+        :func:`time.monotonic` time after which non-critical blocks
+        (``@block(critical=False)``) are no longer started and those still
+        running are cancelled; their outputs become ``None``.
+    **extra_ctx:
+        Variables that should be *implicitly* available to every block - e.g.
+        the active Discord ``bot`` instance, the current ``interaction``, etc.
+
+    Nodes are started as soon as all of their inputs are available, so
+    independent branches await their blocks concurrently and a run takes
+    roughly as long as its critical path.
+    """
+
+    if isinstance(graph, CompiledGraph):
+        plan = graph
+    else:
+        if module_name is None:
+            raise TypeError("module_name is required when running an uncompiled graph")
+        plan = compile_graph(graph, module_name)
+
+    # One value per slot, pre‑filled with the flow's constants and the overlay
+    values: List[Any] = list(plan.initial)
+    if constants:
+        slots = plan.slots
+        for name, value in constants.items():
+            slot = slots.get(_port_key(name))
+            if slot is not None:
+                values[slot] = value
+
+    instruments = tuple(instrumentation.active)
+
+    # Lazy plans free each value once every input reading it has done so
+    refs: Optional[array] = array("l", plan.consumers) if plan.lazy else None
+
+    def consume(source: int) -> None:
+        refs[source] -= 1  # type: ignore[index]
+        if refs[source] == 0:  # type: ignore[index]
+            values[source] = _UNSET
+
+    # --------------------  node execution ------------------------------
+    def start_node(node: NodePlan) -> Any:
+        """Call *node*'s block; return its awaitable, or ``None`` when done."""
+
+        fn = node.fn
+        if fn is None:
+            return None  # nothing to execute – their outputs come from constants
 
         # -------- build **kwargs for the call ---------------------
         kwargs: Dict[str, Any] = {}
-        for port in node.get("inputs", []):
-            pname: str = port["name"]
-            key: PortKey = (node_id, pname)
+        for binding in node.inputs:
+            pname = binding.port
+            source = binding.source
 
             # 1️⃣ constant / previously‑computed value ------------------
-            if key in cache:
-                kwargs[pname] = cache[key]
-                continue
-
+            value = values[binding.slot]
+            if value is not _UNSET:
+                kwargs[pname] = value
+                if refs is not None and source != NO_SOURCE:
+                    consume(source)
             # 2️⃣ connected edge ---------------------------------------
-            edge = next(
-                (
-                    e
-                    for e in edges
-                    if _tgt(e) == node_id and e["targetPort"] == pname
-                ),
-                None,
-            )
-            if edge is not None:
-                val_key = (_src(edge), edge["sourcePort"])
-                kwargs[pname] = cache[val_key]
-                continue
-
+            elif source != NO_SOURCE:
+                value = values[source]
+                if value is _UNSET:
+                    raise KeyError(plan.ports[source])
+                kwargs[pname] = value
+                if refs is not None:
+                    consume(source)
             # 3️⃣ default specified in function signature --------------
-            param = sig.parameters.get(pname)
-            if param and param.default is not inspect._empty:  # type: ignore[attr-defined]
-                kwargs[pname] = param.default
-                continue
-
+            elif binding.default is not _MISSING:
+                kwargs[pname] = binding.default
             # 4️⃣ total failure → explicit error -----------------------
-            raise ValueError(
-                f"Input port '{pname}' on node '{node['label']}' (id={node_id}) "
-                "is unconnected and has no default or constant value."
-            )
+            else:
+                raise ValueError(
+                    f"Input port '{pname}' on node '{node.label}' (id={node.node_id}) "
+                    "is unconnected and has no default or constant value."
+                )
+
+        # -------- instrumentation (skipped entirely when disabled) -
+        span = None
+        if instruments:
+            span = instrumentation.NodeSpan(plan.key[0], node.node_id, node.code_id, kwargs)
+            for instrument in instruments:
+                instrument.before_node(span)
 
         # -------- inject **extra_ctx if accepted -------------------
-        if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in sig.parameters.values()):
+        if node.ctx_params is None:
             # function has a **kwargs – give it everything
             kwargs.update(extra_ctx)
         else:
             # only pass named extra vars the function explicitly wants
             for name, val in extra_ctx.items():
-                if name in sig.parameters and name not in kwargs:
+                if name in node.ctx_params and name not in kwargs:
                     kwargs[name] = val
 
-        # -------- call (and await if needed) ----------------------
-        result = fn(**kwargs)
-        if inspect.isawaitable(result):
-            result = await result
+        # -------- pure blocks: reuse an earlier identical call -----
+        memo_key = None
+        if node.pure:
+            memo_key = memo.results.make_key(fn, kwargs)
+            if memo_key is None:
+                memo.results.uncacheable += 1
+            else:
+                hit = memo.results.get(memo_key)
+                if hit is not memo.MISS:
+                    if span is not None:
+                        span.cached = True
+                        instrumentation.finish(span, instruments, hit)
+                    store_result(node, hit)
+                    return None
+
+        # -------- offload heavy sync blocks to the shared pools ----
+        if node.execution != "inline":
+            pending = run_in_pool(node.execution, fn, kwargs)
+        else:
+            # -------- call; sync results are stored straight away -
+            cpu_start = time.thread_time() if span is not None else 0.0
+            try:
+                pending = fn(**kwargs)
+            except BaseException as exc:
+                if span is not None:
+                    instrumentation.finish(span, instruments, error=exc)
+                raise
+            if span is not None:
+                span.cpu = time.thread_time() - cpu_start
+
+            if not inspect.isawaitable(pending):
+                if span is not None:
+                    instrumentation.finish(span, instruments, pending)
+                if memo_key is not None:
+                    memo.results.put(memo_key, pending, node.ttl)
+                store_result(node, pending)
+                return None
+
+        if span is not None:
+            pending = instrumentation.traced(pending, span, instruments)
+        return pending if memo_key is None else _memoize(pending, memo_key, node.ttl)
+
+    def store_degraded(node: NodePlan) -> None:
+        """Give every output of a skipped or cancelled non-critical *node* ``None``."""
 
-        # -------- fan‑out result to cache -------------------------
-        outs = node.get("outputs", [])
+        for slot in node.output_slots:
+            if refs is None or refs[slot]:
+                values[slot] = None
+
+    def store_result(node: NodePlan, result: Any) -> None:
+        """Fan *result* out to the slots of *node*'s output ports."""
+
+        outs = node.outputs
         if not outs:
             return  # nothing declared → nothing stored
 
         if len(outs) == 1:
-            cache[(node_id, outs[0]["name"])] = result
-        else:
-            # Multiple declared outputs – expect a mapping from fn
-            if not isinstance(result, Mapping):
-                raise TypeError(
-                    f"Block '{code_id}' declares {len(outs)} outputs but returned a "
-                    f"{type(result).__name__}; expected a dict port→value."
+            slot = node.output_slots[0]
+            # lazy runs only keep ports somebody downstream is still going to read
+            if refs is None or refs[slot]:
+                values[slot] = result
+            return
+
+        # Multiple declared outputs – expect a mapping from fn
+        if not isinstance(result, Mapping):
+            raise TypeError(
+                f"Block '{node.code_id}' declares {len(outs)} outputs but returned a "
+                f"{type(result).__name__}; expected a dict port→value."
+            )
+        for pname, slot in zip(outs, node.output_slots):
+            if refs is not None and not refs[slot]:
+                continue
+            if pname not in result:
+                raise KeyError(
+                    f"Block '{node.code_id}' did not return a value for output port '{pname}'."
                 )
-            for port_meta in outs:
-                pname = port_meta["name"]
-                if pname not in result:
-                    raise KeyError(
-                        f"Block '{code_id}' did not return a value for output port '{pname}'."
-                    )
-                cache[(node_id, pname)] = result[pname]
+            values[slot] = result[pname]
 
     # ------------------------------------------------------------------
-    # Topological execution (Kahn)
+    # Ready-set scheduling over the precomputed dependencies
     # ------------------------------------------------------------------
-    while queue:
-        nid = queue.pop(0)
-        await exec_node(nid)
-        for m in adj[nid]:
-            incoming[m] -= 1
-            if incoming[m] == 0:
-                queue.append(m)
+    order = plan.order
+    limit = check_concurrency(max_concurrency) or plan.max_concurrency or DEFAULT_MAX_CONCURRENCY
+    remaining = list(plan.indegree)
+    ready = [i for i, deg in enumerate(remaining) if deg == 0]  # min-heap → topo order
+    running: Dict[asyncio.Future, int] = {}
+
+    offsets, targets = plan.succ_offsets, plan.succ_targets
+
+    def release(i: int) -> None:
+        for j in targets[offsets[i]:offsets[i + 1]]:
+            remaining[j] -= 1
+            if remaining[j] == 0:
+                heapq.heappush(ready, j)
+
+    overdue = False  # the deadline passed and non-critical blocks were dropped
+
+    try:
+        while ready or running:
+            while ready and len(running) < limit:
+                i = heapq.heappop(ready)
+                node = order[i]
+                if deadline is not None and not node.critical and time.monotonic() >= deadline:
+                    store_degraded(node)  # degrade instead of starting it
+                    release(i)
+                    continue
+                pending = start_node(node)
+                if pending is None:
+                    release(i)
+                else:
+                    running[asyncio.ensure_future(pending)] = i
+
+            if not running:
+                continue
+
+            timeout = None
+            if deadline is not None and not overdue and not all(order[i].critical for i in running.values()):
+                timeout = max(deadline - time.monotonic(), 0.0)
+
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # out of time – give up on non-critical blocks still in flight
+                overdue = True
+                for task, i in running.items():
+                    if not order[i].critical:
+                        task.cancel()
+                continue
+
+            for task in sorted(done, key=running.__getitem__):
+                i = running.pop(task)
+                node = order[i]
+                if task.cancelled() and not node.critical:
+                    store_degraded(node)
+                else:
+                    store_result(node, task.result())
+                release(i)
+    finally:
+        # A block failed (or we were cancelled) – don't leave orphans behind
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
 
-    return cache
+    return PortValues(plan, values)
@@ -0,0 +1,182 @@
+"""
+instrumentation.py
+
+Hooks the graph runner calls around every block, plus a built-in collector
+that aggregates latency percentiles per ``code_id``
+
+Nothing is timed unless an instrument is registered with
+:func:`add_instrument`; the runner checks :data:`active` once per run.
+"""
+import os
+import sys
+import time
+import types
+from collections import deque
+from typing import Any, Deque, Dict, List, Mapping, Optional
+
+
+class NodeSpan:
+    """Timing and size information for one block call (times in seconds)"""
+
+    __slots__ = (
+        "flow", "node_id", "code_id", "started", "wall", "cpu",
+        "input_bytes", "output_bytes", "cached", "error",
+    )
+
+    def __init__(self, flow: Any, node_id: str, code_id: str, inputs: Mapping[str, Any]):
+        self.flow = flow
+        self.node_id = node_id
+        self.code_id = code_id
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.input_bytes = sum(sys.getsizeof(v) for v in inputs.values())
+        self.output_bytes = 0
+        self.cached = False
+        self.error: Optional[BaseException] = None
+
+    @property
+    def await_time(self) -> float:
+        """Time spent suspended (network, pools, …) rather than on this thread"""
+        return max(self.wall - self.cpu, 0.0)
+
+
+class Instrument:
+    """Base class for runner instrumentation; override the hooks you need"""
+
+    def before_node(self, span: NodeSpan) -> None:
+        pass
+
+    def after_node(self, span: NodeSpan) -> None:
+        pass
+
+
+# Instruments every run reports to
+active: List[Instrument] = []
+
+
+def add_instrument(instrument: Instrument) -> None:
+    if instrument not in active:
+        active.append(instrument)
+
+
+def remove_instrument(instrument: Instrument) -> None:
+    if instrument in active:
+        active.remove(instrument)
+
+
+# ---------------  Span helpers used by the runner ------------
+
+def finish(span: NodeSpan, instruments: List[Instrument], result: Any = None,
+           error: Optional[BaseException] = None) -> None:
+    span.wall = time.perf_counter() - span.started
+    span.error = error
+    if error is None:
+        span.output_bytes = sys.getsizeof(result)
+    for instrument in instruments:
+        instrument.after_node(span)
+
+
+@types.coroutine
+def traced(awaitable: Any, span: NodeSpan, instruments: List[Instrument]):
+    """Await *awaitable*, adding the CPU time of each of its steps to *span*"""
+    it = awaitable.__await__()
+    value: Any = None
+    exc: Optional[BaseException] = None
+    while True:
+        start = time.thread_time()
+        try:
+            future = it.throw(exc) if exc is not None else it.send(value)
+        except StopIteration as stop:
+            span.cpu += time.thread_time() - start
+            finish(span, instruments, stop.value)
+            return stop.value
+        except BaseException as error:
+            span.cpu += time.thread_time() - start
+            finish(span, instruments, error=error)
+            raise
+        span.cpu += time.thread_time() - start
+
+        try:
+            value, exc = (yield future), None
+        except BaseException as error:
+            value, exc = None, error
+
+
+# ---------------  Built-in collector -------------------------
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class _BlockSamples:
+    __slots__ = ("calls", "errors", "cached", "wall", "cpu", "wait", "input_bytes", "output_bytes")
+
+    def __init__(self, window: int):
+        self.calls = 0
+        self.errors = 0
+        self.cached = 0
+        self.wall: Deque[float] = deque(maxlen=window)
+        self.cpu: Deque[float] = deque(maxlen=window)
+        self.wait: Deque[float] = deque(maxlen=window)
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+
+class LatencyCollector(Instrument):
+    """Keeps the last *window* samples per ``code_id`` and reports p50/p95/p99"""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.blocks: Dict[str, _BlockSamples] = {}
+
+    def after_node(self, span: NodeSpan) -> None:
+        samples = self.blocks.get(span.code_id)
+        if samples is None:
+            samples = self.blocks[span.code_id] = _BlockSamples(self.window)
+
+        samples.calls += 1
+        samples.errors += span.error is not None
+        samples.cached += span.cached
+        samples.wall.append(span.wall)
+        samples.cpu.append(span.cpu)
+        samples.wait.append(span.await_time)
+        samples.input_bytes += span.input_bytes
+        samples.output_bytes += span.output_bytes
+
+    def percentile(self, code_id: str, q: float, min_samples: int = 20) -> Optional[float]:
+        """Wall-time *q* quantile (seconds) of *code_id*, or ``None`` with too few samples"""
+        samples = self.blocks.get(code_id)
+        if samples is None or len(samples.wall) < min_samples:
+            return None
+        return _percentile(sorted(samples.wall), q)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """``code_id → stats``, latencies in milliseconds"""
+        out: Dict[str, Dict[str, Any]] = {}
+        for code_id, s in sorted(self.blocks.items()):
+            stats: Dict[str, Any] = {
+                "calls": s.calls,
+                "errors": s.errors,
+                "cached": s.cached,
+                "avg_input_bytes": s.input_bytes / s.calls,
+                "avg_output_bytes": s.output_bytes / s.calls,
+            }
+            for name, values in (("wall", s.wall), ("cpu", s.cpu), ("await", s.wait)):
+                ordered = sorted(values)
+                for q in (50, 95, 99):
+                    stats[f"{name}_p{q}_ms"] = _percentile(ordered, q / 100) * 1000
+            out[code_id] = stats
+        return out
+
+    def reset(self) -> None:
+        self.blocks.clear()
+
+
+# Process-wide collector; registered when RUNNER_PROFILING=1
+collector = LatencyCollector()
+
+if os.environ.get("RUNNER_PROFILING") == "1":
+    add_instrument(collector)
@@ -0,0 +1,90 @@
+"""
+memo.py
+
+Process-wide result cache for pure blocks (``@block(..., pure=True)``)
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+# Sentinel returned by :meth:`ResultCache.get` on a miss
+MISS = object()
+
+MEMO_MAX_ENTRIES = int(os.environ.get("BLOCK_MEMO_MAX_ENTRIES", 4096))
+
+
+class ResultCache:
+    """Size-bounded LRU of block results with optional per-entry TTLs."""
+
+    def __init__(self, maxsize: int = MEMO_MAX_ENTRIES):
+        self.maxsize = maxsize
+        # key → (expires_at or None, value)
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(fn: Callable[..., Any], kwargs: Mapping[str, Any]) -> Optional[Hashable]:
+        """Key for ``fn(**kwargs)``, or ``None`` if an argument is unhashable."""
+
+        key = (fn.__module__, fn.__qualname__, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISS
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISS
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, fn: Optional[Callable[..., Any]] = None) -> int:
+        """Drop every entry (or only those of *fn*); return how many went."""
+
+        if fn is None:
+            dropped = len(self._data)
+            self._data.clear()
+            return dropped
+
+        prefix = (fn.__module__, fn.__qualname__)
+        stale = [k for k in self._data if k[:2] == prefix]
+        for k in stale:
+            del self._data[k]
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "evictions": self.evictions,
+        }
+
+
+# Shared by every flow run in this process
+results = ResultCache()
@@ -0,0 +1,187 @@
+"""
+outbox.py
+
+Issues the Discord side effects of a flow run (sends, edits) in the
+background, coalescing the ones still waiting and batching them per channel
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+# Join consecutive plain-text sends to one channel into a single message
+OUTBOX_MERGE_SENDS = os.environ.get("OUTBOX_MERGE_SENDS") == "1"
+
+# Discord's limit for message content
+MAX_MESSAGE_LENGTH = 2000
+
+
+class OutboxStats:
+    """How many actions flows asked for vs. how many API calls were made"""
+
+    def __init__(self) -> None:
+        self.requested: Dict[str, int] = {"send": 0, "edit": 0}
+        self.issued: Dict[str, int] = {"send": 0, "edit": 0}
+        self.coalesced_edits = 0
+        self.merged_sends = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requested": dict(self.requested),
+            "issued": dict(self.issued),
+            "coalesced_edits": self.coalesced_edits,
+            "merged_sends": self.merged_sends,
+        }
+
+
+class _Action:
+    __slots__ = ("kind", "target", "content")
+
+    def __init__(self, kind: str, target: Any, content: Any):
+        self.kind = kind  # "send" (target: channel) | "edit" (target: message)
+        self.target = target
+        self.content = content
+
+
+def _channel_key(action: _Action) -> Any:
+    channel = action.target if action.kind == "send" else getattr(action.target, "channel", None)
+    return getattr(channel, "id", None) or id(channel)
+
+
+class Outbox:
+    """Side effects of one flow run, issued as soon as the run yields.
+
+    Queued actions are drained in the background whenever the runner waits
+    (on a block, the network, …), so a "working…" message shows up before a
+    slow block finishes. Only actions still queued are coalesced:
+
+    - Consecutive edits of the same message (nothing else queued for that
+      channel in between) collapse into one edit with the final content.
+    - With *merge_sends*, consecutive plain-text sends to the same channel
+      (nothing else queued for that channel in between) become one message,
+      as long as it fits in :data:`MAX_MESSAGE_LENGTH`.
+    - Channels are issued concurrently, each channel's actions in order, so
+      a flow never has two requests racing for the same channel bucket.
+
+    :meth:`flush` waits for whatever is still queued or in flight and raises
+    the first error any of it hit; call it when the run ends, failed or not.
+    """
+
+    def __init__(self, *, merge_sends: bool = OUTBOX_MERGE_SENDS, stats: Optional[OutboxStats] = None):
+        self.merge_sends = merge_sends
+        self.stats = stats or OutboxStats()
+        self._actions: List[_Action] = []
+        self._edits: Dict[int, _Action] = {}  # message id → its queued edit
+        self._last: Dict[Any, _Action] = {}  # channel key → last action queued for it
+        self._drainer: Optional[asyncio.Task] = None
+        self._errors: List[BaseException] = []
+
+    def send(self, channel: Any, content: Any) -> None:
+        self.stats.requested["send"] += 1
+        action = _Action("send", channel, content)
+        key = _channel_key(action)
+
+        last = self._last.get(key)
+        if (
+            self.merge_sends
+            and last is not None
+            and last.kind == "send"
+            and isinstance(last.content, str)
+            and isinstance(content, str)
+            and len(last.content) + 1 + len(content) <= MAX_MESSAGE_LENGTH
+        ):
+            last.content = f"{last.content}\n{content}"
+            self.stats.merged_sends += 1
+            return
+
+        self._queue(action)
+        self._last[key] = action
+
+    def edit(self, message: Any, content: Any) -> None:
+        self.stats.requested["edit"] += 1
+        queued = self._edits.get(message.id)
+        if queued is not None and self._last.get(_channel_key(queued)) is queued:
+            queued.content = content  # only the final text is ever seen
+            self.stats.coalesced_edits += 1
+            return
+
+        action = _Action("edit", message, content)
+        self._queue(action)
+        self._edits[message.id] = action
+        self._last[_channel_key(action)] = action
+
+    def __len__(self) -> int:
+        return len(self._actions)
+
+    def _queue(self, action: _Action) -> None:
+        self._actions.append(action)
+        if self._drainer is None or self._drainer.done():
+            try:
+                self._drainer = asyncio.get_running_loop().create_task(self._drain())
+            except RuntimeError:
+                pass  # no loop: issued by the next flush()
+
+    def _take(self) -> List[_Action]:
+        """Everything queued so far; later actions no longer coalesce with it"""
+        actions, self._actions = self._actions, []
+        self._edits.clear()
+        self._last.clear()
+        return actions
+
+    async def _flush_channel(self, actions: List[_Action]) -> None:
+        for action in actions:
+            if action.kind == "send":
+                await action.target.send(action.content)
+            else:
+                await action.target.edit(content=action.content)
+            self.stats.issued[action.kind] += 1
+
+    async def _issue(self, actions: List[_Action]) -> None:
+        by_channel: Dict[Any, List[_Action]] = {}
+        for action in actions:
+            by_channel.setdefault(_channel_key(action), []).append(action)
+
+        results = await asyncio.gather(
+            *(self._flush_channel(group) for group in by_channel.values()),
+            return_exceptions=True,
+        )
+        self._errors.extend(r for r in results if isinstance(r, BaseException))
+
+    async def _drain(self) -> None:
+        await asyncio.sleep(0)  # let blocks finishing in the same step queue theirs too
+        while self._actions:
+            await self._issue(self._take())
+
+    async def flush(self) -> None:
+        """Issue everything queued so far and wait until it has been sent"""
+        if self._drainer is not None:
+            await self._drainer
+        while self._actions:
+            await self._issue(self._take())
+
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+
+def bucket_utilization(http: Any) -> Dict[str, Dict[str, Any]]:
+    """Per rate-limit bucket usage as tracked by discord.py's HTTP client.
+
+    Reads the client's internal bucket table, so it degrades to ``{}`` if a
+    discord.py release changes it.
+    """
+    buckets = getattr(http, "_buckets", None)
+    if not isinstance(buckets, dict):
+        return {}
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for key, bucket in list(buckets.items()):
+        limit = getattr(bucket, "limit", 0) or 0
+        remaining = getattr(bucket, "remaining", 0) or 0
+        out[key] = {
+            "limit": limit,
+            "remaining": remaining,
+            "outgoing": getattr(bucket, "outgoing", 0),
+            "reset_after": getattr(bucket, "reset_after", 0.0),
+            "utilization": (limit - remaining) / limit if limit else 0.0,
+        }
+    return out
@@ -1,101 +1,440 @@
+import asyncio
 import os
+import time
 import discord
-import json
-import pathlib
 from inspect import Parameter, Signature
+from typing import Dict, List, Optional, Set, Tuple
 
-import requests
-from .graph_runner import run_graph
+from . import instrumentation, variables
+from .api_client import FlowClient
+from .blocks import BLOCK_MODULES
+from .channels import ChannelResolver
+from .graph_runner import CompiledGraph, GraphValidationError, compile_graph, estimate_cost, run_graph
+from .outbox import Outbox, OutboxStats, bucket_utilization
+from .scheduler import SCHEDULE, Schedule, Scheduler, schedule_for
+from .sharding import ShardMetrics, shard_for_guild
+from .triggers import EVENT_TRIGGERS, EventContext, Trigger, TriggerIndex, TriggerMetrics, trigger_for
+from .validation import PY_TYPES
 import api.graph_workspace.globals as globals
 from discord import app_commands
 
+# Seconds between checks for edited flows (0 disables hot reload)
+FLOW_RELOAD_INTERVAL = float(os.environ.get('FLOW_RELOAD_INTERVAL', 30))
 
-API_BASE_URL = os.environ.get('API_BASE_URL', "http://127.0.0.1:8000")
+BLOCK_MODULE = ",".join(BLOCK_MODULES)
 
+# Discord wants a first response within 3 s; follow-ups work for 15 minutes
+# Defer straight away when a flow is predicted to take longer than this
+AUTO_DEFER_THRESHOLD = float(os.environ.get('AUTO_DEFER_THRESHOLD', 2.0))
+# …and in any case once this many seconds passed without a response
+AUTO_DEFER_AFTER = float(os.environ.get('AUTO_DEFER_AFTER', 2.5))
+INTERACTION_TOKEN_LIFETIME = 15 * 60
+# Non-critical blocks are dropped this many seconds before the token expires
+INTERACTION_DEADLINE_MARGIN = float(os.environ.get('INTERACTION_DEADLINE_MARGIN', 5))
+# Seconds a flow's predicted cost is reused before being recomputed
+COST_ESTIMATE_TTL = 10.0
 
-class FlowBot(discord.Client):
-    def __init__(self):
-        super().__init__(intents=discord.Intents.default())
+# Privileged intents to request (comma separated, e.g. "message_content,members");
+# they must also be enabled for the bot in the developer portal
+PRIVILEGED_INTENTS = [i.strip() for i in os.environ.get('BOT_PRIVILEGED_INTENTS', '').split(',') if i.strip()]
+# Event-triggered flow runs in flight at once; matches beyond that are shed
+TRIGGER_MAX_CONCURRENCY = int(os.environ.get('TRIGGER_MAX_CONCURRENCY', 64))
+
+
+def bot_intents() -> discord.Intents:
+    intents = discord.Intents.default()
+    for name in PRIVILEGED_INTENTS:
+        setattr(intents, name, True)
+    return intents
+
+
+class FlowBot(discord.AutoShardedClient):
+    def __init__(self, *, shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None):
+        # no shard_ids/shard_count → discord.py runs every shard Discord recommends
+        super().__init__(
+            intents=bot_intents(),
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+        )
         self.tree = app_commands.CommandTree(self)
+        self.api = FlowClient()
+        self.shard_metrics = ShardMetrics()
+        # shared by every bot in the process; variables are namespaced per application
+        self.variables = variables.default_store()
+        # channel id → channel for blocks, kept fresh by the channel events below
+        self.channels = ChannelResolver(self)
+
+        # command name → (slash node, compiled plan); swapped as a whole on reload
+        self.routes: Dict[str, Tuple[dict, CompiledGraph]] = {}
+        # command name → (description, options) as last synced with Discord
+        self.surface: Dict[str, tuple] = {}
+        # plan key → (computed at, predicted seconds)
+        self._estimates: Dict[tuple, Tuple[float, float]] = {}
+        self.deferrals = {"predicted": 0, "watchdog": 0}
+        # gateway events → the flows they start; swapped as a whole on reload
+        self.triggers = TriggerIndex()
+        self.trigger_metrics = TriggerMetrics()
+        self._trigger_runs: Set[asyncio.Task] = set()
+        # reload/refresh/scheduler loops started by setup_hook, cancelled by close
+        self._background: Set[asyncio.Task] = set()
+        # only the bot holding shard 0 runs schedules, so sharded bots fire them once
+        self.runs_schedules = shard_ids is None or 0 in shard_ids
+        self.scheduler = Scheduler(self.run_schedule)
+        # sends/edits requested by flows vs. API calls actually made
+        self.outbox_stats = OutboxStats()
 
     async def setup_hook(self):
-        flows = requests.get(f'{API_BASE_URL}/api/flows').json()
-
-        PY_TYPES = {"string": str, "integer": int, "boolean": bool}
-
-        def build_handler(node: dict, flow: dict):
-            """Return a coroutine whose signature mirrors node['options']"""
-            # ---------- build the extra parameters ----------
-            extra_params = []
-            for opt in node.get("options", []):
-                extra_params.append(
-                    Parameter(
-                        opt["name"],                               # ← slash-option name
-                        kind=Parameter.POSITIONAL_OR_KEYWORD,
-                        annotation=PY_TYPES.get(opt["type"], str), # str/int/bool…
-                        default=Parameter.empty                   # omit default → required
-                    )
+        self.variables.start()
+        # schedules are persisted per application, like variables
+        self.scheduler.namespace = str(self.application_id or "")
+
+        snapshot = self.api.load_snapshot()
+        if snapshot is None:
+            await self.load_flows(await self.api.fetch_flows())
+        else:
+            # boot from the last known flows, catch up with the API afterwards
+            await self.load_flows(snapshot)
+            self._background.add(asyncio.create_task(self.refresh_flows()))
+
+        if FLOW_RELOAD_INTERVAL > 0:
+            self._background.add(asyncio.create_task(self.reload_forever()))
+        if self.runs_schedules:
+            self._background.add(asyncio.create_task(self.scheduler.run_forever()))
+
+    async def close(self):
+        # stop everything that could still call the API or Discord before closing them
+        tasks = [*self._background, *self._trigger_runs]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._background.clear()
+        try:
+            await self.variables.flush()
+        except Exception as exc:
+            print(f"Variable flush on close failed: {exc!r}")
+        await self.api.close()
+        await super().close()
+
+    async def load_flows(self, flows: list) -> Set[str]:
+        """Compile *flows* and make them live; return the commands that changed shape
+
+        Plans are cached by flow id and content hash, so only edited flows are
+        recompiled. Slash commands are only re-registered (and the tree only
+        synced) when a command was added, removed, or its description or
+        options changed. Flows called through sub-flow nodes are compiled
+        once and shared by every command that calls them.
+        """
+        routes: Dict[str, Tuple[dict, CompiledGraph]] = {}
+        surface: Dict[str, tuple] = {}
+        triggers: List[Trigger] = []
+        schedules: List[Schedule] = []
+        library = {flow["flowId"]: flow for flow in flows if "flowId" in flow}
+
+        # One slash command for each start_command node, one trigger per event node
+        for flow in flows:
+            for node in flow["nodes"]:
+                if node["code_id"] in EVENT_TRIGGERS or node["code_id"] == SCHEDULE:
+                    try:
+                        plan = compile_graph(flow, module_name=BLOCK_MODULE, lazy=True, subflows=library)
+                        if node["code_id"] == SCHEDULE:
+                            schedules.append(schedule_for(flow.get("flowId"), node, plan))
+                        else:
+                            triggers.append(trigger_for(node, plan))
+                    except (GraphValidationError, ValueError) as exc:
+                        print(f"Skipping {node['code_id']} trigger of flow {flow.get('flowId')}: {exc}")
+                    continue
+                if node["code_id"] != "__slash__":
+                    continue
+                cmd_name = node["command"]
+                try:
+                    plan = compile_graph(flow, module_name=BLOCK_MODULE, lazy=True, subflows=library)
+                except GraphValidationError as exc:
+                    # e.g. a flow it calls was deleted; leave the command out
+                    print(f"Skipping /{cmd_name}: {exc}")
+                    continue
+                routes[cmd_name] = (node, plan)
+                surface[cmd_name] = (
+                    node["description"],
+                    tuple((opt["name"], opt["type"]) for opt in node.get("options", [])),
+                )
+
+        changed = {
+            name for name in surface.keys() | self.surface.keys()
+            if surface.get(name) != self.surface.get(name)
+        }
+        for cmd_name in changed:
+            self.tree.remove_command(cmd_name)
+            if cmd_name not in surface:
+                continue
+
+            # Register it manually via Command object
+            self.tree.add_command(
+                app_commands.Command(
+                    name        = cmd_name,
+                    description = surface[cmd_name][0],
+                    callback    = self.build_handler(cmd_name, routes[cmd_name][0]),
                 )
+            )
 
-            # ---------- the real coroutine ----------
-            async def _handler(interaction: discord.Interaction, **kwargs):
-                # push option values into the graph as constants
-                consts = {f"{node['id']}.{k}": v for k, v in kwargs.items()}
+        # handlers look their plan up per call, so this swap is all a reload needs
+        self.routes = routes
+        self.surface = surface
+        self.triggers = TriggerIndex(triggers)
+        if (
+            not self.intents.message_content
+            and any(t.prefix or t.pattern is not None for t in triggers)
+        ):
+            print("Message triggers with a prefix or pattern need BOT_PRIVILEGED_INTENTS=message_content")
+        if self.runs_schedules:
+            await self.scheduler.load(schedules)
 
-                # 👇 NEW — satisfy the “ctx” output expected by the graph
-                consts[f"{node['id']}.ctx"] = interaction
+        if changed:
+            await self.tree.sync()
+        return changed
+
+    async def refresh_flows(self):
+        """Fetch flows (a cheap 304 when unchanged) and hot-swap any edits"""
+        try:
+            flows = await self.api.fetch_flows()
+            if flows is None:
+                return
+            changed = await self.load_flows(flows)
+        except Exception as exc:
+            print(f"Flow reload failed: {exc!r}")
+            return
+        if changed:
+            print(f"Re-synced commands: {', '.join(sorted(changed))}")
+
+    async def reload_forever(self):
+        """Poll the API and hot-swap edited flows into the running bot"""
+        while not self.is_closed():
+            await asyncio.sleep(FLOW_RELOAD_INTERVAL)
+            await self.refresh_flows()
+
+    def build_handler(self, cmd_name: str, node: dict):
+        """Return a coroutine whose signature mirrors node['options']"""
+        # ---------- build the extra parameters ----------
+        extra_params = []
+        for opt in node.get("options", []):
+            extra_params.append(
+                Parameter(
+                    opt["name"],                               # ← slash-option name
+                    kind=Parameter.POSITIONAL_OR_KEYWORD,
+                    annotation=PY_TYPES.get(opt["type"], str), # str/int/bool…
+                    default=Parameter.empty                   # omit default → required
+                )
+            )
 
-                # keep the old alias around in case blocks look it up directly
-                consts[f"{node['id']}.interaction"] = interaction
+        # ---------- the real coroutine ----------
+        async def _handler(interaction: discord.Interaction, **kwargs):
+            # always run the latest plan for this command
+            node, plan = self.routes[cmd_name]
 
-                flow_with_const = {
-                    **flow,
-                    "constants": {**flow.get("constants", {}), **consts},
-                }
+            # don't let a slow flow miss Discord's 3 s window
+            age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+            if self.predicted_cost(plan) > AUTO_DEFER_THRESHOLD:
+                if await self.defer(interaction):
+                    self.deferrals["predicted"] += 1
+            watchdog = asyncio.create_task(self.defer(interaction, delay=AUTO_DEFER_AFTER - age))
 
+            # push option values into the graph as constants
+            consts = {f"{node['id']}.{k}": v for k, v in kwargs.items()}
+
+            # 👇 NEW — satisfy the “ctx” output expected by the graph
+            consts[f"{node['id']}.ctx"] = interaction
+
+            # keep the old alias around in case blocks look it up directly
+            consts[f"{node['id']}.interaction"] = interaction
+
+            # sends/edits go out in the background as the flow runs; flush waits for the rest
+            outbox = Outbox(stats=self.outbox_stats)
+            try:
                 await run_graph(
-                    flow_with_const,              # no json.dumps needed
-                    module_name="api.graph_workspace.components",
+                    plan,
+                    constants=consts,
+                    deadline=time.monotonic() + INTERACTION_TOKEN_LIFETIME - INTERACTION_DEADLINE_MARGIN - age,
                     bot=interaction.client,
                     interaction=interaction,
+                    variables=self.variables,
+                    channels=self.channels,
+                    outbox=outbox,
                 )
+            finally:
+                # whatever ran before a failure still takes effect, as it did unbatched
+                try:
+                    await outbox.flush()
+                finally:
+                    watchdog.cancel()
+                    if watchdog.done() and not watchdog.cancelled() and watchdog.result():
+                        self.deferrals["watchdog"] += 1
 
-                if not interaction.response.is_done():
-                    await interaction.response.defer()
+            await self.defer(interaction)
 
-            # ---------- stitch the signature in ----------
-            _handler.__signature__ = Signature((
-                Parameter(
-                    "interaction",
-                    kind=Parameter.POSITIONAL_OR_KEYWORD,
-                    annotation=discord.Interaction
-                ),
-                *extra_params
-            ))
+        # ---------- stitch the signature in ----------
+        _handler.__signature__ = Signature((
+            Parameter(
+                "interaction",
+                kind=Parameter.POSITIONAL_OR_KEYWORD,
+                annotation=discord.Interaction
+            ),
+            *extra_params
+        ))
 
-            return _handler
+        return _handler
 
-        # Register one slash command for each start_command node
-        for flow in flows:
-            for node in flow["nodes"]:
-                if node["code_id"] != "__slash__":
-                    continue
-                cmd_name = node["command"]
-                handler  = build_handler(node, flow)
-
-                # Register it manually via Command object
-                self.tree.add_command(
-                    app_commands.Command(
-                        name        = cmd_name,
-                        description = node["description"],
-                        callback    = handler,
-                    )
-                )
+    def predicted_cost(self, plan: CompiledGraph) -> float:
+        """:func:`estimate_cost` of *plan*, cached for :data:`COST_ESTIMATE_TTL` seconds"""
+        now = time.monotonic()
+        cached = self._estimates.get(plan.key)
+        if cached is None or now - cached[0] > COST_ESTIMATE_TTL:
+            cached = self._estimates[plan.key] = (now, estimate_cost(plan))
+        return cached[1]
+
+    @staticmethod
+    async def defer(interaction: discord.Interaction, delay: float = 0.0) -> bool:
+        """Acknowledge *interaction* after *delay* seconds unless something
+        already responded; return whether this call deferred it"""
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if interaction.response.is_done():
+            return False
+        try:
+            await interaction.response.defer()
+        except discord.InteractionResponded:
+            return False
+        return True
+
+    # ---------- event triggers ----------
+    def start_triggers(self, event: str, guild_id: Optional[int], channel_id: Optional[int],
+                       ctx, outputs: dict, user, **match) -> int:
+        """Start the flows *event* triggers; return how many were started.
+
+        Matches that find all TRIGGER_MAX_CONCURRENCY slots taken are shed
+        rather than queued, so a burst can't pile up tasks without bound.
+        """
+        matches = self.triggers.match(event, guild_id, channel_id, **match)
+        free = max(TRIGGER_MAX_CONCURRENCY - len(self._trigger_runs), 0)
+        started, shed = matches[:free], matches[free:]
+        self.trigger_metrics.record(event, len(matches), len(shed))
+
+        # variable blocks read the same ids from this as from an interaction
+        context = EventContext(self.application_id, guild_id, channel_id, user)
+        for trigger, rest in started:
+            nid = trigger.node["id"]
+            consts = {f"{nid}.{port}": value for port, value in outputs.items()}
+            consts[f"{nid}.ctx"] = ctx
+            consts[f"{nid}.args"] = rest
+            task = asyncio.create_task(self.run_trigger(trigger.node, trigger.plan, consts, context))
+            self._trigger_runs.add(task)
+            task.add_done_callback(self._trigger_runs.discard)
+        return len(started)
+
+    async def run_trigger(self, node: dict, plan: CompiledGraph, consts: dict, context: EventContext):
+        """Run *plan*, started by its trigger *node* rather than an interaction"""
+        outbox = Outbox(stats=self.outbox_stats)
+        try:
+            await run_graph(
+                plan,
+                constants=consts,
+                bot=self,
+                interaction=context,
+                variables=self.variables,
+                channels=self.channels,
+                outbox=outbox,
+            )
+        except Exception as exc:
+            print(f"{node['code_id']} flow {plan.key[0]} failed: {exc!r}")
+        finally:
+            try:
+                await outbox.flush()
+            except Exception as exc:
+                print(f"{node['code_id']} flow {plan.key[0]} could not send: {exc!r}")
+
+    async def run_schedule(self, schedule: Schedule, fired_at):
+        nid = schedule.node["id"]
+        consts = {f"{nid}.ctx": fired_at, f"{nid}.fired_at": fired_at, f"{nid}.args": ""}
+        await self.run_trigger(
+            schedule.node, schedule.plan, consts, EventContext(self.application_id, None, None, None)
+        )
+
+    async def on_message(self, message: discord.Message):
+        if message.author == self.user:
+            return  # never trigger on our own messages
+        guild_id = message.guild.id if message.guild else None
+        self.start_triggers(
+            "message", guild_id, message.channel.id, message,
+            {"message": message, "content": message.content, "author": message.author, "channel": message.channel},
+            message.author,
+            content=message.content, from_bot=message.author.bot,
+        )
+
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if self.user is not None and payload.user_id == self.user.id:
+            return
+        self.start_triggers(
+            "raw_reaction_add", payload.guild_id, payload.channel_id, payload,
+            {"payload": payload, "emoji": str(payload.emoji), "user_id": payload.user_id,
+             "message_id": payload.message_id, "channel_id": payload.channel_id},
+            payload.member or discord.Object(payload.user_id),
+            emoji=str(payload.emoji), from_bot=bool(payload.member and payload.member.bot),
+        )
+
+    async def on_member_join(self, member: discord.Member):
+        self.start_triggers(
+            "member_join", member.guild.id, None, member,
+            {"member": member, "guild": member.guild},
+            member,
+            from_bot=member.bot,
+        )
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        # attribute the event to the shard of the guild it came from
+        shard_id = None
+        if args and self.shard_count:
+            guild_id = getattr(args[0], "guild_id", None) or getattr(getattr(args[0], "guild", None), "id", None)
+            if isinstance(guild_id, int):
+                shard_id = shard_for_guild(guild_id, self.shard_count)
+        self.shard_metrics.record(shard_id)
+        super().dispatch(event_name, *args, **kwargs)
+
+    def metrics(self) -> dict:
+        """Per-shard latency and event rates since the previous call, variable
+        store, outbox, channel cache, trigger and schedule counters, rate-limit
+        bucket usage, plus block latency percentiles when runner profiling is
+        enabled (process-wide)"""
+        latencies = [(sid, lat) for sid, lat in self.latencies if lat == lat]  # drop NaN (not connected)
+        stats = {
+            "shards": self.shard_metrics.snapshot(latencies),
+            "variables": self.variables.stats(),
+            "deferrals": dict(self.deferrals),
+            "outbox": self.outbox_stats.snapshot(),
+            "channels": self.channels.stats(),
+            "triggers": self.trigger_metrics.snapshot(),
+            "schedules": self.scheduler.stats(),
+            "buckets": bucket_utilization(self.http),
+        }
+        if instrumentation.collector in instrumentation.active:
+            stats["blocks"] = instrumentation.collector.snapshot()
+        return stats
+
+    # ---------- keep the channel cache honest ----------
+    async def on_guild_channel_update(self, before, after):
+        self.channels.invalidate(after.id)
+
+    async def on_guild_channel_delete(self, channel):
+        self.channels.invalidate(channel.id)
+
+    async def on_private_channel_delete(self, channel):
+        self.channels.invalidate(channel.id)
+
+    async def on_raw_thread_update(self, payload):
+        self.channels.invalidate(payload.thread_id)
 
-        await self.tree.sync()
+    async def on_raw_thread_delete(self, payload):
+        self.channels.invalidate(payload.thread_id)
 
     async def on_ready(self):
-        print(f"Logged in as {self.user}")
+        print(f"Logged in as {self.user} (shards {self.shard_ids or 'auto'} of {self.shard_count})")
 
 if __name__ == "__main__":
     FlowBot().run(globals.TOKEN)
@@ -0,0 +1,375 @@
+"""
+scheduler.py
+
+Runs flows on a timetable: "__schedule__" trigger nodes with either a
+5-field ``cron`` expression (UTC) or an ``interval`` in seconds
+
+Upcoming fire times are kept in a heap, so a tick costs O(log n) however
+many schedules are loaded. Each schedule's next fire time is persisted (in
+the :class:`~api.models.ScheduleState` table, or in memory with
+``SCHEDULE_BACKEND=memory``) *before* its run starts: a restart never fires
+a run twice, and a run missed while the bot was down fires once when it
+comes back.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+
+from .graph_runner import CompiledGraph
+
+SCHEDULE = "__schedule__"
+
+SCHEDULE_BACKEND = os.environ.get("SCHEDULE_BACKEND", "django")
+# Scheduled runs in flight at once, across all schedules of a bot
+SCHEDULE_MAX_CONCURRENCY = int(os.environ.get("SCHEDULE_MAX_CONCURRENCY", 16))
+
+# Longest the loop sleeps without re-reading the clock (copes with clock jumps)
+MAX_SLEEP = 60.0
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# name, lowest, highest
+_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+
+# ---------------  Cron expressions --------------------------
+
+def _parse_field(text: str, name: str, lo: int, hi: int) -> FrozenSet[int]:
+    values: Set[int] = set()
+    for part in text.split(","):
+        base, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, end = lo, hi
+            elif "-" in base:
+                start, end = (int(v) for v in base.split("-", 1))
+            else:
+                start = int(base)
+                end = hi if step_text else start
+        except ValueError:
+            raise ValueError(f"Invalid {name} field {text!r}") from None
+        if step < 1 or not lo <= start <= end <= hi:
+            raise ValueError(f"{name} field {text!r} is out of range {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSpec(NamedTuple):
+    """A parsed 5-field cron expression (minute hour day month weekday)"""
+
+    minutes: FrozenSet[int]
+    hours: FrozenSet[int]
+    days: FrozenSet[int]
+    months: FrozenSet[int]
+    weekdays: FrozenSet[int]  # 0 = Sunday
+    any_day: bool  # day field was "*"
+    any_weekday: bool  # weekday field was "*"
+
+    @classmethod
+    def parse(cls, expr: str) -> "CronSpec":
+        fields = _ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expr!r} needs 5 fields, got {len(fields)}")
+        minutes, hours, days, months, weekdays = (
+            _parse_field(text, name, lo, hi) for text, (name, lo, hi) in zip(fields, _FIELDS)
+        )
+        return cls(
+            minutes, hours, days, months,
+            frozenset(d % 7 for d in weekdays),  # 7 is Sunday too
+            fields[2].startswith("*"), fields[4].startswith("*"),
+        )
+
+    def _day_matches(self, moment: datetime) -> bool:
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays  # both restricted: either one will do, as in cron
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after *moment*"""
+        t = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        give_up = t.year + 5  # e.g. "0 0 31 2 *" never matches
+        while t.year <= give_up:
+            if t.month not in self.months:
+                t = t.replace(year=t.year + t.month // 12, month=t.month % 12 + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError("Cron expression never matches")
+
+
+# ---------------  Schedules ---------------------------------
+
+class Schedule(NamedTuple):
+    """One "__schedule__" node of a loaded flow"""
+
+    key: str  # "flowId:nodeId"
+    spec: str  # "cron:<expr>" / "interval:<seconds>", persisted to notice edits
+    node: dict
+    plan: Optional[CompiledGraph]
+    cron: Optional[CronSpec]
+    interval: Optional[float]
+
+    def next_after(self, moment: datetime) -> datetime:
+        if self.cron is not None:
+            return self.cron.next_after(moment)
+        return moment + timedelta(seconds=self.interval)  # type: ignore[arg-type]
+
+
+def schedule_for(flow_id: Any, node: dict, plan: Optional[CompiledGraph]) -> Schedule:
+    """Build the :class:`Schedule` of a "__schedule__" *node*
+
+    Raises ``ValueError`` unless exactly one of ``cron`` / ``interval`` is
+    set to something valid.
+    """
+    cron_text = str(node.get("cron") or "").strip()
+    interval_text = str(node.get("interval") or "").strip()
+    if bool(cron_text) == bool(interval_text):
+        raise ValueError("A schedule needs either a cron expression or an interval")
+
+    cron = interval = None
+    if cron_text:
+        cron = CronSpec.parse(cron_text)
+        cron.next_after(datetime.now(timezone.utc))  # reject expressions that never fire
+        spec = f"cron:{cron_text}"
+    else:
+        try:
+            interval = float(interval_text)
+        except ValueError:
+            raise ValueError(f"Interval {interval_text!r} is not a number of seconds") from None
+        if interval < 1:
+            raise ValueError("Interval must be at least 1 second")
+        spec = f"interval:{interval:g}"
+    return Schedule(f"{flow_id}:{node['id']}", spec, node, plan, cron, interval)
+
+
+# ---------------  Stores ------------------------------------
+#
+# Stores are synchronous; rows are key → (spec, next fire time).
+
+class MemoryScheduleStore:
+    """Process-local stand-in for the database, for tests and single-process bots"""
+
+    blocking = False
+
+    def __init__(self) -> None:
+        self.rows: Dict[Tuple[str, str], Tuple[str, datetime, Optional[datetime]]] = {}
+
+    def load(self, namespace: str) -> Dict[str, Tuple[str, datetime]]:
+        return {key: (spec, at) for (ns, key), (spec, at, _) in self.rows.items() if ns == namespace}
+
+    def save_many(self, namespace: str, rows: Dict[str, Tuple[str, datetime, Optional[datetime]]]) -> None:
+        for key, row in rows.items():
+            self.rows[namespace, key] = row
+
+    def prune(self, namespace: str, keep: Set[str]) -> None:
+        for ns, key in [k for k in self.rows if k[0] == namespace and k[1] not in keep]:
+            del self.rows[ns, key]
+
+
+class DjangoScheduleStore:
+    """Stores next fire times in the :class:`~api.models.ScheduleState` table"""
+
+    blocking = True
+
+    def load(self, namespace: str) -> Dict[str, Tuple[str, datetime]]:
+        from ..models import ScheduleState
+
+        rows = ScheduleState.objects.filter(namespace=namespace).values_list("key", "spec", "next_fire_at")
+        return {key: (spec, at) for key, spec, at in rows}
+
+    def save_many(self, namespace: str, rows: Dict[str, Tuple[str, datetime, Optional[datetime]]]) -> None:
+        from ..models import ScheduleState
+
+        ScheduleState.objects.bulk_create(
+            [
+                ScheduleState(namespace=namespace, key=key, spec=spec, next_fire_at=at, last_fired_at=fired)
+                for key, (spec, at, fired) in rows.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["namespace", "key"],
+            update_fields=["spec", "next_fire_at", "last_fired_at", "updated_at"],
+        )
+
+    def prune(self, namespace: str, keep: Set[str]) -> None:
+        from ..models import ScheduleState
+
+        ScheduleState.objects.filter(namespace=namespace).exclude(key__in=keep).delete()
+
+
+def default_schedule_store() -> Any:
+    return MemoryScheduleStore() if SCHEDULE_BACKEND == "memory" else DjangoScheduleStore()
+
+
+# ---------------  Scheduler ---------------------------------
+
+class Scheduler:
+    """Fires loaded schedules on time and hands them to *run*.
+
+    *run* is awaited as ``run(schedule, fired_at)`` in its own task; at most
+    *max_concurrency* run at once, and a schedule whose previous run is
+    still going skips its turn instead of piling up.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Schedule, datetime], Awaitable[Any]],
+        store: Any = None,
+        *,
+        namespace: str = "",
+        max_concurrency: int = SCHEDULE_MAX_CONCURRENCY,
+    ):
+        self.run = run
+        self.store = store if store is not None else default_schedule_store()
+        self.namespace = namespace
+
+        self._schedules: Dict[str, Schedule] = {}
+        self._next: Dict[str, datetime] = {}
+        self._heap: List[Tuple[float, int, str]] = []  # (fire timestamp, tie-breaker, key)
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.counts = {"fired": 0, "caught_up": 0, "skipped": 0, "failed": 0}
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.store.blocking:
+            return await sync_to_async(fn)(*args)
+        return fn(*args)
+
+    def _push(self, key: str, at: datetime) -> None:
+        self._next[key] = at
+        heapq.heappush(self._heap, (at.timestamp(), next(self._seq), key))
+
+    async def load(self, schedules: Iterable[Schedule]) -> None:
+        """Replace the loaded schedules, keeping the fire times of unchanged ones"""
+        persisted = await self._call(self.store.load, self.namespace)
+        now = datetime.now(timezone.utc)
+
+        loaded: Dict[str, Schedule] = {}
+        upcoming: Dict[str, datetime] = {}
+        fresh: Dict[str, Tuple[str, datetime, Optional[datetime]]] = {}
+        for schedule in schedules:
+            key = schedule.key
+            loaded[key] = schedule
+            current = self._schedules.get(key)
+            if current is not None and current.spec == schedule.spec:
+                upcoming[key] = self._next[key]
+            elif key in persisted and persisted[key][0] == schedule.spec:
+                upcoming[key] = persisted[key][1]  # possibly in the past: fires once straight away
+            else:
+                upcoming[key] = schedule.next_after(now)
+                fresh[key] = (schedule.spec, upcoming[key], None)
+
+        if fresh:
+            await self._call(self.store.save_many, self.namespace, fresh)
+        if persisted.keys() - loaded.keys():
+            await self._call(self.store.prune, self.namespace, set(loaded))
+
+        self._schedules = loaded
+        self._next = {}
+        self._heap = []
+        for key, at in upcoming.items():
+            self._push(key, at)
+        self._wake.set()
+
+    def _start(self, schedule: Schedule, fired_at: datetime) -> None:
+        if schedule.key in self._running:
+            self.counts["skipped"] += 1
+            return
+        self._running.add(schedule.key)
+        task = asyncio.create_task(self._run(schedule, fired_at))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, schedule: Schedule, fired_at: datetime) -> None:
+        try:
+            async with self._slots:
+                await self.run(schedule, fired_at)
+        except Exception as exc:
+            self.counts["failed"] += 1
+            print(f"Scheduled flow {schedule.key} failed: {exc!r}")
+        finally:
+            self._running.discard(schedule.key)
+
+    async def tick(self) -> None:
+        """Fire every schedule that is due"""
+        now = datetime.now(timezone.utc)
+        cutoff = now.timestamp()
+        due: List[Tuple[Schedule, datetime]] = []
+        rows: Dict[str, Tuple[str, datetime, Optional[datetime]]] = {}
+
+        while self._heap and self._heap[0][0] <= cutoff:
+            at_ts, _, key = heapq.heappop(self._heap)
+            schedule = self._schedules.get(key)
+            fired_at = self._next.get(key)
+            if schedule is None or fired_at is None or fired_at.timestamp() != at_ts:
+                continue  # replaced by a reload
+
+            following = schedule.next_after(fired_at)
+            if following <= now:
+                # we were down (or asleep) for several periods: run once, not once per period
+                following = schedule.next_after(now)
+                self.counts["caught_up"] += 1
+            self._push(key, following)
+            rows[key] = (schedule.spec, following, fired_at)
+            due.append((schedule, fired_at))
+
+        if not due:
+            return
+        # persisted before anything runs, so a crash can't fire these twice
+        await self._call(self.store.save_many, self.namespace, rows)
+        for schedule, fired_at in due:
+            self.counts["fired"] += 1
+            self._start(schedule, fired_at)
+
+    async def run_forever(self) -> None:
+        """Fire schedules until cancelled; cancelling also cancels runs in flight"""
+        try:
+            while True:
+                self._wake.clear()
+                try:
+                    await self.tick()
+                except Exception as exc:
+                    print(f"Scheduler tick failed: {exc!r}")
+                delay = MAX_SLEEP
+                if self._heap:
+                    delay = min(max(self._heap[0][0] - time.time(), 0.0), MAX_SLEEP)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        upcoming = self._heap[0][0] if self._heap else None
+        return {
+            **self.counts,
+            "schedules": len(self._schedules),
+            "running": len(self._running),
+            "next_fire_in": upcoming - time.time() if upcoming is not None else None,
+        }
@@ -0,0 +1,61 @@
+"""
+sharding.py
+
+Splitting a bot's gateway shards across supervisors, and per-shard metrics
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[List[int]]:
+    """Split shards ``0..shard_count-1`` into *workers* contiguous, balanced ranges"""
+    if workers < 1 or shard_count < workers:
+        raise ValueError(f"Cannot split {shard_count} shards across {workers} workers")
+
+    size, extra = divmod(shard_count, workers)
+    ranges: List[List[int]] = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """Shard that receives *guild_id*'s events (Discord's sharding formula)"""
+    return (guild_id >> 22) % shard_count
+
+
+class ShardMetrics:
+    """Event counts per shard, turned into rates between snapshots"""
+
+    def __init__(self) -> None:
+        self.events: Dict[Optional[int], int] = {}
+        self._last_events: Dict[Optional[int], int] = {}
+        self._last_snapshot = time.monotonic()
+
+    def record(self, shard_id: Optional[int]) -> None:
+        self.events[shard_id] = self.events.get(shard_id, 0) + 1
+
+    def snapshot(self, latencies: List[tuple]) -> Dict[str, Dict[str, Any]]:
+        """Per-shard totals, events/s since the previous snapshot and latency
+
+        Events that carry no guild are reported under ``"global"``.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._last_snapshot, 1e-9)
+        latency = dict(latencies)
+
+        out: Dict[str, Dict[str, Any]] = {}
+        for shard_id in sorted(self.events.keys() | latency.keys(), key=lambda s: (s is None, s or 0)):
+            total = self.events.get(shard_id, 0)
+            out["global" if shard_id is None else str(shard_id)] = {
+                "events": total,
+                "events_per_sec": (total - self._last_events.get(shard_id, 0)) / elapsed,
+                "latency_ms": latency[shard_id] * 1000 if shard_id in latency else None,
+            }
+
+        self._last_events = dict(self.events)
+        self._last_snapshot = now
+        return out
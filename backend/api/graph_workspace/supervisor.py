@@ -0,0 +1,172 @@
+"""
+supervisor.py
+
+Runs the bots requested through ``/api/run_bot/`` in a long-lived worker
+process (``python manage.py runbots``) instead of inside an HTTP request
+"""
+import asyncio
+import os
+import socket
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import BotJob, BotShard
+from .runbot import FlowBot
+
+State = BotJob.State
+
+
+class Assignment(NamedTuple):
+    """A shard range this supervisor should be running"""
+
+    shard_pk: int
+    job_id: int
+    token: str
+    shard_ids: Optional[List[int]]  # None → let discord.py pick
+    shard_count: Optional[int]
+
+
+class BotSupervisor:
+    """Claims :class:`BotShard` rows and keeps their bots running.
+
+    Every job is split into one or more shard ranges. Several supervisors
+    (pods/processes) share the table: each claims unowned ranges up to
+    *max_bots* and heartbeats the ones it runs, so a sharded bot spreads its
+    gateway connections across workers. Ranges whose worker stops
+    heartbeating for *lease_timeout* seconds are picked up by another
+    supervisor.
+    """
+
+    def __init__(
+        self,
+        name: str | None = None,
+        *,
+        max_bots: int = 10,
+        poll_interval: float = 5.0,
+        lease_timeout: float = 30.0,
+    ):
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.max_bots = max_bots
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+
+        # BotShard pk → (assignment, bot, task running it)
+        self.bots: Dict[int, tuple] = {}
+        self._stopping = asyncio.Event()
+
+    # ---------------  Job table (sync, run in a thread) ---------
+
+    def _sync_jobs(self, stats: Dict[int, dict]) -> List[Assignment]:
+        """Heartbeat (with *stats*), claim free shard ranges, return what we should run"""
+        now = timezone.now()
+        stale = now - timedelta(seconds=self.lease_timeout)
+
+        with transaction.atomic():
+            mine = BotShard.objects.filter(worker=self.name)
+            mine.update(heartbeat_at=now)
+            for shard_pk, shard_stats in stats.items():
+                mine.filter(pk=shard_pk).update(stats=shard_stats)
+
+            wanted = mine.filter(job__desired_state=State.RUNNING)
+            capacity = self.max_bots - wanted.count()
+            if capacity > 0:
+                free = (
+                    BotShard.objects.select_for_update(skip_locked=True)
+                    .filter(job__desired_state=State.RUNNING)
+                    .filter(Q(worker="") | Q(heartbeat_at__lt=stale))
+                    .exclude(worker=self.name)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[:capacity]
+                )
+                BotShard.objects.filter(pk__in=list(free)).update(
+                    worker=self.name, status=State.STARTING, heartbeat_at=now, error=""
+                )
+
+            return [
+                Assignment(*row)
+                for row in wanted.values_list("pk", "job_id", "job__token", "shard_ids", "job__shard_count")
+            ]
+
+    def _set_status(self, shard: Assignment, status: str, error: str = "", release: bool = False) -> None:
+        fields = {"status": status, "error": error}
+        if release:
+            fields["worker"] = ""
+        BotShard.objects.filter(pk=shard.shard_pk, worker=self.name).update(**fields)
+        if status == State.FAILED:
+            # don't retry a bad token forever
+            BotJob.objects.filter(pk=shard.job_id).update(desired_state=State.STOPPED)
+
+    def _release_all(self) -> None:
+        BotShard.objects.filter(worker=self.name).update(worker="", status=State.STOPPED)
+
+    # ---------------  Bot lifecycles ----------------------------
+
+    async def _run_bot(self, shard: Assignment, bot: FlowBot) -> None:
+        try:
+            await bot.login(shard.token)
+            await sync_to_async(self._set_status)(shard, State.RUNNING)
+            await bot.connect()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"Bot for job {shard.job_id} (shards {shard.shard_ids}) failed: {exc!r}")
+            await sync_to_async(self._set_status)(shard, State.FAILED, repr(exc), release=True)
+        else:
+            await sync_to_async(self._set_status)(shard, State.STOPPED, release=True)
+        finally:
+            if not bot.is_closed():
+                await bot.close()
+            self.bots.pop(shard.shard_pk, None)
+
+    async def _stop_bot(self, shard_pk: int) -> None:
+        entry = self.bots.pop(shard_pk, None)
+        if entry is None:
+            return  # _run_bot already finished and cleaned up
+        shard, bot, task = entry
+        await bot.close()
+        try:
+            await asyncio.wait_for(task, timeout=10)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            task.cancel()
+        await sync_to_async(self._set_status)(shard, State.STOPPED, release=True)
+
+    async def reconcile(self) -> None:
+        """Bring local bots in line with the job table"""
+        stats = {pk: bot.metrics() for pk, (_, bot, _) in self.bots.items()}
+        wanted = {a.shard_pk: a for a in await sync_to_async(self._sync_jobs)(stats)}
+
+        for shard_pk in [pk for pk in self.bots if pk not in wanted]:
+            print(f"Stopping bot for shard range {shard_pk}")
+            await self._stop_bot(shard_pk)
+
+        for shard_pk, shard in wanted.items():
+            if shard_pk in self.bots:
+                continue
+            print(f"Starting bot for job {shard.job_id} (shards {shard.shard_ids or 'auto'})")
+            bot = FlowBot(shard_ids=shard.shard_ids, shard_count=shard.shard_count)
+            self.bots[shard_pk] = (shard, bot, asyncio.create_task(self._run_bot(shard, bot)))
+
+    async def run(self) -> None:
+        """Reconcile every *poll_interval* seconds until :meth:`stop` is called"""
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await self.reconcile()
+                except Exception as exc:
+                    print(f"Supervisor reconcile failed: {exc!r}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for shard_pk in list(self.bots):
+                await self._stop_bot(shard_pk)
+            await sync_to_async(self._release_all)()
+
+    def stop(self) -> None:
+        self._stopping.set()
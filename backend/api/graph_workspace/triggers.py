@@ -0,0 +1,213 @@
+"""
+triggers.py
+
+Flows started by gateway events (messages, reactions, member joins) and the
+index that matches an incoming event to the flows it should start
+"""
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+from .graph_runner import CompiledGraph
+
+# Trigger node code_id → discord.py event it listens to
+EVENT_TRIGGERS: Dict[str, str] = {
+    "__message__": "message",
+    "__reaction__": "raw_reaction_add",
+    "__member_join__": "member_join",
+}
+
+
+class Trigger(NamedTuple):
+    """One event trigger node of a loaded flow"""
+
+    event: str
+    node: dict
+    plan: CompiledGraph
+    guild_id: Optional[int]  # None → any guild
+    channel_id: Optional[int]  # None → any channel
+    prefix: str  # message triggers: content must start with it
+    pattern: Optional[Pattern[str]]  # message triggers: content must match it
+    emoji: str  # reaction triggers: only this emoji ("" → any)
+    ignore_bots: bool
+
+
+class EventContext(NamedTuple):
+    """The ids variable blocks read from an interaction, for event-started runs"""
+
+    application_id: Optional[int]
+    guild_id: Optional[int]
+    channel_id: Optional[int]
+    user: Any
+
+
+def _snowflake(value: Any) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    return int(value)
+
+
+def trigger_for(node: dict, plan: CompiledGraph) -> Trigger:
+    """Build the :class:`Trigger` of an event trigger *node* (see :data:`EVENT_TRIGGERS`)
+
+    Raises ``ValueError`` for a malformed id or regular expression.
+    """
+    pattern = node.get("pattern") or None
+    try:
+        compiled = re.compile(pattern) if pattern else None
+    except re.error as exc:
+        raise ValueError(f"Invalid pattern {pattern!r}: {exc}") from None
+    return Trigger(
+        event=EVENT_TRIGGERS[node["code_id"]],
+        node=node,
+        plan=plan,
+        guild_id=_snowflake(node.get("guild_id")),
+        channel_id=_snowflake(node.get("channel_id")),
+        prefix=node.get("prefix") or "",
+        pattern=compiled,
+        emoji=node.get("emoji") or "",
+        ignore_bots=node.get("ignore_bots", True) not in (False, "false", "0"),
+    )
+
+
+# Back-references can't be folded into a combined expression (group numbers shift)
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+# Leading global flags, e.g. "(?i)hello", which are only valid at the very start
+_GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+
+
+def _foldable(pattern: str) -> str:
+    """*pattern* as an alternative that can sit inside a larger expression"""
+    flags = _GLOBAL_FLAGS.match(pattern)
+    if flags:
+        return f"(?{flags.group(1)}:{pattern[flags.end():]})"
+    return f"(?:{pattern})"
+
+
+class _Bucket:
+    """Triggers sharing one (event, guild, channel) key.
+
+    Message triggers with a prefix or pattern are also folded into one
+    regular expression, so content none of them can match is rejected with
+    a single search instead of one test per trigger.
+    """
+
+    __slots__ = ("triggers", "always", "folded", "prefilter")
+
+    def __init__(self, triggers: List[Trigger]):
+        self.triggers = triggers
+        self.always: List[Trigger] = []  # tested on every event
+        self.folded: List[Trigger] = []  # only tested when the prefilter matches
+        alternatives = []
+        for t in triggers:
+            if t.prefix:
+                # the pattern, if any, is checked per trigger afterwards
+                alternatives.append(f"(?:^{re.escape(t.prefix)})")
+            elif t.pattern is not None and not _BACKREFERENCE.search(t.pattern.pattern):
+                alternatives.append(_foldable(t.pattern.pattern))
+            else:
+                self.always.append(t)
+                continue
+            self.folded.append(t)
+
+        self.prefilter: Optional[Pattern[str]] = None
+        if alternatives:
+            try:
+                self.prefilter = re.compile("|".join(alternatives))
+            except re.error:  # e.g. inline flags that are only valid at the start
+                self.always.extend(self.folded)
+                self.folded = []
+
+class TriggerIndex:
+    """Event triggers keyed by ``(event, guild, channel)``.
+
+    A lookup costs at most four dictionary hits (exact guild/channel and
+    their "any" wildcards) whatever the number of flows.
+    """
+
+    def __init__(self, triggers: Iterable[Trigger] = ()):
+        grouped: Dict[Tuple[str, Optional[int], Optional[int]], List[Trigger]] = {}
+        for t in triggers:
+            grouped.setdefault((t.event, t.guild_id, t.channel_id), []).append(t)
+        self._buckets = {key: _Bucket(group) for key, group in grouped.items()}
+        self.events = {key[0] for key in grouped}
+
+    def __len__(self) -> int:
+        return sum(len(b.triggers) for b in self._buckets.values())
+
+    def _buckets_for(self, event: str, guild_id: Optional[int], channel_id: Optional[int]) -> Iterable[_Bucket]:
+        buckets = self._buckets
+        for guild in ((guild_id, None) if guild_id is not None else (None,)):
+            for channel in ((channel_id, None) if channel_id is not None else (None,)):
+                bucket = buckets.get((event, guild, channel))
+                if bucket is not None:
+                    yield bucket
+
+    def match(
+        self,
+        event: str,
+        guild_id: Optional[int],
+        channel_id: Optional[int],
+        *,
+        content: Optional[str] = None,
+        emoji: str = "",
+        from_bot: bool = False,
+    ) -> List[Tuple[Trigger, str]]:
+        """Triggers an event should start, each with the text after its
+        prefix/pattern match (the whole content for unfiltered triggers)"""
+        if event not in self.events:
+            return []
+
+        matched: List[Tuple[Trigger, str]] = []
+        for bucket in self._buckets_for(event, guild_id, channel_id):
+            candidates = bucket.always
+            if bucket.folded and content is not None and bucket.prefilter.search(content):
+                candidates = bucket.always + bucket.folded
+
+            for t in candidates:
+                if t.ignore_bots and from_bot:
+                    continue
+                if t.emoji and t.emoji != emoji:
+                    continue
+                rest = content or ""
+                if t.prefix:
+                    if not rest.startswith(t.prefix):
+                        continue
+                    rest = rest[len(t.prefix):].strip()
+                if t.pattern is not None:
+                    found = t.pattern.search(rest)
+                    if found is None:
+                        continue
+                    rest = rest[found.end():].strip()
+                matched.append((t, rest))
+        return matched
+
+
+class TriggerMetrics:
+    """Per-event counts of flows started, matches shed under load and
+    events that matched no trigger"""
+
+    def __init__(self) -> None:
+        self.received: Dict[str, int] = {}
+        self.dispatched: Dict[str, int] = {}
+        self.shed: Dict[str, int] = {}
+        self.unmatched: Dict[str, int] = {}
+
+    def record(self, event: str, matched: int, shed: int = 0) -> None:
+        self.received[event] = self.received.get(event, 0) + 1
+        if not matched:
+            self.unmatched[event] = self.unmatched.get(event, 0) + 1
+        if matched > shed:
+            self.dispatched[event] = self.dispatched.get(event, 0) + matched - shed
+        if shed:
+            self.shed[event] = self.shed.get(event, 0) + shed
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {
+            event: {
+                "received": count,
+                "dispatched": self.dispatched.get(event, 0),
+                "shed": self.shed.get(event, 0),
+                "unmatched": self.unmatched.get(event, 0),
+            }
+            for event, count in sorted(self.received.items())
+        }
@@ -0,0 +1,318 @@
+"""
+validation.py
+
+Static checks run when a flow is saved, so a broken flow is rejected by the
+API instead of failing in the middle of a Discord interaction
+"""
+import inspect
+import re
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+import discord
+
+from .blocks import BLOCK_MODULES, _py_type_to_ts, annotation_classes, coerce_literal, registry
+from .graph_runner import (
+    FLOW_INPUT, FLOW_OUTPUT, PLAN_VERSION, SUBFLOW, _src, _tgt, check_concurrency, flow_digest, flow_interface,
+)
+from .scheduler import SCHEDULE, schedule_for
+from .triggers import EVENT_TRIGGERS
+
+# Slash command option types → Python types
+PY_TYPES = {"string": str, "integer": int, "boolean": bool}
+
+# code_id → types of the outputs every such trigger node provides
+TRIGGERS: Dict[str, Dict[str, Any]] = {
+    "__slash__": {"ctx": discord.Interaction, "interaction": discord.Interaction},
+    "__message__": {
+        "ctx": discord.Message, "message": discord.Message, "content": str, "args": str,
+        "author": discord.abc.User, "channel": discord.abc.Messageable,
+    },
+    "__reaction__": {
+        "ctx": discord.RawReactionActionEvent, "payload": discord.RawReactionActionEvent, "emoji": str,
+        "args": str, "user_id": int, "message_id": int, "channel_id": int,
+    },
+    "__member_join__": {"ctx": discord.Member, "member": discord.Member, "guild": discord.Guild, "args": str},
+    SCHEDULE: {"ctx": datetime, "fired_at": datetime, "args": str},
+    FLOW_INPUT: {"value": Any},
+}
+
+# Other nodes without a block behind them
+PLACEHOLDERS = {SUBFLOW, FLOW_OUTPUT}
+
+# Discord's limits for slash command names and descriptions (and the sizes
+# of the matching api.models.FlowCommand columns)
+COMMAND_NAME_LENGTH = 32
+COMMAND_DESCRIPTION_LENGTH = 100
+
+
+class FlowIssue(NamedTuple):
+    """One problem found in a flow"""
+
+    code: str  # "cycle", "unbound_port", "type_conflict", …
+    message: str
+    node_id: Optional[str] = None
+    port: Optional[str] = None
+    severity: str = "error"  # "error" blocks saving, "warning" doesn't
+
+
+def literal(node: Mapping[str, Any], port: str) -> Any:
+    """Value typed into the builder for *port* of *node*, or ``None``"""
+    value = node.get(port)
+    return None if value is None or value == "" else value
+
+
+def _compatible(source: Any, target: Any) -> bool:
+    src, dst = annotation_classes(source), annotation_classes(target)
+    if src is None or dst is None:
+        return True
+    for s in src:
+        for d in dst:
+            try:
+                if issubclass(s, d) or (s is int and d is float):
+                    return True
+            except TypeError:  # protocols and other non-class annotations
+                return True
+    return False
+
+
+def _output_types(node: Mapping[str, Any], fn: Any) -> Dict[str, Any]:
+    """Port name → annotation of everything *node* can output"""
+    if node["code_id"] in TRIGGERS:
+        types = dict(TRIGGERS[node["code_id"]])
+        for opt in node.get("options", []):
+            types[opt["name"]] = PY_TYPES.get(opt.get("type"), str)
+        return types
+
+    ret = inspect.signature(fn).return_annotation if fn is not None else inspect.Parameter.empty
+    return {p["name"]: ret for p in node.get("outputs", [])}
+
+
+def _calls(flow_id: Any, graph: Mapping[str, Any], subflows: Mapping[Any, Mapping[str, Any]]) -> bool:
+    """Whether *graph* ends up running flow *flow_id* through its sub-flows"""
+    seen: Set[Any] = set()
+    stack = [graph]
+    while stack:
+        for node in stack.pop()["nodes"]:
+            child = node.get("flowId") if node["code_id"] == SUBFLOW else None
+            if child is None or child in seen:
+                continue
+            if child == flow_id:
+                return True
+            seen.add(child)
+            if child in subflows:
+                stack.append(subflows[child])
+    return False
+
+
+def validate_flow(
+    graph: Mapping[str, Any],
+    module_names: Iterable[str] = BLOCK_MODULES,
+    subflows: Optional[Mapping[Any, Mapping[str, Any]]] = None,
+) -> Tuple[List[FlowIssue], Optional[Dict[str, Any]]]:
+    """Check *graph* and return ``(issues, plan)``.
+
+    *plan* is ``None`` when any issue is an error. Otherwise it records the
+    topological order the flow was validated with, keyed by the flow's
+    :func:`~.graph_runner.flow_digest`; :func:`~.graph_runner.compile_graph`
+    reuses it instead of sorting and cycle-checking again.
+
+    Sub-flow nodes are checked against *subflows* (``flowId → flow``, every
+    flow the graph calls directly or indirectly) when it is given.
+    """
+
+    module_names = list(module_names)
+    blocks = registry.blocks(module_names)
+    constants = graph.get("constants", {})
+    issues: List[FlowIssue] = []
+
+    try:
+        check_concurrency(graph.get("maxConcurrency"), "maxConcurrency")
+    except ValueError as exc:
+        issues.append(FlowIssue("bad_setting", str(exc), port="maxConcurrency"))
+
+    nodes: Dict[str, Mapping[str, Any]] = {}
+    for node in graph["nodes"]:
+        if node["id"] in nodes:
+            issues.append(FlowIssue("duplicate_node", f"Node id '{node['id']}' is used twice", node["id"]))
+        nodes[node["id"]] = node
+
+    fns: Dict[str, Any] = {}
+    for nid, node in nodes.items():
+        code_id = node["code_id"]
+        if code_id not in TRIGGERS and code_id not in PLACEHOLDERS and code_id not in blocks:
+            issues.append(FlowIssue("unknown_block", f"Unknown block '{code_id}'", nid))
+        if code_id in EVENT_TRIGGERS:
+            for field in ("guild_id", "channel_id"):
+                if literal(node, field) is not None and not str(node[field]).isdigit():
+                    issues.append(FlowIssue("bad_trigger", f"{field} must be a Discord id", nid, field))
+            if literal(node, "pattern") is not None:
+                try:
+                    re.compile(node["pattern"])
+                except re.error as exc:
+                    issues.append(FlowIssue("bad_trigger", f"Invalid pattern: {exc}", nid, "pattern"))
+        if code_id == "__slash__":
+            for field, limit in (("command", COMMAND_NAME_LENGTH), ("description", COMMAND_DESCRIPTION_LENGTH)):
+                if len(str(node.get(field) or "")) > limit:
+                    issues.append(FlowIssue("bad_command", f"The command {field} can be at most {limit} characters",
+                                            nid, field))
+        if code_id == SCHEDULE:
+            try:
+                schedule_for(graph.get("flowId"), node, None)
+            except ValueError as exc:
+                issues.append(FlowIssue("bad_trigger", str(exc), nid))
+        fns[nid] = blocks.get(code_id)
+
+    # ---------------  Edges -------------------------------------
+    outputs = {nid: _output_types(node, fns[nid]) for nid, node in nodes.items()}
+    bound: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    adj: Dict[str, List[str]] = {nid: [] for nid in nodes}
+    indegree: Dict[str, int] = {nid: 0 for nid in nodes}
+
+    for e in graph["edges"]:
+        s, t = _src(e), _tgt(e)
+        sport, tport = e["sourcePort"], e["targetPort"]
+        if s not in nodes or t not in nodes:
+            issues.append(FlowIssue("dangling_edge", f"Edge {s}.{sport} → {t}.{tport} points at a missing node",
+                                    t if t in nodes else s, tport))
+            continue
+        if sport not in outputs[s]:
+            issues.append(FlowIssue("unknown_port", f"'{s}' has no output '{sport}'", s, sport))
+        if tport not in {p["name"] for p in nodes[t].get("inputs", [])}:
+            issues.append(FlowIssue("unknown_port", f"'{t}' has no input '{tport}'", t, tport))
+
+        previous = bound.setdefault((t, tport), (s, sport))
+        if previous != (s, sport):
+            issues.append(FlowIssue("duplicate_binding",
+                                    f"Input '{tport}' of '{t}' is connected to both "
+                                    f"{previous[0]}.{previous[1]} and {s}.{sport}", t, tport))
+        adj[s].append(t)
+        indegree[t] += 1
+
+    # ---------------  Cycles (Kahn) -----------------------------
+    queue = deque(nid for nid, deg in indegree.items() if deg == 0)
+    order: List[str] = []
+    while queue:
+        nid = queue.popleft()
+        order.append(nid)
+        for m in adj[nid]:
+            indegree[m] -= 1
+            if indegree[m] == 0:
+                queue.append(m)
+    if len(order) < len(nodes):
+        stuck = [nid for nid in nodes if indegree[nid] > 0]
+        issues.append(FlowIssue("cycle", f"These nodes form a cycle: {', '.join(stuck)}", stuck[0]))
+
+    # ---------------  Reachability from triggers ----------------
+    triggers = [nid for nid, node in nodes.items() if node["code_id"] in TRIGGERS]
+    if not triggers:
+        issues.append(FlowIssue("no_trigger", "The flow has no slash command, event, schedule or flow input, so it never runs",
+                                severity="warning"))
+    else:
+        # downstream of a trigger, or feeding something that is
+        seen: Set[str] = set(triggers)
+        stack = list(triggers)
+        while stack:
+            for m in adj[stack.pop()]:
+                if m not in seen:
+                    seen.add(m)
+                    stack.append(m)
+        preds: Dict[str, List[str]] = {nid: [] for nid in nodes}
+        for src, targets in adj.items():
+            for dst in targets:
+                preds[dst].append(src)
+        stack = list(seen)
+        while stack:
+            for p in preds[stack.pop()]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        for nid in nodes:
+            if nid not in seen:
+                issues.append(FlowIssue("unreachable", f"'{nodes[nid].get('label', nid)}' is not connected "
+                                        "to a trigger", nid, severity="warning"))
+
+    # ---------------  Sub-flows and flow outputs ----------------
+    for nid, node in nodes.items():
+        label = node.get("label", nid)
+        if node["code_id"] == FLOW_OUTPUT:
+            if (nid, "value") not in bound and literal(node, "value") is None:
+                issues.append(FlowIssue("unbound_port", f"Flow output '{label}' needs a connection", nid, "value"))
+        if node["code_id"] != SUBFLOW or subflows is None:
+            continue
+
+        child_id = node.get("flowId")
+        if child_id not in subflows:
+            issues.append(FlowIssue("unknown_subflow", f"'{label}' calls flow {child_id!r}, which doesn't exist", nid))
+            continue
+        if graph.get("flowId") is not None and (
+            child_id == graph["flowId"] or _calls(graph["flowId"], subflows[child_id], subflows)
+        ):
+            issues.append(FlowIssue("cycle", f"'{label}' makes this flow call itself", nid))
+
+        child_inputs, child_outputs = flow_interface(subflows[child_id])
+        for pname in {p["name"] for p in node.get("inputs", [])} - child_inputs.keys():
+            issues.append(FlowIssue("unknown_port", f"Flow {child_id!r} has no input '{pname}'", nid, pname))
+        for pname in {p["name"] for p in node.get("outputs", [])} - child_outputs.keys():
+            issues.append(FlowIssue("unknown_port", f"Flow {child_id!r} has no output '{pname}'", nid, pname))
+        for pname in child_inputs:
+            if (nid, pname) not in bound and f"{nid}.{pname}" not in constants and literal(node, pname) is None:
+                issues.append(FlowIssue("unbound_port", f"'{pname}' of '{label}' needs a value or a connection",
+                                        nid, pname))
+
+    # ---------------  Ports and types ---------------------------
+    for nid, node in nodes.items():
+        fn = fns[nid]
+        if fn is None:
+            continue
+        params = inspect.signature(fn).parameters
+        accepts_all = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+        label = node.get("label", nid)
+        declared = {p["name"] for p in node.get("inputs", [])}
+
+        for pname in declared:
+            param = params.get(pname)
+            if param is None and not accepts_all:
+                issues.append(FlowIssue("unknown_port", f"'{label}' has no input '{pname}'", nid, pname))
+                continue
+            annotation = param.annotation if param is not None else inspect.Parameter.empty
+            source = bound.get((nid, pname))
+
+            if source is not None and source[0] in nodes:
+                source_type = outputs[source[0]].get(source[1], inspect.Parameter.empty)
+                if not _compatible(source_type, annotation):
+                    issues.append(FlowIssue(
+                        "type_conflict",
+                        f"{source[0]}.{source[1]} ({_py_type_to_ts(source_type, is_return=True)}) can't feed "
+                        f"'{pname}' of '{label}' ({_py_type_to_ts(annotation)})",
+                        nid, pname,
+                    ))
+            elif f"{nid}.{pname}" in constants:
+                continue
+            elif literal(node, pname) is not None:
+                try:
+                    coerce_literal(literal(node, pname), annotation)
+                except ValueError as exc:
+                    issues.append(FlowIssue("type_conflict", f"'{pname}' of '{label}': {exc}", nid, pname))
+            elif param is None or param.default is inspect.Parameter.empty:
+                issues.append(FlowIssue("unbound_port", f"'{pname}' of '{label}' needs a value or a connection",
+                                        nid, pname))
+
+        # required arguments the node doesn't even have a port for
+        for pname, param in params.items():
+            if (
+                pname not in declared
+                and param.default is inspect.Parameter.empty
+                and param.kind in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+            ):
+                issues.append(FlowIssue("unbound_port", f"'{label}' is missing its '{pname}' input", nid, pname))
+
+    if any(issue.severity == "error" for issue in issues):
+        return issues, None
+    return issues, {
+        "version": PLAN_VERSION,
+        "digest": flow_digest(graph),
+        "modules": module_names,
+        "order": order,
+    }
@@ -0,0 +1,389 @@
+"""
+variables.py
+
+Scoped variables for the "Get/Set Variable" blocks, kept across runs,
+restarts and replicas
+
+Values live in the :class:`~api.models.Variable` table (or in process
+memory with ``VARIABLE_BACKEND=memory``). A :class:`VariableStore` sits in
+front of the backend as a write-back cache: reads are served locally for
+``VARIABLE_CACHE_SECONDS``, plain writes are batched and flushed every
+``VARIABLE_FLUSH_INTERVAL`` seconds, and increments / compare-and-set go
+straight to the backend so they stay atomic across processes.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+VARIABLE_BACKEND = os.environ.get("VARIABLE_BACKEND", "django")
+VARIABLE_CACHE_SECONDS = float(os.environ.get("VARIABLE_CACHE_SECONDS", 5))
+VARIABLE_FLUSH_INTERVAL = float(os.environ.get("VARIABLE_FLUSH_INTERVAL", 1))
+VARIABLE_CACHE_MAX_ENTRIES = int(os.environ.get("VARIABLE_CACHE_MAX_ENTRIES", 10_000))
+
+SCOPES = ("global", "guild", "channel", "user")
+
+# Sentinel for "not stored"
+MISSING = object()
+
+
+class VariableKey(NamedTuple):
+    namespace: str  # the bot's application id, so bots never share variables
+    scope: str  # one of SCOPES
+    scope_id: str  # guild/channel/user id, "" for global
+    name: str
+
+
+def key_for(name: str, scope: str, interaction: Any) -> VariableKey:
+    """Key of variable *name* in *scope* for the user/channel/guild of *interaction*"""
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown variable scope {scope!r}; expected one of {', '.join(SCOPES)}")
+
+    scope_id: Any = ""
+    if scope != "global":
+        if interaction is None:
+            raise ValueError(f"{scope} variables can only be used from an interaction")
+        scope_id = {
+            "guild": lambda: interaction.guild_id,
+            "channel": lambda: interaction.channel_id,
+            "user": lambda: getattr(interaction.user, "id", None),
+        }[scope]()
+        if scope_id is None:
+            raise ValueError(f"This interaction has no {scope} to store {name!r} against")
+
+    namespace = getattr(interaction, "application_id", None) or ""
+    return VariableKey(str(namespace), scope, str(scope_id), name)
+
+
+# ---------------  Backends ----------------------------------
+#
+# Backends are synchronous; expiry times are UNIX timestamps (None → never).
+
+class MemoryBackend:
+    """Process-local stand-in for the database, for tests and single-process bots"""
+
+    blocking = False  # cheap enough to call from the event loop
+
+    def __init__(self) -> None:
+        self._rows: Dict[VariableKey, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: VariableKey) -> Any:
+        row = self._rows.get(key)
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return MISSING
+        return row[0]
+
+    def load(self, key: VariableKey) -> Tuple[Any, Optional[float]]:
+        with self._lock:
+            value = self._live(key)
+            return (value, None) if value is MISSING else self._rows[key]
+
+    def write_many(self, rows: Dict[VariableKey, Tuple[Any, Optional[float]]]) -> None:
+        with self._lock:
+            self._rows.update(rows)
+
+    def increment(self, key: VariableKey, delta: float, expires_at: Optional[float]) -> Any:
+        with self._lock:
+            current = self._live(key)
+            value = (0 if current is MISSING else current) + delta
+            self._rows[key] = (value, expires_at)
+            return value
+
+    def compare_and_set(self, key: VariableKey, expected: Any, value: Any,
+                        expires_at: Optional[float]) -> Tuple[bool, Any]:
+        with self._lock:
+            current = self._live(key)
+            if (None if current is MISSING else current) != expected:
+                return False, current
+            self._rows[key] = (value, expires_at)
+            return True, value
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            now = time.time()
+            expired = [k for k, (_, exp) in self._rows.items() if exp is not None and exp <= now]
+            for k in expired:
+                del self._rows[k]
+            return len(expired)
+
+
+class DjangoBackend:
+    """Stores variables in the :class:`~api.models.Variable` table"""
+
+    blocking = True
+
+    @staticmethod
+    def _fields(key: VariableKey) -> Dict[str, str]:
+        return key._asdict()
+
+    @staticmethod
+    def _timestamp(expires_at: Optional[datetime]) -> Optional[float]:
+        return expires_at.timestamp() if expires_at is not None else None
+
+    @staticmethod
+    def _datetime(expires_at: Optional[float]) -> Optional[datetime]:
+        return datetime.fromtimestamp(expires_at, timezone.utc) if expires_at is not None else None
+
+    @staticmethod
+    def check(value: Any) -> None:
+        """Raise ``TypeError`` early for values the JSON column can't hold"""
+        json.dumps(value)
+
+    def load(self, key: VariableKey) -> Tuple[Any, Optional[float]]:
+        from ..models import Variable
+
+        row = Variable.objects.live().filter(**self._fields(key)).values_list("value", "expires_at").first()
+        if row is None:
+            return MISSING, None
+        return row[0], self._timestamp(row[1])
+
+    def write_many(self, rows: Dict[VariableKey, Tuple[Any, Optional[float]]]) -> None:
+        from ..models import Variable
+
+        Variable.objects.bulk_create(
+            [
+                Variable(**self._fields(key), value=value, expires_at=self._datetime(expires_at))
+                for key, (value, expires_at) in rows.items()
+            ],
+            update_conflicts=True,
+            unique_fields=list(VariableKey._fields),
+            update_fields=["value", "expires_at", "updated_at"],
+        )
+
+    def _lock(self, key: VariableKey):
+        """The row for *key*, locked for the current transaction, or ``None``"""
+        from ..models import Variable
+
+        row = Variable.objects.select_for_update().filter(**self._fields(key)).first()
+        if row is not None and row.is_expired():
+            row.value = None
+        return row
+
+    def _insert(self, key: VariableKey, value: Any, expires_at: Optional[float]) -> bool:
+        """Create the row for *key*; ``False`` if somebody else created it first"""
+        from django.db import IntegrityError, transaction
+        from ..models import Variable
+
+        try:
+            with transaction.atomic():
+                Variable.objects.create(**self._fields(key), value=value, expires_at=self._datetime(expires_at))
+        except IntegrityError:
+            return False
+        return True
+
+    def increment(self, key: VariableKey, delta: float, expires_at: Optional[float]) -> Any:
+        from django.db import transaction
+
+        with transaction.atomic():
+            while True:
+                row = self._lock(key)
+                if row is not None:
+                    break
+                if self._insert(key, delta, expires_at):
+                    return delta
+                # lost the race – lock their row instead
+            row.value = (row.value or 0) + delta
+            row.expires_at = self._datetime(expires_at)
+            row.save(update_fields=["value", "expires_at", "updated_at"])
+            return row.value
+
+    def compare_and_set(self, key: VariableKey, expected: Any, value: Any,
+                        expires_at: Optional[float]) -> Tuple[bool, Any]:
+        from django.db import transaction
+
+        with transaction.atomic():
+            while True:
+                row = self._lock(key)
+                if row is not None:
+                    break
+                # a missing variable only matches None, and is only created on success
+                if expected is not None:
+                    return False, MISSING
+                if self._insert(key, value, expires_at):
+                    return True, value
+            if row.value != expected:
+                return False, row.value
+            row.value = value
+            row.expires_at = self._datetime(expires_at)
+            row.save(update_fields=["value", "expires_at", "updated_at"])
+            return True, value
+
+    def purge_expired(self) -> int:
+        from ..models import Variable
+
+        return Variable.objects.expired().delete()[0]
+
+
+# ---------------  Store -------------------------------------
+
+class VariableStore:
+    """Write-back cache in front of a variable backend.
+
+    ``get`` serves values it has seen in the last *cache_seconds* without a
+    round trip; ``set`` only updates memory and marks the key dirty.
+    :meth:`flush` (run every *flush_interval* seconds by :meth:`start`, and
+    whenever *max_dirty* keys are pending) writes every dirty key in one
+    batch. :meth:`increment` and :meth:`compare_and_set` are executed by
+    the backend itself, so concurrent flows, shards and replicas never lose
+    an update.
+    """
+
+    def __init__(
+        self,
+        backend: Any,
+        *,
+        cache_seconds: float = VARIABLE_CACHE_SECONDS,
+        flush_interval: float = VARIABLE_FLUSH_INTERVAL,
+        max_entries: int = VARIABLE_CACHE_MAX_ENTRIES,
+        max_dirty: int = 500,
+    ):
+        self.backend = backend
+        self.cache_seconds = cache_seconds
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.max_dirty = max_dirty
+
+        # key → (value, expires_at, loaded_at); value may be MISSING
+        self._cache: "OrderedDict[VariableKey, Tuple[Any, Optional[float], float]]" = OrderedDict()
+        # key → (value, expires_at) not yet written to the backend
+        self._dirty: Dict[VariableKey, Tuple[Any, Optional[float]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await sync_to_async(fn)(*args)
+        return fn(*args)
+
+    def _remember(self, key: VariableKey, value: Any, expires_at: Optional[float]) -> None:
+        self._cache[key] = (value, expires_at, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)  # dirty values are kept in _dirty
+
+    @staticmethod
+    def _expiry(ttl: Optional[float]) -> Optional[float]:
+        return time.time() + ttl if ttl is not None else None
+
+    # ---------------  Operations --------------------------------
+
+    async def get(self, key: VariableKey, default: Any = None) -> Any:
+        entry = self._dirty.get(key)
+        if entry is None:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[2] < self.cache_seconds:
+                self.hits += 1
+                entry = cached[:2]
+            else:
+                self.misses += 1
+                entry = await self._call(self.backend.load, key)
+                self._remember(key, *entry)
+
+        value, expires_at = entry
+        if value is MISSING or (expires_at is not None and expires_at <= time.time()):
+            return default
+        return value
+
+    async def set(self, key: VariableKey, value: Any, ttl: Optional[float] = None) -> None:
+        check = getattr(self.backend, "check", None)
+        if check is not None:
+            check(value)
+
+        expires_at = self._expiry(ttl)
+        self._dirty[key] = (value, expires_at)
+        self._remember(key, value, expires_at)
+        if len(self._dirty) >= self.max_dirty:
+            await self.flush()
+
+    async def increment(self, key: VariableKey, delta: float = 1, ttl: Optional[float] = None) -> Any:
+        """Atomically add *delta* (a missing variable counts as 0); return the new value"""
+        if key in self._dirty:
+            await self.flush()
+        expires_at = self._expiry(ttl)
+        value = await self._call(self.backend.increment, key, delta, expires_at)
+        self._remember(key, value, expires_at)
+        return value
+
+    async def compare_and_set(self, key: VariableKey, expected: Any, value: Any,
+                              ttl: Optional[float] = None) -> bool:
+        """Atomically set *value* if the variable currently equals *expected*
+        (``None`` matches a missing variable); return whether it was set"""
+        if key in self._dirty:
+            await self.flush()
+        expires_at = self._expiry(ttl)
+        ok, _ = await self._call(self.backend.compare_and_set, key, expected, value, expires_at)
+        if ok:
+            self._remember(key, value, expires_at)
+        else:
+            self._cache.pop(key, None)  # somebody else changed it; reload next time
+        return ok
+
+    # ---------------  Flushing ----------------------------------
+
+    async def flush(self) -> int:
+        """Write every dirty variable in one batch; return how many were written"""
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        try:
+            await self._call(self.backend.write_many, batch)
+        except BaseException:
+            # keep them for the next attempt, unless they were overwritten meanwhile
+            self._dirty = {**batch, **self._dirty}
+            raise
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        return len(batch)
+
+    async def flush_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await self._call(self.backend.purge_expired)
+            except Exception as exc:
+                print(f"Variable flush failed: {exc!r}")
+
+    def start(self) -> None:
+        """Start the periodic flush on the running loop (no-op if already running)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self.flush_forever())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+_store: Optional[VariableStore] = None
+
+
+def default_store() -> VariableStore:
+    """The process-wide store, shared by every bot in this process"""
+    global _store
+    if _store is None:
+        backend = MemoryBackend() if VARIABLE_BACKEND == "memory" else DjangoBackend()
+        _store = VariableStore(backend)
+    return _store
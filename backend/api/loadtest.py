@@ -0,0 +1,135 @@
+"""
+loadtest.py
+
+HTTP load test for the flow endpoints, to compare server setups (e.g. WSGI
+with the sync views vs. ASGI with the async ones) against the same database.
+
+Start each server, then run from the ``backend`` directory::
+
+    ASYNC_API=0 gunicorn FlowCord.wsgi:application --bind 127.0.0.1:8001 -w 4
+    gunicorn FlowCord.asgi:application -k uvicorn_worker.UvicornWorker --bind 127.0.0.1:8002 -w 4
+
+    python -m api.loadtest --target wsgi=http://127.0.0.1:8001 \\
+                           --target asgi=http://127.0.0.1:8002 \\
+                           --concurrency 64 --duration 20 --write-ratio 0.1
+
+Reads list flows (``?fields=flowId,name`` and full bodies alternately);
+writes re-save one flow created for the test, which is deleted afterwards.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+# Valid minimal flow: a slash command feeding a send block
+TEST_FLOW = {
+    "name": "loadtest",
+    "nodes": [
+        {"id": "s", "code_id": "__slash__", "command": "loadtest", "description": "load test",
+         "options": [], "inputs": [], "outputs": [{"name": "ctx"}]},
+        {"id": "n", "code_id": "send", "text": "hi",
+         "inputs": [{"name": "channel_id"}, {"name": "text"}], "outputs": []},
+    ],
+    "edges": [{"id": "e", "sourceId": "s", "sourcePort": "ctx", "targetId": "n", "targetPort": "channel_id"}],
+}
+
+READ_PATHS = ("/api/flows/?fields=flowId,name", "/api/flows/")
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _worker(session: aiohttp.ClientSession, base: str, flow_id: int, until: float,
+                  write_ratio: float, samples: List[float], errors: List[int]) -> None:
+    while time.monotonic() < until:
+        write = random.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if write:
+                request = session.put(f"{base}/api/flows/", json={**TEST_FLOW, "flowId": flow_id})
+            else:
+                request = session.get(f"{base}{random.choice(READ_PATHS)}")
+            async with request as response:
+                await response.read()
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        samples.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(1)
+
+
+async def run_target(base: str, concurrency: int, duration: float, write_ratio: float) -> Dict[str, float]:
+    """Hammer *base* for *duration* seconds; return throughput and latency stats"""
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async with session.post(f"{base}/api/flows/", json={**TEST_FLOW, "flowId": None}) as response:
+            response.raise_for_status()
+            flow_id = (await response.json())["flowId"]
+
+        samples: List[float] = []
+        errors: List[int] = []
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(
+                _worker(session, base, flow_id, started + duration, write_ratio, samples, errors)
+                for _ in range(concurrency)
+            ))
+        finally:
+            async with session.delete(f"{base}/api/flows/", json={"flowId": flow_id}) as response:
+                await response.read()
+        elapsed = time.monotonic() - started
+
+    ordered = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "requests_per_s": len(samples) / elapsed,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+    }
+
+
+def _target(value: str) -> Tuple[str, str]:
+    name, sep, url = value.partition("=")
+    if not sep:
+        name, url = value, value
+    return name, url.rstrip("/")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flow API load test")
+    parser.add_argument("--target", action="append", type=_target, required=True,
+                        help="name=base_url of a running server; repeat to compare")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per target")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="share of requests that save a flow")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, url in args.target:
+        results[name] = asyncio.run(run_target(url, args.concurrency, args.duration, args.write_ratio))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'target':<12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['requests_per_s']:>9.1f} {r['p50_ms']:>9.1f} "
+              f"{r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.graph_workspace.graph_runner import flow_digest
+from api.graph_workspace.validation import validate_flow
+from api.models import Flows
+from api.views import called_flows
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the slash command and block usage tables from every saved flow, "
+        "backfilling content hashes, versions and validated plans"
+    )
+
+    def handle(self, *args, **options):
+        count = updated = 0
+        for flow in Flows.objects.iterator():
+            graph = {"flowId": flow.pk, "nodes": flow.nodes, "edges": flow.edges}
+            _, plan = validate_flow(graph, subflows=called_flows(flow.nodes))
+            with transaction.atomic():
+                version = flow.version
+                if plan != flow.plan or flow_digest(graph) != flow.content_hash:
+                    flow.plan = plan
+                    # recomputes content_hash, and bumps the version of flows
+                    # stored before either was tracked
+                    flow.save(update_fields=["plan"])
+                    updated += 1
+                if flow.version == version:
+                    # save() only reindexes changed content
+                    flow.reindex()
+            count += 1
+        self.stdout.write(f"Reindexed {count} flows, updated {updated}")
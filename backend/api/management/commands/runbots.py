@@ -0,0 +1,44 @@
+import asyncio
+import os
+import signal
+
+from django.core.management.base import BaseCommand
+
+from api.graph_workspace import instrumentation
+from api.graph_workspace.supervisor import BotSupervisor
+
+
+class Command(BaseCommand):
+    help = "Run the bot supervisor: start and stop bots requested through /api/run_bot/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", default=None,
+                            help="Worker name stored on claimed jobs (default: host-pid)")
+        parser.add_argument("--max-bots", type=int,
+                            default=int(os.environ.get("BOT_MAX_PER_WORKER", 10)),
+                            help="Most bots this worker runs at once")
+        parser.add_argument("--poll-interval", type=float, default=5.0,
+                            help="Seconds between job table checks")
+        parser.add_argument("--lease-timeout", type=float, default=30.0,
+                            help="Seconds without heartbeat before another worker takes over a job")
+        parser.add_argument("--profile", action="store_true",
+                            help="Collect per-block latency percentiles (see manage.py runner_stats)")
+
+    def handle(self, *args, **options):
+        if options["profile"]:
+            instrumentation.add_instrument(instrumentation.collector)
+        asyncio.run(self.supervise(options))
+
+    async def supervise(self, options):
+        supervisor = BotSupervisor(
+            options["name"],
+            max_bots=options["max_bots"],
+            poll_interval=options["poll_interval"],
+            lease_timeout=options["lease_timeout"],
+        )
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, supervisor.stop)
+
+        self.stdout.write(f"Supervisor {supervisor.name} running (max {supervisor.max_bots} bots)")
+        await supervisor.run()
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.models import BotShard
+
+
+class Command(BaseCommand):
+    help = "Print per-block latency percentiles reported by profiling supervisors (runbots --profile)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Dump the raw stats as JSON")
+
+    def handle(self, *args, **options):
+        # the collector is process-wide, so one report per worker is enough
+        reports = {}
+        for worker, stats in BotShard.objects.exclude(worker="").values_list("worker", "stats"):
+            if stats.get("blocks"):
+                reports.setdefault(worker, stats["blocks"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+        if not reports:
+            self.stdout.write("No profiling data; start supervisors with 'runbots --profile'.")
+            return
+
+        header = f"{'block':<24}{'calls':>8}{'errors':>8}{'cached':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu p95':>10}"
+        for worker, blocks in sorted(reports.items()):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{worker}"))
+            self.stdout.write(header)
+            for code_id, s in sorted(blocks.items(), key=lambda kv: -kv[1]["wall_p95_ms"]):
+                self.stdout.write(
+                    f"{code_id:<24}{s['calls']:>8}{s['errors']:>8}{s['cached']:>8}"
+                    f"{s['wall_p50_ms']:>10.2f}{s['wall_p95_ms']:>10.2f}{s['wall_p99_ms']:>10.2f}"
+                    f"{s['cpu_p95_ms']:>10.2f}"
+                )
@@ -1,7 +1,165 @@
-from django.db import models
+from collections import Counter
+
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.utils import timezone
+
+from .graph_workspace.graph_runner import flow_digest
+
 
 class Flows(models.Model):
     flowId = models.AutoField(primary_key=True)
     nodes = models.JSONField()
     edges = models.JSONField()
     name = models.CharField(max_length=50)
+    content_hash = models.CharField(max_length=64, editable=False, default="")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # order etc. from graph_workspace.validation; ignored by bots once stale
+    plan = models.JSONField(null=True, blank=True, editable=False)
+    # bumped whenever nodes/edges change
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # cap on blocks awaited at once per run (None → the runner's default)
+    maxConcurrency = models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1)])
+
+    def save(self, *args, **kwargs):
+        content_hash = flow_digest({"nodes": self.nodes, "edges": self.edges})
+        changed = self._state.adding or content_hash != self.content_hash
+        self.content_hash = content_hash
+        if changed:
+            self.version += 1
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "content_hash", "version", "updated_at"}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if changed:
+                self.reindex()
+
+    def reindex(self) -> None:
+        """Rebuild this flow's :class:`FlowCommand` and :class:`FlowBlockUsage` rows"""
+        self.commands.all().delete()
+        self.block_usages.all().delete()
+
+        nodes = [n for n in self.nodes if isinstance(n, dict)]
+        FlowCommand.objects.bulk_create(
+            FlowCommand(
+                flow=self,
+                node_id=str(n.get("id", "")),
+                name=n.get("command", ""),
+                description=n.get("description", ""),
+            )
+            for n in nodes if n.get("code_id") == "__slash__"
+        )
+        usage = Counter(n["code_id"] for n in nodes if n.get("code_id"))
+        FlowBlockUsage.objects.bulk_create(
+            FlowBlockUsage(flow=self, code_id=code_id, count=count) for code_id, count in usage.items()
+        )
+
+
+class FlowCommand(models.Model):
+    """A slash command registered by a flow (derived from its nodes on save)"""
+
+    flow = models.ForeignKey(Flows, related_name="commands", on_delete=models.CASCADE)
+    node_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=32, db_index=True)
+    description = models.CharField(max_length=100, blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["flow", "node_id"], name="unique_flow_command_node"),
+        ]
+
+
+class FlowBlockUsage(models.Model):
+    """How many nodes of a flow use a block (derived from its nodes on save)"""
+
+    flow = models.ForeignKey(Flows, related_name="block_usages", on_delete=models.CASCADE)
+    code_id = models.CharField(max_length=100, db_index=True)
+    count = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["flow", "code_id"], name="unique_flow_block_usage"),
+        ]
+
+
+class BotJob(models.Model):
+    """A bot the supervisor (``manage.py runbots``) should run or stop"""
+
+    class State(models.TextChoices):
+        PENDING = "pending"
+        STARTING = "starting"
+        RUNNING = "running"
+        STOPPED = "stopped"
+        FAILED = "failed"
+
+    jobId = models.AutoField(primary_key=True)
+    token = models.CharField(max_length=100, unique=True)
+    desired_state = models.CharField(max_length=10, choices=State.choices, default=State.RUNNING)
+    shard_count = models.PositiveIntegerField(null=True, blank=True)  # None → Discord's recommendation
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class BotShard(models.Model):
+    """A range of a job's gateway shards, run by one supervisor at a time"""
+
+    job = models.ForeignKey(BotJob, related_name="shards", on_delete=models.CASCADE)
+    shard_ids = models.JSONField(null=True, blank=True)  # None → every shard
+    status = models.CharField(max_length=10, choices=BotJob.State.choices, default=BotJob.State.PENDING)
+    worker = models.CharField(max_length=100, blank=True, default="", db_index=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    stats = models.JSONField(default=dict, blank=True)
+
+
+class VariableQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()))
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class Variable(models.Model):
+    """A flow variable (see ``graph_workspace.variables``)"""
+
+    class Scope(models.TextChoices):
+        GLOBAL = "global"
+        GUILD = "guild"
+        CHANNEL = "channel"
+        USER = "user"
+
+    namespace = models.CharField(max_length=32, blank=True, default="")  # bot application id
+    scope = models.CharField(max_length=7, choices=Scope.choices, default=Scope.GLOBAL)
+    scope_id = models.CharField(max_length=32, blank=True, default="")  # "" for global
+    name = models.CharField(max_length=100)
+    value = models.JSONField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = VariableQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["namespace", "scope", "scope_id", "name"], name="unique_variable"),
+        ]
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+
+class ScheduleState(models.Model):
+    """When a scheduled flow fires next (see ``graph_workspace.scheduler``)"""
+
+    namespace = models.CharField(max_length=32, blank=True, default="")  # bot application id
+    key = models.CharField(max_length=150)  # "flowId:nodeId"
+    spec = models.CharField(max_length=120)  # "cron:…" / "interval:…" the time was computed for
+    next_fire_at = models.DateTimeField()
+    last_fired_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["namespace", "key"], name="unique_schedule"),
+        ]
@@ -1,9 +1,31 @@
 from rest_framework import serializers
 
-from .models import Flows
+from .models import BotJob, BotShard, Flows
 
 
 class FlowSerializer(serializers.ModelSerializer):
+    """Serializes flows; pass ``fields=[...]`` to only include some columns"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = Flows
         fields = '__all__'
+
+
+class BotShardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BotShard
+        exclude = ['job']
+
+
+class BotJobSerializer(serializers.ModelSerializer):
+    shards = BotShardSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = BotJob
+        exclude = ['token']
@@ -1,3 +1,987 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import pathlib
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+import discord
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import call_command
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.utils.http import http_date
+
+from .graph_workspace import memo
+from .graph_workspace.api_client import FlowClient
+from .graph_workspace.blocks import block
+from .graph_workspace.graph_runner import (
+    GraphValidationError, clear_plan_cache, compile_graph, estimate_cost, flow_digest, run_graph,
+)
+from .graph_workspace.outbox import Outbox
+from .graph_workspace.runbot import FlowBot
+from .graph_workspace.scheduler import CronSpec, MemoryScheduleStore, Scheduler, schedule_for
+from .graph_workspace.supervisor import BotSupervisor
+from .graph_workspace.triggers import TriggerIndex, TriggerMetrics, trigger_for
+from .graph_workspace.validation import validate_flow
+from .graph_workspace.variables import MISSING, DjangoBackend, MemoryBackend, VariableKey, VariableStore
+from .models import BotJob, BotShard, FlowCommand, Flows, Variable
+from .views import AsyncFlowsView, FlowsView
+
+COMPONENTS = "api.graph_workspace.components"
+
+# Blocks of this module, for flows compiled with module_name="api.tests"
+calls = []
+
+
+@block("Record Call")
+def record_call(text: str) -> None:
+    calls.append(text)
+
+
+@block("Shout", pure=True)
+def shout(text: str) -> str:
+    return text.upper()
+
+
+# ("start" | "end", label) in the order the blocks below ran
+events = []
+
+
+@block("Wait", sink=False)
+async def wait(label: str, seconds: float = 0.01) -> str:
+    events.append(("start", label))
+    await asyncio.sleep(seconds)
+    events.append(("end", label))
+    return label
+
+
+@block("Log In Order", concurrent=False)
+async def log_in_order(label: str) -> None:
+    events.append(("start", label))
+    await asyncio.sleep(0.01)
+    events.append(("end", label))
+
+
+@block("Loud", pure=True)
+def loud(text: str) -> str:
+    events.append(("loud", text))
+    return text.upper()
+
+
+@block("Split", critical=False, sink=False)
+async def split(text: str, seconds: float = 0) -> dict:
+    await asyncio.sleep(seconds)
+    head, _, tail = text.partition(" ")
+    return {"head": head, "tail": tail}
+
+
+def node(node_id, code_id, inputs=(), outputs=("output",), **fields):
+    return {
+        "id": node_id,
+        "code_id": code_id,
+        "label": node_id,
+        "inputs": [{"name": name} for name in inputs],
+        "outputs": [{"name": name} for name in outputs],
+        **fields,
+    }
+
+
+def edge(source, source_port, target, target_port):
+    return {"sourceId": source, "sourcePort": source_port, "targetId": target, "targetPort": target_port}
+
+
+class PlanCacheTests(SimpleTestCase):
+    def setUp(self):
+        clear_plan_cache()
+
+    def lower_flow(self, text, max_concurrency=None):
+        return {
+            "nodes": [node("a", "to_lower", ["text"])],
+            "edges": [],
+            "constants": {"a.text": text},
+            "maxConcurrency": max_concurrency,
+        }
+
+    def test_same_flow_reuses_plan(self):
+        self.assertIs(
+            compile_graph(self.lower_flow("ONE"), COMPONENTS),
+            compile_graph(self.lower_flow("ONE"), COMPONENTS),
+        )
+
+    def test_constants_invalidate_plan(self):
+        one = async_to_sync(run_graph)(self.lower_flow("ONE"), COMPONENTS)
+        two = async_to_sync(run_graph)(self.lower_flow("TWO"), COMPONENTS)
+        self.assertEqual(one[("a", "output")], "one")
+        self.assertEqual(two[("a", "output")], "two")
+
+    def test_constants_invalidate_saved_flow_plan(self):
+        first = compile_graph({**self.lower_flow("ONE"), "flowId": 7}, COMPONENTS)
+        second = compile_graph({**self.lower_flow("TWO"), "flowId": 7}, COMPONENTS)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.initial[second.slots[("a", "text")]], "TWO")
+
+    def test_lazy_plan_runs_unmarked_blocks(self):
+        calls.clear()
+        flow = {
+            "nodes": [node("s", "shout", ["text"]), node("r", "record_call", ["text"], ())],
+            "edges": [],
+            "constants": {"s.text": "hi", "r.text": "ran"},
+        }
+        plan = compile_graph(flow, "api.tests", lazy=True)
+        self.assertEqual([n.node_id for n in plan.order], ["r"])
+        async_to_sync(run_graph)(plan)
+        self.assertEqual(calls, ["ran"])
+
+    def test_max_concurrency_invalidates_plan(self):
+        self.assertEqual(compile_graph(self.lower_flow("ONE", 3), COMPONENTS).max_concurrency, 3)
+        self.assertEqual(compile_graph(self.lower_flow("ONE", 5), COMPONENTS).max_concurrency, 5)
+
+
+class RunGraphTests(SimpleTestCase):
+    def setUp(self):
+        clear_plan_cache()
+        events.clear()
+
+    def branches(self, code_id, count=3, **fields):
+        return {
+            "nodes": [node(f"n{i}", code_id, ["label"], label=f"n{i}") for i in range(count)],
+            "edges": [],
+            **fields,
+        }
+
+    def test_independent_branches_overlap(self):
+        async_to_sync(run_graph)(self.branches("wait"), "api.tests")
+        self.assertEqual([kind for kind, _ in events], ["start"] * 3 + ["end"] * 3)
+
+    def test_concurrency_cap(self):
+        async_to_sync(run_graph)(self.branches("wait"), "api.tests", max_concurrency=1)
+        self.assertEqual([kind for kind, _ in events], ["start", "end"] * 3)
+
+        events.clear()
+        async_to_sync(run_graph)(self.branches("wait", maxConcurrency=2), "api.tests")
+        self.assertEqual([kind for kind, _ in events[:3]], ["start", "start", "end"])
+
+    def test_non_concurrent_blocks_run_in_flow_order(self):
+        async_to_sync(run_graph)(self.branches("log_in_order"), "api.tests")
+        self.assertEqual(
+            events,
+            [(kind, f"n{i}") for i in range(3) for kind in ("start", "end")],
+        )
+
+    def test_edges_order_dependent_blocks(self):
+        flow = {
+            "nodes": [node("a", "wait", ["label"], label="a"), node("b", "wait", ["label"])],
+            "edges": [edge("a", "output", "b", "label")],
+        }
+        values = async_to_sync(run_graph)(flow, "api.tests")
+        self.assertEqual(values[("b", "output")], "a")
+        self.assertEqual(events, [("start", "a"), ("end", "a"), ("start", "a"), ("end", "a")])
+
+    def test_non_positive_caps_are_rejected(self):
+        for cap in (0, -1, 1.5, True):
+            with self.subTest(cap=cap), self.assertRaises(ValueError):
+                async_to_sync(run_graph)(self.branches("wait"), "api.tests", max_concurrency=cap)
+            with self.subTest(cap=cap), self.assertRaises(GraphValidationError):
+                compile_graph(self.branches("wait", maxConcurrency=cap), "api.tests")
+        self.assertEqual(events, [])
+
+
+class SubflowTests(SimpleTestCase):
+    modules = f"api.tests,{COMPONENTS}"
+
+    # flow 9: text → LOUD and text → lower
+    child = {
+        "flowId": 9,
+        "nodes": [
+            node("in", "__flow_input__", (), ("value",), name="text"),
+            node("up", "loud", ["text"]),
+            node("down", "to_lower", ["text"]),
+            node("o1", "__flow_output__", ["value"], (), name="loud"),
+            node("o2", "__flow_output__", ["value"], (), name="quiet"),
+        ],
+        "edges": [
+            edge("in", "value", "up", "text"),
+            edge("in", "value", "down", "text"),
+            edge("up", "output", "o1", "value"),
+            edge("down", "output", "o2", "value"),
+        ],
+    }
+
+    def setUp(self):
+        clear_plan_cache()
+        memo.results.invalidate()
+        events.clear()
+        calls.clear()
+
+    def parent(self, flow_id, outputs, text="Hi"):
+        return {
+            "flowId": flow_id,
+            "nodes": [
+                node("sub", "__subflow__", ["text"], outputs, flowId=9, text=text),
+                node("rec", "record_call", ["text"], ()),
+            ],
+            "edges": [edge("sub", outputs[0], "rec", "text")],
+        }
+
+    def run_flow(self, flow, lazy=False):
+        plan = compile_graph(flow, self.modules, lazy=lazy, subflows={9: self.child})
+        return async_to_sync(run_graph)(plan)
+
+    def test_one_declared_output_of_several(self):
+        values = self.run_flow(self.parent(1, ("loud",)))
+        self.assertEqual(values[("sub", "loud")], "HI")
+        self.assertEqual(calls, ["HI"])
+
+    def test_several_declared_outputs(self):
+        values = self.run_flow(self.parent(1, ("quiet", "loud")))
+        self.assertEqual((values[("sub", "quiet")], values[("sub", "loud")]), ("hi", "HI"))
+        self.assertEqual(calls, ["hi"])
+
+    def test_callers_share_the_child_plan_and_memo(self):
+        self.run_flow(self.parent(1, ("loud",)), lazy=True)
+        self.run_flow(self.parent(2, ("quiet",)), lazy=True)
+        self.run_flow(self.parent(1, ("loud",)), lazy=True)
+        self.assertEqual(calls, ["HI", "hi", "HI"])
+        self.assertEqual(events, [("loud", "Hi")])  # the child's pure block ran once
+
+    def test_each_subflow_keeps_its_own_cost(self):
+        slow = {
+            "flowId": 8,
+            "nodes": [node("w", "wait", ["label"], label="x"), node("o", "__flow_output__", ["value"], (), name="v")],
+            "edges": [edge("w", "output", "o", "value")],
+        }
+        flow = {
+            "nodes": [
+                node("a", "__subflow__", ["text"], ("loud",), flowId=9, text="x"),
+                node("b", "__subflow__", (), ("v",), flowId=8),
+            ],
+            "edges": [],
+        }
+        plan = compile_graph(flow, self.modules, subflows={9: self.child, 8: slow})
+        self.assertGreater(estimate_cost(plan), 0.0)
+        costs = {n.node_id: n.fn.__block_cost__ for n in plan.order}
+        self.assertEqual(costs["a"], 0.0)
+        self.assertGreater(costs["b"], 0.0)
+
+
+class DeadlineTests(SimpleTestCase):
+    def flow(self, seconds):
+        return {
+            "nodes": [
+                node("sp", "split", ["text", "seconds"], ("head", "tail"), text="a b", seconds=seconds),
+                node("h", "record_call", ["text"], ()),
+                node("t", "record_call", ["text"], ()),
+            ],
+            "edges": [edge("sp", "head", "h", "text"), edge("sp", "tail", "t", "text")],
+        }
+
+    def setUp(self):
+        clear_plan_cache()
+        calls.clear()
+
+    def test_skipped_after_deadline(self):
+        values = async_to_sync(run_graph)(self.flow(0), "api.tests", deadline=time.monotonic() - 1)
+        self.assertEqual((values[("sp", "head")], values[("sp", "tail")]), (None, None))
+        self.assertEqual(calls, [None, None])  # critical blocks still run, on None
+
+    def test_cancelled_at_deadline(self):
+        started = time.monotonic()
+        values = async_to_sync(run_graph)(self.flow(5), "api.tests", deadline=time.monotonic() + 0.05)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((values[("sp", "head")], values[("sp", "tail")]), (None, None))
+        self.assertEqual(calls, [None, None])
+
+    def test_runs_normally_before_deadline(self):
+        values = async_to_sync(run_graph)(self.flow(0), "api.tests", deadline=time.monotonic() + 5)
+        self.assertEqual(values[("sp", "head")], "a")
+        self.assertEqual(sorted(calls), ["a", "b"])
+
+
+class VariableStoreMixin:
+    key = VariableKey("app", "global", "", "counter")
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+        self.store = VariableStore(self.backend, cache_seconds=0)
+
+    def run_async(self, fn, *args, **kwargs):
+        return async_to_sync(fn)(*args, **kwargs)
+
+    def test_increment(self):
+        self.assertEqual(self.run_async(self.store.increment, self.key), 1)
+        self.assertEqual(self.run_async(self.store.increment, self.key, 2.5), 3.5)
+        self.assertEqual(self.run_async(self.store.get, self.key), 3.5)
+
+    def test_increment_flushes_pending_set(self):
+        self.run_async(self.store.set, self.key, 10)
+        self.assertEqual(self.run_async(self.store.increment, self.key), 11)
+
+    def test_compare_and_set(self):
+        self.assertTrue(self.run_async(self.store.compare_and_set, self.key, None, "a"))
+        self.assertFalse(self.run_async(self.store.compare_and_set, self.key, "b", "c"))
+        self.assertTrue(self.run_async(self.store.compare_and_set, self.key, "a", "b"))
+        self.assertEqual(self.run_async(self.store.get, self.key), "b")
+
+    def test_failed_compare_and_set_leaves_missing_variable(self):
+        self.assertFalse(self.run_async(self.store.compare_and_set, self.key, "x", "y"))
+        self.assertEqual(self.run_async(self.store.get, self.key, "default"), "default")
+
+    def test_set_is_written_on_flush(self):
+        self.run_async(self.store.set, self.key, {"n": 1})
+        self.assertIs(self.backend.load(self.key)[0], MISSING)
+        self.assertEqual(self.run_async(self.store.flush), 1)
+        self.assertEqual(self.backend.load(self.key)[0], {"n": 1})
+        self.assertEqual(self.run_async(self.store.flush), 0)
+
+
+class MemoryVariableStoreTests(VariableStoreMixin, SimpleTestCase):
+    def make_backend(self):
+        return MemoryBackend()
+
+
+class DjangoVariableStoreTests(VariableStoreMixin, TestCase):
+    def make_backend(self):
+        return DjangoBackend()
+
+    def test_failed_compare_and_set_creates_no_row(self):
+        self.run_async(self.store.compare_and_set, self.key, "x", "y")
+        self.assertFalse(Variable.objects.exists())
+
+
+class TriggerIndexTests(SimpleTestCase):
+    def trigger(self, node_id, code_id="__message__", **fields):
+        return trigger_for(node(node_id, code_id, **fields), None)
+
+    def matched(self, index, content, guild_id=1, channel_id=2, **kwargs):
+        return [
+            (t.node["id"], rest)
+            for t, rest in index.match("message", guild_id, channel_id, content=content, **kwargs)
+        ]
+
+    def test_prefix(self):
+        index = TriggerIndex([self.trigger("p", prefix="!roll")])
+        self.assertEqual(self.matched(index, "!roll 2d6"), [("p", "2d6")])
+        self.assertEqual(self.matched(index, "roll 2d6"), [])
+
+    def test_pattern(self):
+        index = TriggerIndex([self.trigger("r", pattern=r"(?i)hello\b"), self.trigger("b", pattern=r"(a)\1")])
+        self.assertEqual(self.matched(index, "HELLO there"), [("r", "there")])
+        self.assertEqual(self.matched(index, "say aa now"), [("b", "now")])
+        self.assertEqual(self.matched(index, "helloworld"), [])
+
+    def test_prefix_and_pattern(self):
+        index = TriggerIndex([self.trigger("pp", prefix="!set", pattern=r"^\w+")])
+        self.assertEqual(self.matched(index, "!set name Bob"), [("pp", "Bob")])
+        self.assertEqual(self.matched(index, "!set  "), [])
+
+    def test_guild_and_channel_filters(self):
+        index = TriggerIndex([
+            self.trigger("any"),
+            self.trigger("guild", guild_id="1"),
+            self.trigger("channel", guild_id="1", channel_id="3"),
+        ])
+        self.assertEqual({m[0] for m in self.matched(index, "x")}, {"any", "guild"})
+        self.assertEqual({m[0] for m in self.matched(index, "x", channel_id=3)}, {"any", "guild", "channel"})
+        self.assertEqual({m[0] for m in self.matched(index, "x", guild_id=9)}, {"any"})
+
+    def test_bots_and_other_events(self):
+        index = TriggerIndex([self.trigger("m"), self.trigger("e", "__reaction__", emoji="👍")])
+        self.assertEqual(self.matched(index, "x", from_bot=True), [])
+        self.assertEqual(len(index.match("raw_reaction_add", 1, 2, emoji="👍")), 1)
+        self.assertEqual(index.match("raw_reaction_add", 1, 2, emoji="👎"), [])
+        self.assertEqual(index.match("member_join", 1, None), [])
+
+
+class TriggerSheddingTests(SimpleTestCase):
+    def test_matches_beyond_capacity_are_shed(self):
+        async def burst():
+            bot = FlowBot()
+            release = asyncio.Event()
+
+            async def run_trigger(*args):
+                await release.wait()
+
+            bot.run_trigger = run_trigger
+            bot.triggers = TriggerIndex([trigger_for(node(f"t{i}", "__message__"), None) for i in range(3)])
+            try:
+                with mock.patch("api.graph_workspace.runbot.TRIGGER_MAX_CONCURRENCY", 4):
+                    started = [bot.start_triggers("message", 1, 2, None, {}, None, content="x") for _ in range(2)]
+                    running = len(bot._trigger_runs)
+                    release.set()
+                    await asyncio.gather(*bot._trigger_runs)
+                return started, running, bot.trigger_metrics.snapshot()["message"]
+            finally:
+                await bot.api.close()
+
+        started, running, metrics = async_to_sync(burst)()
+        self.assertEqual(started, [3, 1])
+        self.assertEqual(running, 4)
+        self.assertEqual(metrics, {"received": 2, "dispatched": 4, "shed": 2, "unmatched": 0})
+
+    def test_unmatched_events_are_not_shed(self):
+        metrics = TriggerMetrics()
+        metrics.record("message", 0)
+        self.assertEqual(metrics.snapshot()["message"], {"received": 1, "dispatched": 0, "shed": 0, "unmatched": 1})
+
+
+class BotCloseTests(SimpleTestCase):
+    def test_close_stops_background_tasks(self):
+        async def lifecycle():
+            bot = FlowBot()
+            bot.scheduler.store = MemoryScheduleStore()
+            hanging = asyncio.Event()
+
+            async def fetch_flows():
+                await hanging.wait()
+
+            bot.api.load_snapshot = lambda: []
+            bot.api.fetch_flows = fetch_flows
+            # never connected, so there is no gateway for discord.py to close
+            with mock.patch("api.graph_workspace.runbot.FLOW_RELOAD_INTERVAL", 0.01), \
+                    mock.patch.object(discord.AutoShardedClient, "close", mock.AsyncMock()):
+                await bot.setup_hook()
+                await asyncio.sleep(0.05)
+                tasks = set(bot._background)
+                await bot.close()
+            return tasks, bot
+
+        tasks, bot = async_to_sync(lifecycle)()
+        self.assertEqual(len(tasks), 3)  # refresher, reloader, scheduler
+        self.assertTrue(all(task.done() for task in tasks))
+        self.assertEqual(bot._background, set())
+
+
+class FakeBot:
+    """Stands in for FlowBot: "connected" until closed"""
+
+    def __init__(self, shard_ids=None, shard_count=None):
+        self.shard_ids = shard_ids
+        self.closed = asyncio.Event()
+
+    async def login(self, token):
+        pass
+
+    async def connect(self):
+        await self.closed.wait()
+
+    async def close(self):
+        self.closed.set()
+
+    def is_closed(self):
+        return self.closed.is_set()
+
+    def metrics(self):
+        return {"shards": self.shard_ids}
+
+
+@mock.patch("api.graph_workspace.supervisor.FlowBot", FakeBot)
+class SupervisorTests(TestCase):
+    def setUp(self):
+        self.job = BotJob.objects.create(token="t", shard_count=4)
+        BotShard.objects.create(job=self.job, shard_ids=[0, 1])
+        BotShard.objects.create(job=self.job, shard_ids=[2, 3])
+
+    def test_reconcile_starts_and_stops_bots(self):
+        supervisor = BotSupervisor("w1")
+
+        async def run():
+            await supervisor.reconcile()
+            await asyncio.sleep(0.01)  # let the bots log in
+            running = sorted(shard.shard_ids for shard, _, _ in supervisor.bots.values())
+            await sync_to_async(BotJob.objects.filter(pk=self.job.pk).update)(desired_state=BotJob.State.STOPPED)
+            await supervisor.reconcile()
+            return running
+
+        self.assertEqual(async_to_sync(run)(), [[0, 1], [2, 3]])
+        self.assertEqual(supervisor.bots, {})
+        self.assertEqual(set(BotShard.objects.values_list("worker", "status")), {("", BotJob.State.STOPPED)})
+
+    def test_shard_ranges_spread_over_supervisors(self):
+        supervisors = [BotSupervisor("w1", max_bots=1), BotSupervisor("w2", max_bots=1)]
+
+        async def run():
+            for supervisor in supervisors:
+                await supervisor.reconcile()
+            claimed = await sync_to_async(lambda: sorted(BotShard.objects.values_list("worker", flat=True)))()
+            for supervisor in supervisors:
+                for shard_pk in list(supervisor.bots):
+                    await supervisor._stop_bot(shard_pk)
+            return claimed
+
+        self.assertEqual(async_to_sync(run)(), ["w1", "w2"])
+
+    def test_stopping_a_bot_that_already_exited(self):
+        supervisor = BotSupervisor("w1")
+
+        async def run():
+            await supervisor.reconcile()
+            shard_pk = next(iter(supervisor.bots))
+            _, bot, task = supervisor.bots[shard_pk]
+            await bot.close()  # connect() returns, _run_bot removes the entry
+            await task
+            await supervisor._stop_bot(shard_pk)
+            for pk in list(supervisor.bots):
+                await supervisor._stop_bot(pk)
+
+        async_to_sync(run)()
+        self.assertEqual(supervisor.bots, {})
+
+
+class FakeChannel:
+    def __init__(self, channel_id, log):
+        self.id = channel_id
+        self.log = log
+
+    async def send(self, content):
+        await asyncio.sleep(0)
+        self.log.append(("send", self.id, content))
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+    async def edit(self, content):
+        await asyncio.sleep(0)
+        self.channel.log.append(("edit", self.id, content))
+
+
+class OutboxTests(SimpleTestCase):
+    def setUp(self):
+        self.log = []
+        self.channel = FakeChannel(1, self.log)
+        self.message = FakeMessage(10, self.channel)
+
+    def test_edits_to_one_message_coalesce(self):
+        async def run():
+            outbox = Outbox()
+            for text in ("1", "2", "3"):
+                outbox.edit(self.message, text)
+            await outbox.flush()
+            return outbox.stats
+
+        stats = async_to_sync(run)()
+        self.assertEqual(self.log, [("edit", 10, "3")])
+        self.assertEqual(stats.coalesced_edits, 2)
+        self.assertEqual(stats.issued["edit"], 1)
+
+    def test_edits_around_a_send_stay_in_order(self):
+        async def run():
+            outbox = Outbox()
+            outbox.edit(self.message, "1")
+            outbox.send(self.channel, "a")
+            outbox.edit(self.message, "2")
+            await outbox.flush()
+            return outbox.stats
+
+        stats = async_to_sync(run)()
+        self.assertEqual(self.log, [("edit", 10, "1"), ("send", 1, "a"), ("edit", 10, "2")])
+        self.assertEqual(stats.coalesced_edits, 0)
+
+    def test_merge_sends(self):
+        async def run():
+            outbox = Outbox(merge_sends=True)
+            outbox.send(self.channel, "a")
+            outbox.send(self.channel, "b")
+            outbox.edit(self.message, "e")
+            outbox.send(self.channel, "c")
+            await outbox.flush()
+
+        async_to_sync(run)()
+        self.assertEqual(self.log, [("send", 1, "a\nb"), ("edit", 10, "e"), ("send", 1, "c")])
+
+    def test_sends_without_merging_stay_separate(self):
+        async def run():
+            outbox = Outbox(merge_sends=False)
+            outbox.send(self.channel, "a")
+            outbox.send(self.channel, "b")
+            await outbox.flush()
+
+        async_to_sync(run)()
+        self.assertEqual(self.log, [("send", 1, "a"), ("send", 1, "b")])
+
+    def test_actions_go_out_while_the_run_waits(self):
+        async def run():
+            outbox = Outbox()
+            outbox.send(self.channel, "working…")
+            await asyncio.sleep(0.01)  # a slow block
+            sent_before_end = list(self.log)
+            outbox.edit(self.message, "done")
+            await outbox.flush()
+            return sent_before_end
+
+        self.assertEqual(async_to_sync(run)(), [("send", 1, "working…")])
+        self.assertEqual(self.log[-1], ("edit", 10, "done"))
+
+    def test_flush_raises_send_errors_after_sending_the_rest(self):
+        class Broken(FakeChannel):
+            async def send(self, content):
+                raise RuntimeError("forbidden")
+
+        async def run():
+            outbox = Outbox()
+            outbox.send(Broken(2, self.log), "lost")
+            outbox.send(self.channel, "kept")
+            await outbox.flush()
+
+        with self.assertRaisesMessage(RuntimeError, "forbidden"):
+            async_to_sync(run)()
+        self.assertEqual(self.log, [("send", 1, "kept")])
+
+
+def slash_flow(command="hi", description="Say hi"):
+    return {
+        "nodes": [
+            node("s", "__slash__", (), ("ctx",), command=command, description=description, options=[]),
+            node("snd", "send", ["channel_id", "text"], (), text="hello"),
+        ],
+        "edges": [edge("s", "ctx", "snd", "channel_id")],
+    }
+
+
+class ValidateFlowTests(SimpleTestCase):
+    def issues(self, nodes=(), edges=(), **kwargs):
+        """``(issue codes, plan)`` of slash_flow() extended with *nodes* and *edges*"""
+        graph = slash_flow()
+        graph["nodes"] += nodes
+        graph["edges"] += edges
+        issues, plan = validate_flow({**graph, **kwargs.pop("graph", {})}, **kwargs)
+        return {(issue.code, issue.node_id) for issue in issues}, plan
+
+    def test_valid_flow_gets_a_plan(self):
+        issues, plan = validate_flow(slash_flow())
+        self.assertEqual(issues, [])
+        self.assertEqual(plan["order"], ["s", "snd"])
+        self.assertEqual(plan["digest"], flow_digest(slash_flow()))
+
+    def test_node_errors(self):
+        codes, plan = self.issues([node("snd", "to_lower", ["text"]), node("q", "nope")])
+        self.assertIsNone(plan)
+        self.assertLessEqual({("duplicate_node", "snd"), ("unknown_block", "q")}, codes)
+
+    def test_edge_errors(self):
+        codes, plan = self.issues(
+            [node("a", "to_lower", ["text"], text="X")],
+            [
+                edge("a", "output", "gone", "text"),
+                edge("s", "ctx", "a", "missing"),
+                edge("s", "nothing", "a", "text"),
+                edge("a", "output", "snd", "channel_id"),
+            ],
+        )
+        self.assertIsNone(plan)
+        self.assertLessEqual(
+            {("dangling_edge", "a"), ("unknown_port", "a"), ("unknown_port", "s"), ("duplicate_binding", "snd")},
+            codes,
+        )
+
+    def test_cycle(self):
+        codes, plan = self.issues(
+            [node("a", "to_lower", ["text"]), node("b", "to_lower", ["text"])],
+            [edge("a", "output", "b", "text"), edge("b", "output", "a", "text")],
+        )
+        self.assertIsNone(plan)
+        self.assertIn(("cycle", "a"), codes)
+
+    def test_type_errors(self):
+        codes, plan = self.issues(
+            [node("r", "random_int", ["low", "high"], high="many"), node("ed", "edit_message", ["message"])],
+            [edge("s", "ctx", "r", "low"), edge("s", "ctx", "ed", "message")],
+        )
+        self.assertIsNone(plan)
+        self.assertLessEqual({("type_conflict", "r"), ("unbound_port", "ed")}, codes)
+
+    def test_warnings_keep_the_plan(self):
+        issues, plan = validate_flow({"nodes": [node("a", "to_lower", ["text"], text="X")], "edges": []})
+        self.assertEqual([issue.code for issue in issues], ["no_trigger"])
+        self.assertIsNotNone(plan)
+
+        codes, plan = self.issues([node("a", "to_lower", ["text"], text="X")])
+        self.assertEqual(codes, {("unreachable", "a")})
+        self.assertIsNotNone(plan)
+
+    def test_sources_feeding_a_triggered_node_are_reachable(self):
+        codes, _ = self.issues([node("r", "random_int", ["low", "high"], low=1, high=6),
+                                node("l", "to_lower", ["text"])],
+                               [edge("r", "output", "l", "text"), edge("l", "output", "snd", "text")])
+        self.assertNotIn("unreachable", {code for code, _ in codes})
+
+    def test_max_concurrency_setting(self):
+        for cap in (0, -2, "3"):
+            with self.subTest(cap=cap):
+                codes, plan = self.issues(graph={"maxConcurrency": cap})
+                self.assertEqual(codes, {("bad_setting", None)})
+                self.assertIsNone(plan)
+        self.assertEqual(self.issues(graph={"maxConcurrency": 4}), (set(), self.issues()[1]))
+
+    def test_subflows(self):
+        call = node("sub", "__subflow__", ["go"], (), flowId=99)
+        codes, plan = self.issues([call], [edge("s", "ctx", "sub", "go")], subflows={})
+        self.assertIsNone(plan)
+        self.assertIn(("unknown_subflow", "sub"), codes)
+
+        child = {"nodes": [node("in", "__flow_input__", (), ("value",), name="go"), node("again", "__subflow__", flowId=1)],
+                 "edges": []}
+        codes, _ = self.issues([call], [edge("s", "ctx", "sub", "go")], graph={"flowId": 1}, subflows={99: child})
+        self.assertIn(("cycle", "sub"), codes)
+
+
+class FlowIndexTests(TestCase):
+    def test_reindex_backfills_hash_version_and_plan(self):
+        flow = Flows.objects.create(name="old", **slash_flow())
+        # as stored before content hashes, versions and plans were tracked
+        Flows.objects.filter(pk=flow.pk).update(content_hash="", version=0, plan=None)
+        FlowCommand.objects.all().delete()
+
+        call_command("reindexflows", stdout=io.StringIO())
+
+        flow.refresh_from_db()
+        self.assertEqual(len(flow.content_hash), 64)
+        self.assertEqual(flow.version, 1)
+        self.assertEqual(flow.plan["digest"], flow.content_hash)
+        self.assertEqual(list(flow.commands.values_list("name", flat=True)), ["hi"])
+
+    def test_reindex_leaves_current_flows_alone(self):
+        flow = Flows.objects.create(name="new", **slash_flow())
+        _, plan = validate_flow({**slash_flow(), "flowId": flow.pk})
+        Flows.objects.filter(pk=flow.pk).update(plan=plan)
+
+        call_command("reindexflows", stdout=io.StringIO())
+
+        flow.refresh_from_db()
+        self.assertEqual(flow.version, 1)
+        self.assertEqual(flow.commands.count(), 1)
+
+    def test_max_concurrency_is_saved(self):
+        client = Client()
+        response = client.post(
+            "/api/flows/", {**slash_flow(), "name": "capped", "maxConcurrency": 2}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        flow = client.get("/api/flows/").json()[0]
+        self.assertEqual(flow["maxConcurrency"], 2)
+        self.assertEqual(compile_graph(flow, COMPONENTS).max_concurrency, 2)
+
+        response = client.post(
+            "/api/flows/", {**slash_flow(), "name": "bad", "maxConcurrency": 0}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_long_command_names_are_rejected(self):
+        issues, plan = validate_flow(slash_flow(command="x" * 33, description="d" * 101))
+        self.assertIsNone(plan)
+        self.assertEqual(
+            [(i.code, i.port) for i in issues if i.code == "bad_command"],
+            [("bad_command", "command"), ("bad_command", "description")],
+        )
+
+        response = Client().post(
+            "/api/flows/", {**slash_flow(command="x" * 33), "name": "long"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["code"], "bad_command")
+        self.assertFalse(Flows.objects.exists())
+
+
+class FlowListingTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.ids = [Flows.objects.create(name=f"f{i}", **slash_flow(f"c{i}")).pk for i in range(5)]
+
+    def test_pages_follow_the_cursor(self):
+        first = self.client.get("/api/flows/?limit=2&fields=flowId,name").json()
+        self.assertEqual([f["flowId"] for f in first["results"]], self.ids[:2])
+        self.assertEqual(set(first["results"][0]), {"flowId", "name"})
+
+        second = self.client.get(f"/api/flows/?limit=2&cursor={first['next']}").json()
+        self.assertEqual([f["flowId"] for f in second["results"]], self.ids[2:4])
+        last = self.client.get(f"/api/flows/?limit=2&cursor={second['next']}").json()
+        self.assertEqual(([f["flowId"] for f in last["results"]], last["next"]), (self.ids[4:], None))
+
+    def test_bad_parameters(self):
+        for query in ("limit=0", "limit=x", "cursor=x", "fields=token", "updated_since=yesterday"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/flows/?{query}").status_code, 400)
+
+    def test_unchanged_listing_is_not_modified(self):
+        response = self.client.get("/api/flows/")
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        again = self.client.get("/api/flows/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], etag)
+        self.assertEqual(self.client.get("/api/flows/?limit=2", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_changes_on_edit_and_delete(self):
+        etag = self.client.get("/api/flows/")["ETag"]
+        flow = Flows.objects.get(pk=self.ids[0])
+        flow.name = "renamed"
+        flow.save()
+        edited = self.client.get("/api/flows/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(edited.status_code, 200)
+
+        Flows.objects.filter(pk=self.ids[-1]).delete()
+        deleted = self.client.get("/api/flows/", HTTP_IF_NONE_MATCH=edited["ETag"])
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual(len(deleted.json()), 4)
+
+        # If-Modified-Since alone can't notice deletions, so it is never answered with a 304
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get("/api/flows/", HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+
+class ComponentsViewTests(SimpleTestCase):
+    def test_unchanged_palette_is_not_modified(self):
+        client = Client()
+        response = client.get("/api/components/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("send", {c["code_id"] for c in response.json()})
+        etag = response["ETag"]
+
+        again = client.get("/api/components/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((again.status_code, again["ETag"], again.content), (304, etag, b""))
+        self.assertEqual(client.get("/api/components/", HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+
+class FlowViewParityTests(TestCase):
+    """FlowsView and AsyncFlowsView answer the same requests the same way"""
+
+    def exchange(self, view, method, data=None, query=""):
+        factory = RequestFactory()
+        if method == "get":
+            request = factory.get(f"/api/flows/{query}")
+        else:
+            request = getattr(factory, method)("/api/flows/", json.dumps(data), content_type="application/json")
+
+        handler = view.as_view()
+        if view.view_is_async:
+            response = async_to_sync(handler)(request)
+        else:
+            response = handler(request).render()
+        body = json.loads(response.content) if response.content else None
+        if isinstance(body, dict):
+            body.pop("flowId", None)
+            body.pop("updated_at", None)
+        return response.status_code, body
+
+    def session(self, view):
+        """Status and body of every step of a create → list → edit → delete session"""
+        created = self.exchange(view, "post", {"name": "a", **slash_flow()})
+        flow_id = Flows.objects.get().pk
+        return [
+            created,
+            self.exchange(view, "post", {"name": "a"}),
+            self.exchange(view, "get", query="?fields=name,version"),
+            self.exchange(view, "get", query="?limit=x"),
+            self.exchange(view, "put", {"flowId": flow_id, "name": "b", **slash_flow()}),
+            self.exchange(view, "put", {"name": "b"}),
+            self.exchange(view, "put", {"flowId": flow_id + 100, "name": "b", **slash_flow()}),
+            self.exchange(view, "delete", {"flowId": flow_id}),
+            self.exchange(view, "delete", {"flowId": flow_id}),
+        ]
+
+    def test_sync_and_async_views_agree(self):
+        sync_steps = self.session(FlowsView)
+        async_steps = self.session(AsyncFlowsView)
+        self.assertEqual([code for code, _ in sync_steps], [200, 400, 200, 400, 200, 400, 404, 204, 404])
+        self.assertEqual(async_steps, sync_steps)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class CronSpecTests(SimpleTestCase):
+    def next_after(self, expr, *moment):
+        return CronSpec.parse(expr).next_after(utc(*moment))
+
+    def test_every_minute_is_strictly_after(self):
+        self.assertEqual(self.next_after("* * * * *", 2026, 3, 1, 12, 0, 30), utc(2026, 3, 1, 12, 1))
+        self.assertEqual(self.next_after("* * * * *", 2026, 3, 1, 12, 1), utc(2026, 3, 1, 12, 2))
+
+    def test_steps_ranges_and_lists(self):
+        self.assertEqual(self.next_after("*/15 9-17 * * *", 2026, 3, 1, 17, 50), utc(2026, 3, 2, 9, 0))
+        self.assertEqual(self.next_after("0 8,20 * * *", 2026, 3, 1, 8, 0), utc(2026, 3, 1, 20, 0))
+
+    def test_year_rollover(self):
+        self.assertEqual(self.next_after("@yearly", 2026, 12, 31, 23, 59), utc(2027, 1, 1, 0, 0))
+        self.assertEqual(self.next_after("30 6 * 1 *", 2026, 2, 1, 0, 0), utc(2027, 1, 1, 6, 30))
+
+    def test_february_29(self):
+        self.assertEqual(self.next_after("0 0 29 2 *", 2026, 3, 1, 0, 0), utc(2028, 2, 29, 0, 0))
+        self.assertEqual(self.next_after("0 12 * * *", 2028, 2, 28, 13, 0), utc(2028, 2, 29, 12, 0))
+
+    def test_weekdays(self):
+        # 2026-10-18 is a Sunday
+        self.assertEqual(self.next_after("0 9 * * 1-5", 2026, 10, 17, 10, 0), utc(2026, 10, 19, 9, 0))
+        self.assertEqual(self.next_after("0 9 * * 7", 2026, 10, 17, 10, 0), utc(2026, 10, 18, 9, 0))
+
+    def test_day_and_weekday_either_matches(self):
+        # the 13th or any Friday, whichever comes first
+        self.assertEqual(self.next_after("0 12 13 * 5", 2026, 10, 18, 0, 0), utc(2026, 10, 23, 12, 0))
+
+    def test_invalid_expressions(self):
+        for expr in ("* * * *", "60 * * * *", "* * 0 * *", "*/0 * * * *", "a * * * *"):
+            with self.subTest(expr=expr), self.assertRaises(ValueError):
+                CronSpec.parse(expr)
+        with self.assertRaises(ValueError):
+            self.next_after("0 0 31 2 *", 2026, 1, 1, 0, 0)
+
+
+class SchedulerTests(SimpleTestCase):
+    def test_missed_fires_run_once_after_restart(self):
+        schedule = schedule_for(1, node("sc", "__schedule__", (), ("fired_at",), interval=60), None)
+        store = MemoryScheduleStore()
+        fired = []
+
+        async def restart():
+            async def run(s, fired_at):
+                fired.append(fired_at)
+
+            store.save_many("app", {schedule.key: (schedule.spec, utc(2026, 1, 1), None)})
+            scheduler = Scheduler(run, store, namespace="app")
+            await scheduler.load([schedule])
+            await scheduler.tick()
+            await asyncio.gather(*scheduler._tasks)
+            return scheduler.counts, store.load("app")[schedule.key][1]
+
+        counts, next_fire = async_to_sync(restart)()
+        self.assertEqual(fired, [utc(2026, 1, 1)])
+        self.assertEqual(counts["caught_up"], 1)
+        self.assertGreater(next_fire, datetime.now(timezone.utc))
+        self.assertLessEqual(next_fire, datetime.now(timezone.utc) + timedelta(seconds=60))
+
+
+class FlowSnapshotTests(SimpleTestCase):
+    def test_bots_sharing_a_snapshot_path_can_save_at_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "flows.json"
+            clients = [FlowClient(snapshot_path=path) for _ in range(8)]
+            errors = []
+
+            def save(client, i):
+                client.flows, client.etag = [{"flowId": i}], f'"{i}"'
+                try:
+                    for _ in range(20):
+                        client._save_snapshot()
+                except Exception as exc:
+                    errors.append(exc)
+
+            threads = [threading.Thread(target=save, args=(c, i)) for i, c in enumerate(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual([p.name for p in pathlib.Path(directory).iterdir()], ["flows.json"])
+            reader = FlowClient(snapshot_path=path)
+            self.assertEqual(len(reader.load_snapshot()), 1)
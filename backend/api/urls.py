@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import FlowsView, RunBotView
+from .views import AsyncFlowsView, CommandsView, ComponentsView, FlowsView, RunBotView
 
 urlpatterns = [
-    path('flows/', FlowsView.as_view(), name='flows'),
+    path('flows/', (AsyncFlowsView if settings.ASYNC_API else FlowsView).as_view(), name='flows'),
     path('run_bot/', RunBotView.as_view(), name='run_bot'),
+    path('components/', ComponentsView.as_view(), name='components'),
+    path('commands/', CommandsView.as_view(), name='commands'),
 ]
 
@@ -1,27 +1,174 @@
+import hashlib
+import json
+from typing import Dict, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Flows
-from .serializers import FlowSerializer
+from .graph_workspace.blocks import BLOCK_MODULES, registry
+from .graph_workspace.graph_runner import SUBFLOW
+from .graph_workspace.sharding import shard_ranges
+from .graph_workspace.validation import validate_flow
+from .models import BotJob, BotShard, FlowCommand, Flows
+from .serializers import BotJobSerializer, FlowSerializer
+
+# Columns that can be requested through ``?fields=``
+FLOW_FIELDS = ("flowId", "name", "nodes", "edges", "maxConcurrency", "content_hash", "version", "updated_at", "plan")
+MAX_PAGE_SIZE = 500
+
+
+class BadRequest(ValueError):
+    """A query parameter or request body the flow endpoints can't use"""
+
+
+def flow_listing(params) -> Tuple[QuerySet, Tuple[str, ...], int, bool]:
+    """Parse the listing query parameters (see :meth:`FlowsView.get`) into
+    ``(flows, fields, limit, paginate)``; nothing is queried yet"""
+    flows = Flows.objects.order_by("flowId")
+
+    fields = FLOW_FIELDS
+    if params.get("fields"):
+        fields = tuple(f.strip() for f in params["fields"].split(",") if f.strip())
+        unknown = set(fields) - set(FLOW_FIELDS)
+        if unknown:
+            raise BadRequest(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    if params.get("updated_since"):
+        since = parse_datetime(params["updated_since"])
+        if since is None:
+            raise BadRequest("updated_since must be an ISO-8601 datetime")
+        flows = flows.filter(updated_at__gt=since)
+
+    # index lookups on the tables Flows.save() maintains
+    if params.get("command"):
+        flows = flows.filter(commands__name=params["command"]).distinct()
+    for code_id in filter(None, (c.strip() for c in params.get("uses", "").split(","))):
+        flows = flows.filter(block_usages__code_id=code_id)
+    any_of = [c.strip() for c in params.get("uses_any", "").split(",") if c.strip()]
+    if any_of:
+        flows = flows.filter(block_usages__code_id__in=any_of).distinct()
+
+    paginate = "limit" in params or "cursor" in params
+    try:
+        limit = min(int(params.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if params.get("cursor"):
+            flows = flows.filter(flowId__gt=int(params["cursor"]))
+    except ValueError:
+        raise BadRequest("limit and cursor must be integers")
+    if limit < 1:
+        raise BadRequest("limit must be positive")
+    return flows, fields, limit, paginate
+
+
+def listing_version(full_path: str, versions: list) -> str:
+    """Strong ETag of a listing's ``(flowId, content_hash, updated_at)`` rows.
+
+    There is deliberately no Last-Modified: the newest ``updated_at`` doesn't
+    change when a flow is deleted, but the set of rows hashed here does.
+    """
+    digest = hashlib.sha256(full_path.encode("utf-8"))
+    for flow_id, content_hash, updated_at in versions:
+        digest.update(f"{flow_id}:{content_hash}:{updated_at.isoformat()};".encode("utf-8"))
+    return quote_etag(digest.hexdigest())
+
+
+def called_flows(nodes: list) -> Dict[int, dict]:
+    """``flowId → flow`` of every flow *nodes* call through sub-flow nodes,
+    directly or through other sub-flows"""
+    found: Dict[int, dict] = {}
+    pending = {n.get("flowId") for n in nodes if n.get("code_id") == SUBFLOW}
+    while pending:
+        rows = Flows.objects.filter(flowId__in=[i for i in pending if isinstance(i, int)])
+        pending = set()
+        for row in rows.values("flowId", "nodes", "edges"):
+            found[row["flowId"]] = row
+            pending |= {n.get("flowId") for n in row["nodes"] if n.get("code_id") == SUBFLOW}
+        pending -= found.keys()
+    return found
+
+
+def save_flow_data(data: dict, instance=None) -> Tuple[dict, int]:
+    """Validate and store a flow; return ``(body, status)`` for the response"""
+    data.pop('flowId', None)
+    serializer = FlowSerializer(instance, data=data)
+    if not serializer.is_valid():
+        return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+    # Reject flows that would fail at run time; keep the validated plan
+    graph = {**serializer.validated_data, "flowId": instance.pk if instance is not None else None}
+    issues, plan = validate_flow(graph, subflows=called_flows(graph["nodes"]))
+    if plan is None:
+        return {"errors": [issue._asdict() for issue in issues]}, status.HTTP_400_BAD_REQUEST
+
+    serializer.save(plan=plan)
+    return {**serializer.data, "warnings": [issue._asdict() for issue in issues]}, status.HTTP_200_OK
 
-from .graph_workspace import globals, runbot
 
 class FlowsView(APIView):
     @staticmethod
     def save_flow(request: Request, instance=None):
-        request.data.pop('flowId')
-        serializer = FlowSerializer(instance, data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        body, code = save_flow_data(request.data, instance)
+        return Response(body, status=code)
 
     def get(self, request, format=None):
-        flows = Flows.objects.all()
-        serializer = FlowSerializer(flows, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """List flows
+
+        Query parameters (all optional):
+
+        - ``fields``: comma separated columns to return, e.g. ``flowId,name``
+        - ``updated_since``: ISO-8601 timestamp; only flows saved after it
+          (deletions are not reported, do a full listing to notice those)
+        - ``command``: only flows registering this slash command
+        - ``uses``: comma separated ``code_id``s; only flows using all of them
+        - ``uses_any``: comma separated ``code_id``s; flows using at least one
+        - ``limit`` / ``cursor``: page through flows ordered by id; the
+          response becomes ``{"results": [...], "next": <cursor or null>}``
+
+        Responses carry a strong ``ETag`` derived from the stored content
+        hashes, so an unchanged listing is answered with a 304 (to
+        ``If-None-Match``) before any flow body is loaded.
+        """
+        try:
+            flows, fields, limit, paginate = flow_listing(request.query_params)
+        except BadRequest as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Cheap pass over the version columns only
+        versions = flows.values_list("flowId", "content_hash", "updated_at")
+        versions = list(versions[:limit + 1] if paginate else versions)
+        next_cursor = None
+        if paginate and len(versions) > limit:
+            versions = versions[:limit]
+            next_cursor = versions[-1][0]
+
+        etag = listing_version(request.get_full_path(), versions)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        rows = Flows.objects.filter(flowId__in=[v[0] for v in versions]).order_by("flowId")
+        rows = rows.only(*{"flowId", *fields})
+        data = FlowSerializer(rows, many=True, fields=fields).data
+        response = Response(
+            {"results": data, "next": next_cursor} if paginate else data,
+            status=status.HTTP_200_OK,
+        )
+        response["ETag"] = etag
+        return response
 
     def post(self, request: Request, format=None):
         return FlowsView.save_flow(request)
@@ -50,7 +197,171 @@ class FlowsView(APIView):
         except Flows.DoesNotExist:
             return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
 
+def _json(data, code: int = status.HTTP_200_OK) -> HttpResponse:
+    # same bytes DRF's Response would render
+    return HttpResponse(JSONRenderer().render(data), status=code, content_type="application/json")
+
+
+@method_decorator(csrf_exempt, name="dispatch")  # like APIView, which the builder already posts to
+class AsyncFlowsView(View):
+    """:class:`FlowsView` with async handlers and the async ORM, for ASGI servers
+
+    Reads never block a worker thread. Saves still run in a thread because
+    validation and the index rebuild share one transaction, which the async
+    ORM can't open.
+    """
+
+    async def _body(self, request) -> dict:
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            raise BadRequest("Request body must be JSON")
+        if not isinstance(data, dict):
+            raise BadRequest("Request body must be a JSON object")
+        return data
+
+    async def get(self, request):
+        try:
+            flows, fields, limit, paginate = flow_listing(request.GET)
+        except BadRequest as exc:
+            return _json({"error": str(exc)}, status.HTTP_400_BAD_REQUEST)
+
+        versions = flows.values_list("flowId", "content_hash", "updated_at")
+        versions = [v async for v in (versions[:limit + 1] if paginate else versions)]
+        next_cursor = None
+        if paginate and len(versions) > limit:
+            versions = versions[:limit]
+            next_cursor = versions[-1][0]
+
+        etag = listing_version(request.get_full_path(), versions)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        rows = Flows.objects.filter(flowId__in=[v[0] for v in versions]).order_by("flowId")
+        rows = [row async for row in rows.only(*{"flowId", *fields})]
+        data = FlowSerializer(rows, many=True, fields=fields).data
+        response = _json({"results": data, "next": next_cursor} if paginate else data)
+        response["ETag"] = etag
+        return response
+
+    async def post(self, request):
+        try:
+            data = await self._body(request)
+        except BadRequest as exc:
+            return _json({"error": str(exc)}, status.HTTP_400_BAD_REQUEST)
+        return _json(*await sync_to_async(save_flow_data)(data))
+
+    async def put(self, request):
+        try:
+            data = await self._body(request)
+        except BadRequest as exc:
+            return _json({"error": str(exc)}, status.HTTP_400_BAD_REQUEST)
+        if not data.get("flowId"):
+            return _json({"error": "ID is required in payload."}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            instance = await Flows.objects.aget(pk=data["flowId"])
+        except Flows.DoesNotExist:
+            return _json({"error": "Not found"}, status.HTTP_404_NOT_FOUND)
+        return _json(*await sync_to_async(save_flow_data)(data, instance))
+
+    async def delete(self, request):
+        try:
+            data = await self._body(request)
+        except BadRequest as exc:
+            return _json({"error": str(exc)}, status.HTTP_400_BAD_REQUEST)
+        if not data.get("flowId"):
+            return _json({"error": "Flow ID required"}, status.HTTP_400_BAD_REQUEST)
+
+        deleted, _ = await Flows.objects.filter(pk=data["flowId"]).adelete()
+        if not deleted:
+            return _json({"error": "Not found"}, status.HTTP_404_NOT_FOUND)
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+class ComponentsView(APIView):
+    """Builder palette: every block registered by the modules in ``BLOCK_MODULES``"""
+
+    def get(self, request: Request, format=None):
+        # Encoded once per process (and again only if a block registers later)
+        body, etag = registry.payload(BLOCK_MODULES)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"  # always revalidate; a 304 is cheap
+        return response
+
+class CommandsView(APIView):
+    """Slash commands registered by saved flows, without loading the flows"""
+
+    def get(self, request: Request, format=None):
+        commands = FlowCommand.objects.order_by("name", "flow_id")
+        if request.query_params.get("name"):
+            commands = commands.filter(name=request.query_params["name"])
+        rows = commands.values("name", "description", "node_id", "flow_id", "flow__version")
+        data = [
+            {
+                "name": row["name"],
+                "description": row["description"],
+                "flowId": row["flow_id"],
+                "node_id": row["node_id"],
+                "version": row["flow__version"],
+            }
+            for row in rows
+        ]
+        return Response(data, status=status.HTTP_200_OK)
+
 class RunBotView(APIView):
+    """Ask the bot supervisor (``manage.py runbots``) to start, stop or report on bots"""
+
+    def get(self, request: Request, format=None):
+        jobs = BotJob.objects.order_by("jobId")
+        if request.query_params.get("jobId"):
+            jobs = jobs.filter(pk=request.query_params["jobId"])
+        return Response(BotJobSerializer(jobs, many=True).data, status=status.HTTP_200_OK)
+
     def post(self, request: Request, format=None):
-        globals.TOKEN = request.data['token']
-        runbot.FlowBot().run(globals.TOKEN)
+        """Start a bot; ``shard_count`` + ``shard_workers`` split it across supervisors"""
+        token = request.data.get("token")
+        if not token:
+            return Response({"error": "Token is required in payload."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            shard_count = request.data.get("shard_count")
+            shard_count = int(shard_count) if shard_count is not None else None
+            workers = int(request.data.get("shard_workers", 1))
+            if shard_count is None and workers != 1:
+                raise ValueError("shard_count is required to split a bot across workers")
+            layout = shard_ranges(shard_count, workers) if shard_count else [None]
+        except (TypeError, ValueError) as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            job, created = BotJob.objects.select_for_update().get_or_create(token=token)
+            current = list(job.shards.order_by("pk").values_list("shard_ids", flat=True))
+            if current != layout:
+                job.shards.all().delete()
+                BotShard.objects.bulk_create(BotShard(job=job, shard_ids=ids) for ids in layout)
+            elif job.desired_state != BotJob.State.RUNNING:
+                job.shards.update(status=BotJob.State.PENDING, error="")
+
+            job.desired_state = BotJob.State.RUNNING
+            job.shard_count = shard_count
+            job.save()
+        return Response(BotJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    def delete(self, request: Request, format=None):
+        jobId = request.data.get("jobId")
+        if not jobId:
+            return Response({"error": "Job ID required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = BotJob.objects.filter(pk=jobId).update(desired_state=BotJob.State.STOPPED)
+        if not updated:
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_202_ACCEPTED)
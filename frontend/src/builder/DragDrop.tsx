@@ -21,20 +21,38 @@ interface DragDropAreaProps {
   pageName: string;
 }
 
-const palette: Component_[] = [
-  {
-    code_id: '__slash__',
-    label: 'Slash Command',
-    doc: 'Discord slash command entry-point',
-    inputs: [],                   // none
-    outputs: [
-      { name: 'ctx',   type: 'Interaction', desc: 'discord.py interaction' }
-    ]
-  },
-  ...componentsList as unknown as Component_[]
-];
+const slashComponent: Component_ = {
+  code_id: '__slash__',
+  label: 'Slash Command',
+  doc: 'Discord slash command entry-point',
+  inputs: [],                   // none
+  outputs: [
+    { name: 'ctx',   type: 'Interaction', desc: 'discord.py interaction' }
+  ]
+};
+
+/* bundled copy, used until (or if) /api/components answers */
+const bundledPalette: Component_[] = [slashComponent, ...componentsList as unknown as Component_[]];
 
 const DragDropArea: React.FC<DragDropAreaProps> = ({ pageName }) => {
+  /* ---------- block palette (served with an ETag, so revisits are a 304) ---------- */
+  const [palette, setPalette] = useState<Component_[]>(bundledPalette);
+
+  useEffect(() => {
+    const fetchPalette = async () => {
+      try {
+        const response = await fetch('/api/components/');
+        if (!response.ok) return;
+        const data: Component_[] = await response.json();
+        setPalette([slashComponent, ...data]);
+      } catch {
+        /* keep the bundled palette */
+      }
+    };
+
+    fetchPalette();
+  }, []);
+
   /* ---------- canvas state ---------- */
   const [droppedComponents, setDroppedComponents] = useState<(DroppedComponent_|StartComponent)[]>([]);
   const [draggingId, setDraggingId] = useState<string | null>(null);
@@ -309,7 +327,8 @@ const DragDropArea: React.FC<DragDropAreaProps> = ({ pageName }) => {
             } else {
               const error = await response.json();
               console.error(error);
-              alert('Failed to save flow.');
+              const problems = (error.errors ?? []).map((e: { message: string }) => `• ${e.message}`);
+              alert(problems.length ? `Failed to save flow:\n${problems.join("\n")}` : 'Failed to save flow.');
             }
           } catch (error) {
             console.error(error);